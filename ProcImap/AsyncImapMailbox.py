@@ -0,0 +1,428 @@
+############################################################################
+#    Copyright (C) 2008 by Michael Goerz                                   #
+#    http://www.physik.fu-berlin.de/~goerz                                 #
+#                                                                          #
+#    This program is free software; you can redistribute it and#or modify  #
+#    it under the terms of the GNU General Public License as published by  #
+#    the Free Software Foundation; either version 3 of the License, or     #
+#    (at your option) any later version.                                   #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU General Public License     #
+#    along with this program; if not, write to the                         #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+############################################################################
+
+""" This module provides the AsyncImapMailbox class, the asyncio
+    counterpart of ImapMailbox. It offers the most important methods of
+    ImapMailbox as coroutines, on top of an AsyncImapServer.
+
+    This module requires Python 3.5 or later.
+"""
+
+import asyncio
+from email.generator import Generator
+from io import StringIO
+
+from ProcImap.AsyncImapServer import AsyncImapServer, quote
+from ProcImap.ImapMailbox import ImapNotOkError, ReadOnlyError
+from ProcImap.ImapMailbox import ServerNotAvailableError
+from ProcImap.ImapMailbox import METADATA_FETCH_ITEMS, _fix_fromline
+from ProcImap.ImapMessage import ImapMessage
+from ProcImap.ImapResponse import ResponseParseError
+from ProcImap.ImapResponse import parse_fetch_response, get_body_item
+from ProcImap.ImapResponse import internaldate_to_tuple, get_response_code
+from ProcImap.ImapResponse import parse_copyuid, parse_esearch_response
+from ProcImap.ImapSequenceSet import UIDSet, split_sequence_set
+from ProcImap.ImapSequenceSet import expand_sequence_set
+
+
+class AsyncImapMailbox:
+    """ A mailbox on an IMAP Server, accessed through an AsyncImapServer.
+
+        The methods mirror those of ImapMailbox with the same names, but are
+        coroutines. Since a coroutine cannot be called from __init__, the
+        mailbox has to be opened with the open coroutine before it is
+        used:
+
+            >>> server = AsyncImapServer('localhost', 'user', 'secret')
+            >>> mailbox = AsyncImapMailbox((server, 'INBOX'))
+            >>> await mailbox.open()
+            >>> uids = await mailbox.get_unseen_uids()
+
+        The methods of one mailbox may be called concurrently (e.g. with
+        asyncio.gather); their commands are then pipelined on the
+        connection of the server. Every mailbox needs its own instance of
+        AsyncImapServer, but one event loop can drive any number of them.
+
+        The class specific attributes are:
+
+        name             name of the mailbox (readonly)
+        server           AsyncImapServer object (readonly)
+        trash            Trash folder (name of a mailbox on the same server),
+                         or None
+        readonly         True if mailbox is readonly, false otherwise
+
+        The 'trash' and 'readonly' attributes have the same meaning as for
+        ImapMailbox.
+    """
+    def __init__(self, path, factory=ImapMessage, readonly=False):
+        """ Initialize an AsyncImapMailbox
+            path is a tuple with two elements, consisting of
+            1) an instance of AsyncImapServer in any state
+            2) the name of a mailbox on the server as a string
+            The 'factory' parameter determines to which type the
+            messages in the mailbox should be converted.
+            The mailbox is selected by the open coroutine.
+        """
+        self._factory = factory
+        try:
+            (server, name) = path
+        except (TypeError, ValueError):
+            raise TypeError("path must be a tuple, consisting of an "\
+                            + " instance of AsyncImapServer and a string")
+        if not isinstance(server, AsyncImapServer) \
+        or not isinstance(name, str):
+            raise TypeError("path must be a tuple, consisting of an "\
+                            + " instance of AsyncImapServer and a string")
+        if hasattr(server, 'locked') and server.locked:
+            raise ServerNotAvailableError("This instance of AsyncImapServer"\
+                                + " is already in use for another mailbox")
+        self._server = server
+        self._name = name
+        self.trash = None
+        self.readonly = readonly
+        server.locked = True
+
+    name = property(lambda self: self._name, None,
+                    doc="Name of the mailbox on the server")
+
+    server = property(lambda self: self._server, None,
+            doc="Instance of the AsyncImapServer that is being used as a backend")
+
+    async def open(self, create=True):
+        """ Log in to the server if necessary, and select the mailbox.
+            If the mailbox does not exist, it is created unless create is
+            set to False, in which case NoSuchMailboxError is raised.
+        """
+        await self._server.select(self._name, create)
+
+    async def search(self, criteria='ALL', charset=None, as_set=False):
+        """ Return a sorted list of all the UIDs in the mailbox that match
+            the search criteria, or a ProcImap.ImapSequenceSet.UIDSet if
+            as_set is True. See ImapMailbox.search.
+        """
+        if charset is not None:
+            charset = "CHARSET %s" % charset
+        if self._server.has_capability('ESEARCH'):
+            response = await self._server.uid_response('search',
+                                    'RETURN (ALL)', charset, "(%s)" % criteria)
+            if response.code != 'OK':
+                raise ImapNotOkError("%s in search" % response.code)
+            try:
+                result = parse_esearch_response(response.data('ESEARCH'))
+            except ResponseParseError:
+                raise ImapNotOkError("received unparsable response.")
+            uids = result.get('ALL', UIDSet())
+        else:
+            (code, data) = await self._server.uid('search', charset,
+                                                  "(%s)" % criteria)
+            if code != 'OK':
+                raise ImapNotOkError("%s in search" % code)
+            try:
+                uids = UIDSet(int(uid) for uid in (data[0] or b'').split())
+            except ValueError:
+                raise ImapNotOkError("received unparsable response.")
+        if as_set:
+            return uids
+        return list(uids)
+
+    async def get_unseen_uids(self):
+        """ Get a list of all the unseen UIDs in the mailbox
+            Equivalent to search("UNSEEN UNDELETED")
+        """
+        return await self.search("UNSEEN UNDELETED")
+
+    async def get_all_uids(self):
+        """ Get a list of all the undeleted UIDs in the mailbox.
+            Equivalent to search("UNDELETED")
+        """
+        return await self.search("UNDELETED")
+
+    async def _fetch(self, uids, items):
+        """ Fetch the data items (a string such as 'FLAGS RFC822.SIZE') of
+            the messages in uids (a UID or a sequence set) with a single
+            UID FETCH command. Return a dict mapping UIDs to dicts of data
+            items, see ImapResponse.parse_fetch_response.
+        """
+        (code, data) = await self._server.uid('fetch', str(uids),
+                                              "(UID %s)" % items)
+        if code != 'OK':
+            raise ImapNotOkError("%s in fetch(%s, %s)" % (code, uids, items))
+        try:
+            return parse_fetch_response(data)
+        except ResponseParseError:
+            raise ImapNotOkError("received unparsable response.")
+
+    def _message_from_items(self, rfc822string, items):
+        """ Return a message created from rfc822string, with the imap flags,
+            internal date and size taken from the data items returned by
+            _fetch. The message is converted by the factory of the mailbox.
+        """
+        result = ImapMessage(rfc822string)
+        result.set_imapflags(items.get('FLAGS') or [])
+        if items.get('INTERNALDATE') is not None:
+            result.internaldate = internaldate_to_tuple(items['INTERNALDATE'])
+        result.size = int(items.get('RFC822.SIZE') or 0)
+        if self._factory is ImapMessage:
+            return result
+        return self._factory(result)
+
+    async def get_message(self, uid):
+        """ Return an ImapMessage object created from the message with UID.
+            Raise KeyError if there if there is no message with that UID.
+            The message text, imap flags, internal date and size are
+            fetched in a single round trip.
+        """
+        response = await self._fetch(uid, METADATA_FETCH_ITEMS + " BODY.PEEK[]")
+        items = response.get(int(uid))
+        if items is None or get_body_item(items) is None:
+            raise KeyError("No message %s in get_message" % uid)
+        return self._message_from_items(_fix_fromline(get_body_item(items)),
+                                        items)
+
+    async def get_messages(self, uids):
+        """ Return a dict that maps the UIDs in the iterable 'uids' to
+            messages, as returned by get_message. The messages are fetched
+            with one UID FETCH command per chunk of UIDs (see
+            ImapSequenceSet.split_sequence_set); the commands are
+            pipelined. UIDs for which there is no message are not included
+            in the result.
+        """
+        responses = await asyncio.gather(*[
+                       self._fetch(sequenceset,
+                                   METADATA_FETCH_ITEMS + " BODY.PEEK[]")
+                       for sequenceset in split_sequence_set(uids)])
+        result = {}
+        for response in responses:
+            for (uid, items) in response.items():
+                rfc822string = get_body_item(items)
+                if rfc822string is not None:
+                    result[uid] = self._message_from_items(
+                                            _fix_fromline(rfc822string), items)
+        return result
+
+    async def get_imapflags(self, uid):
+        """ Return a list of imap flags for the message with UID
+            Raise KeyError if there if there is no message with that UID.
+        """
+        items = (await self._fetch(uid, 'FLAGS')).get(int(uid))
+        if items is None:
+            raise KeyError("No message %s in get_imapflags" % uid)
+        return list(items.get('FLAGS') or [])
+
+    async def _store(self, uids, command, flags):
+        """ Send UID STORE commands with the given command ('+FLAGS',
+            '-FLAGS', or 'FLAGS') and flags for all messages in uids, one
+            per chunk of UIDs. The commands are pipelined.
+        """
+        if isinstance(flags, str):
+            flags = [flags]
+        flagstring = "(%s)" % ' '.join(flags)
+        responses = await asyncio.gather(*[
+                       self._server.uid('store', sequenceset,
+                                        command + '.SILENT', flagstring)
+                       for sequenceset in split_sequence_set(uids)])
+        for (code, data) in responses:
+            if code != 'OK':
+                raise ImapNotOkError("%s in %s %s: %s" \
+                                             % (code, command, flagstring, data))
+
+    async def add_imapflag(self, uid, *flags):
+        """ Add imap flags to message with UID.
+        """
+        await self.add_imapflag_many([uid], *flags)
+
+    async def remove_imapflag(self, uid, *flags):
+        """ Remove imap flags from message with UID
+        """
+        await self.remove_imapflag_many([uid], *flags)
+
+    async def set_imapflags(self, uid, flags):
+        """ Set imap flags for message with UID
+            flags must be an iterable of flags, or a string.
+            If flags is a string, it is taken as the single flag
+            to be set.
+        """
+        await self.set_imapflags_many([uid], flags)
+
+    async def add_imapflag_many(self, uids, *flags):
+        """ Add imap flags to all messages with UIDs in the iterable uids """
+        if self.readonly:
+            raise ReadOnlyError(
+                      "Tried to add imap flag for messages in read-only mailbox")
+        await self._store(uids, '+FLAGS', flags)
+
+    async def remove_imapflag_many(self, uids, *flags):
+        """ Remove imap flags from all messages with UIDs in the iterable
+            uids
+        """
+        if self.readonly:
+            raise ReadOnlyError(
+                  "Tried to remove imap flag from messages in read-only mailbox")
+        await self._store(uids, '-FLAGS', flags)
+
+    async def set_imapflags_many(self, uids, flags):
+        """ Set imap flags for all messages with UIDs in the iterable uids.
+            flags may be given as for set_imapflags.
+        """
+        if self.readonly:
+            raise ReadOnlyError(
+                     "Tried to set imap flags for messages in read-only mailbox")
+        await self._store(uids, 'FLAGS', flags)
+
+    async def add(self, message):
+        """ Add the message to mailbox. The message can be given in any
+            form accepted by ImapMailbox.add. Return the UID of the message
+            that was added, as reported by servers that support the UIDPLUS
+            extension (RFC4315), or None for other servers.
+            Raise ImapNotOkError if a non-OK response is received from
+            the server
+        """
+        if self.readonly:
+            raise ReadOnlyError("Tried to add to a read-only mailbox")
+        message = ImapMessage(message)
+        memoryfile = StringIO()
+        generator = Generator(memoryfile, mangle_from_=False)
+        generator.flatten(message)
+        (code, data) = await self._server.append(self._name,
+                                    message.flagstring(),
+                                    message.internaldate, memoryfile.getvalue())
+        if code != 'OK':
+            raise ImapNotOkError("%s in add: %s" % (code, data))
+        appenduid = get_response_code(data, 'APPENDUID')
+        if appenduid is None or len(appenduid) != 2:
+            return None
+        try:
+            return expand_sequence_set(appenduid[1])[0]
+        except (ValueError, IndexError):
+            return None
+
+    def _target_name(self, targetmailbox):
+        """ Return the name of targetmailbox, which must be the name of a
+            mailbox or an AsyncImapMailbox on the same server
+        """
+        if isinstance(targetmailbox, AsyncImapMailbox):
+            if targetmailbox.server != self._server:
+                raise ValueError("targetmailbox must be on the same server")
+            return targetmailbox.name
+        if isinstance(targetmailbox, str):
+            return targetmailbox
+        raise TypeError("targetmailbox in copy is of unknown type.")
+
+    async def _uid_copy_many(self, command, uids, targetmailbox):
+        """ Send a UID COPY or UID MOVE command (depending on 'command') for
+            every chunk of uids, and return a dict mapping the UIDs to the
+            target UIDs reported in COPYUID responses
+        """
+        targetmailbox = quote(targetmailbox)
+        responses = await asyncio.gather(*[
+                       self._server.uid_response(command, sequenceset,
+                                                 targetmailbox)
+                       for sequenceset in split_sequence_set(uids)])
+        result = {}
+        for response in responses:
+            if response.code != 'OK':
+                raise ImapNotOkError("%s in %s: %s" \
+                                     % (response.code, command, response.text))
+            try:
+                result.update(parse_copyuid(response.data('COPYUID')))
+            except ResponseParseError:
+                pass # target UIDs remain unknown
+        return result
+
+    async def copy(self, uid, targetmailbox):
+        """ Copy the message with UID to the targetmailbox (the name of a
+            mailbox on the same server, or an AsyncImapMailbox on the same
+            server), and return the UID of the copy if the server reports
+            it (UIDPLUS extension), or None otherwise.
+        """
+        return (await self.copy_many([uid], targetmailbox))[int(uid)]
+
+    async def copy_many(self, uids, targetmailbox):
+        """ Copy all messages with UIDs in the iterable uids to the
+            targetmailbox, and return a dict that maps each of the UIDs to
+            the UID of the copy, or to None if it is unknown. See copy.
+        """
+        uids = UIDSet(uids)
+        result = dict.fromkeys(uids)
+        result.update(await self._uid_copy_many('copy', uids,
+                                                self._target_name(targetmailbox)))
+        return result
+
+    async def move(self, uid, targetmailbox):
+        """ Move the message with UID to the targetmailbox, and return the
+            UID in the targetmailbox if it is known. See copy.
+        """
+        return (await self.move_many([uid], targetmailbox))[int(uid)]
+
+    async def move_many(self, uids, targetmailbox):
+        """ Move all messages with UIDs in the iterable uids to the
+            targetmailbox, and return a dict that maps each of the UIDs to
+            the UID in the targetmailbox, or to None if it is unknown.
+            If the server supports the MOVE extension (RFC6851), UID MOVE
+            commands are used. Otherwise, the messages are copied, and then
+            flagged as \\Deleted in this mailbox.
+        """
+        if self.readonly:
+            raise ReadOnlyError("Tried to move message from read-only mailbox")
+        uids = UIDSet(uids)
+        targetmailbox = self._target_name(targetmailbox)
+        if targetmailbox == self._name:
+            return dict(zip(uids, uids))
+        if self._server.has_capability('MOVE'):
+            result = dict.fromkeys(uids)
+            result.update(await self._uid_copy_many('move', uids,
+                                                    targetmailbox))
+        else:
+            result = await self.copy_many(uids, targetmailbox)
+            await self.add_imapflag_many(uids, "\\Deleted")
+        return result
+
+    async def discard(self, uid):
+        """ If trash folder is defined, move the message with UID to
+            trash and return its UID there (if known); else, just add the
+            \\Deleted flag to the message with UID and return None.
+        """
+        if self.readonly:
+            raise ReadOnlyError("Tried to discard from read-only mailbox")
+        if self.trash is None:
+            await self.add_imapflag(uid, "\\Deleted")
+            return None
+        return await self.move(uid, self.trash)
+
+    async def expunge(self):
+        """ Expunge the mailbox (delete all messages marked for deletion)"""
+        if self.readonly:
+            raise ReadOnlyError("Tried to expunge read-only mailbox")
+        (code, data) = await self._server.expunge()
+        if code != 'OK':
+            raise ImapNotOkError("%s in expunge: %s" % (code, data))
+
+    async def close(self):
+        """ Close the mailbox and log out of the server """
+        await self._server.close()
+        await self._server.disconnect()
+        if hasattr(self._server, 'locked'):
+            del self._server.locked
+
+    def __len__(self):
+        """ Return a count of messages in the mailbox, as tracked by the
+            server from the EXISTS and EXPUNGE responses
+        """
+        return self._server.exists or 0
@@ -0,0 +1,603 @@
+############################################################################
+#    Copyright (C) 2008 by Michael Goerz                                   #
+#    http://www.physik.fu-berlin.de/~goerz                                 #
+#                                                                          #
+#    This program is free software; you can redistribute it and#or modify  #
+#    it under the terms of the GNU General Public License as published by  #
+#    the Free Software Foundation; either version 3 of the License, or     #
+#    (at your option) any later version.                                   #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU General Public License     #
+#    along with this program; if not, write to the                         #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+############################################################################
+
+""" This module contains the AsyncImapServer class, a counterpart of
+    ImapServer for asyncio. Instead of a blocking socket (and, with
+    imaplib2, three threads) per connection, every connection is driven by
+    a single task on the event loop, so that one process can keep
+    thousands of connections open.
+
+    The IMAP protocol is implemented directly on top of asyncio streams,
+    since neither imaplib nor imaplib2 can be used without blocking. The
+    responses are returned in the same form as by imaplib, so that they can
+    be parsed with the functions in ProcImap.ImapResponse.
+
+    This module requires Python 3.5 or later. It is not imported by any of
+    the other modules of ProcImap.
+"""
+
+import asyncio
+import re
+from collections import OrderedDict
+from imaplib import Time2Internaldate
+from ssl import create_default_context
+
+from ProcImap.ImapServer import ClosedMailboxError, NoSuchMailboxError
+from ProcImap.ImapServer import LITERAL_MINUS_MAX
+
+_MAP_CRLF = re.compile(b'\r\n|\r|\n')
+_LITERAL = re.compile(br'\{(?P<size>\d+)\}$')
+_UNTAGGED_STATUS = re.compile(
+                   br'\* (?P<data>\d+) (?P<type>[A-Za-z-]+)(?: (?P<data2>.*))?$')
+_UNTAGGED = re.compile(br'\* (?P<type>[A-Za-z-]+)(?: (?P<data>.*))?$')
+_TAGGED = re.compile(br'(?P<tag>\S+) (?P<type>[A-Za-z]+)(?: (?P<data>.*))?$')
+_RESPONSE_CODE = re.compile(br'\[(?P<type>[A-Za-z-]+)(?: (?P<data>[^\]]*))?\]')
+_ATOM = re.compile(r'^[^\s"\\(){%*\]]+$')
+
+
+class AsyncImapError(Exception):
+    """ Raised if the connection to the server cannot be established, or is
+        lost, or if the server refuses the login
+    """
+    pass
+
+
+class Literal(bytes):
+    """ A command argument that is sent as an IMAP literal. It is sent
+        without waiting for a continuation request if the server allows
+        it (see AsyncImapServer.nonsync_literal).
+    """
+    pass
+
+
+def quote(value):
+    """ Return value (e.g. a mailbox name) as an IMAP atom if possible, or
+        as a quoted string otherwise
+    """
+    if _ATOM.match(value):
+        return value
+    return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+class _Response:
+    """ The responses to a single command.
+
+        Public attributes are:
+        code            'OK', 'NO' or 'BAD'
+        text            text of the tagged response, e.g.
+                        b'[APPENDUID 38505 3955] APPEND completed'
+        untagged        dict that maps the names of untagged responses and
+                        response codes (e.g. 'FETCH', 'EXISTS', 'COPYUID')
+                        to the lists of their data, as in the
+                        untagged_responses attribute of imaplib
+    """
+    def __init__(self):
+        self.code = None
+        self.text = b''
+        self.untagged = {}
+
+    def data(self, name):
+        """ Return the list of data of the untagged responses 'name', or
+            [None] if there are none (like imaplib's response method)
+        """
+        return self.untagged.get(name.upper(), [None])
+
+
+class AsyncImapServer:
+    """ A connection to an imap server, driven by asyncio.
+
+        Public attributes are:
+        servername      address of the server
+        username        authentication username
+        password        authentication password
+        port            server port
+        ssl             True if the connection uses SSL
+        capabilities    list of the capabilities of the server (upper case)
+        mailboxname     currently active mailbox on the server
+        uidvalidity     UIDVALIDITY of the currently active mailbox, or None
+        exists          number of messages in the currently active mailbox,
+                        or None if unknown
+
+        All methods that talk to the server are coroutines. They may be
+        called concurrently on the same instance: the commands are sent in
+        the order of the calls, without waiting for the responses to
+        earlier commands, and every coroutine returns when the response to
+        its own command arrives. Since IMAP servers respond in order, the
+        untagged responses that arrive before the tagged response of the
+        oldest command in flight are attributed to that command.
+
+        The 'exists' attribute is updated from the untagged EXISTS and
+        EXPUNGE responses as they arrive.
+
+        Example:
+            >>> server = AsyncImapServer('localhost', 'user', 'secret')
+            >>> await server.login()
+            >>> await server.select('INBOX')
+    """
+
+    def __init__(self, servername, username, password, ssl=True, port=None):
+        """ Initialize the server. Unlike ImapServer, the connection is not
+            opened here, but by the connect or login coroutines.
+            If you leave the port unspecified, the default port will be
+            used. This is port 143 is ssl is disabled, and port 993 if ssl
+            is enabled.
+        """
+        self.servername = servername
+        self.username = username
+        self.password = password
+        self.port = port
+        self.ssl = ssl
+        self.capabilities = []
+        self.mailboxname = None
+        self.uidvalidity = None
+        self.exists = None
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._send_lock = None
+        self._continuation = None
+        self._tagnum = 0
+        self._pending = OrderedDict() # tag -> (future, _Response)
+        self._unsolicited = _Response() # untagged responses without command
+        self._logged_in = False
+
+    def clone(self):
+        """ Return a new, unconnected instance of AsyncImapServer that
+            points to the same server
+        """
+        return AsyncImapServer(self.servername, self.username,
+                               self.password, self.ssl, self.port)
+
+    async def connect(self):
+        """ Connect to servername and read the capabilities of the server """
+        context = None
+        if self.ssl:
+            context = create_default_context()
+            if self.port is None:
+                self.port = 993
+        elif self.port is None:
+            self.port = 143
+        try:
+            (self._reader, self._writer) = await asyncio.open_connection(
+                                    self.servername, self.port, ssl=context)
+            greeting = await self._reader.readline()
+        except (OSError, EOFError) as data:
+            raise AsyncImapError("cannot connect to %s: %s"
+                                 % (self.servername, data))
+        if not greeting.startswith(b'* OK'):
+            self._writer.close()
+            self._writer = None
+            raise AsyncImapError("unexpected greeting: %r" % greeting)
+        self._send_lock = asyncio.Lock()
+        self._reader_task = asyncio.ensure_future(self._read_responses())
+        await self.capability()
+
+    async def disconnect(self):
+        """ Disconnect from the server
+            If logged in, log out
+        """
+        if self._writer is None:
+            return
+        if self._logged_in:
+            await self.logout()
+        self._writer.close()
+        self._writer = None
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        self._fail_pending("disconnected")
+
+    async def login(self):
+        """ Identify the client using a plaintext password.
+            Connect to the server if not connected already.
+            Raise AsyncImapError if the server refuses the login.
+        """
+        if self._writer is None:
+            await self.connect()
+        if self._logged_in:
+            return ('OK', [b'already logged in'])
+        response = await self.command('LOGIN', quote(self.username),
+                                      quote(self.password))
+        if response.code != 'OK':
+            raise AsyncImapError("login failed: %s" % response.text)
+        self._logged_in = True
+        if 'CAPABILITY' not in response.untagged:
+            await self.capability() # may have changed after login
+        return (response.code, [response.text])
+
+    async def reconnect(self):
+        """ Close and then reopen the connection to the server """
+        try:
+            await self.disconnect()
+        except (AsyncImapError, OSError):
+            pass
+        self._logged_in = False
+        await self.connect()
+
+    async def logout(self):
+        """ Shutdown connection to server. Returns server "BYE"
+            response.
+        """
+        self._logged_in = False
+        self.mailboxname = None
+        response = await self.command('LOGOUT')
+        return (response.code, response.data('BYE'))
+
+    async def capability(self):
+        """ Request the capabilities of the server, and store them in the
+            'capabilities' attribute
+        """
+        response = await self.command('CAPABILITY')
+        return (response.code, response.data('CAPABILITY'))
+
+    def has_capability(self, name):
+        """ Return True if the server announced the capability 'name'
+            (e.g. 'UIDPLUS') in its CAPABILITY response
+        """
+        return name.upper() in self.capabilities
+
+    def nonsync_literal(self, size):
+        """ Return True if a literal of 'size' bytes may be sent without
+            waiting for a continuation request, i.e. if the server supports
+            LITERAL+, or LITERAL- and size does not exceed LITERAL_MINUS_MAX
+            (RFC7888)
+        """
+        if self.has_capability('LITERAL+'):
+            return True
+        return self.has_capability('LITERAL-') and size <= LITERAL_MINUS_MAX
+
+    async def command(self, name, *args):
+        """ Send the command 'name' with the given arguments, and return
+            its responses (a _Response instance) once the tagged response
+            has arrived. The arguments are strings or bytes, which are sent
+            verbatim (see the quote function), or instances of Literal.
+            Arguments that are None are left out.
+            Raise AsyncImapError if the connection is lost.
+        """
+        if self._writer is None:
+            raise AsyncImapError("not connected")
+        if self._reader_task is not None and self._reader_task.done():
+            raise AsyncImapError("connection lost")
+        loop = asyncio.get_event_loop()
+        self._tagnum += 1
+        tag = ('P%03d' % self._tagnum).encode('ascii')
+        response = _Response()
+        future = loop.create_future()
+        async with self._send_lock:
+            self._pending[tag] = (future, response)
+            line = tag + b' ' + name.encode('ascii')
+            for arg in args:
+                if arg is None:
+                    continue
+                if isinstance(arg, Literal):
+                    if self.nonsync_literal(len(arg)):
+                        self._writer.write(line + b' {%d+}\r\n' % len(arg))
+                    else:
+                        self._continuation = loop.create_future()
+                        self._writer.write(line + b' {%d}\r\n' % len(arg))
+                        await asyncio.wait([self._continuation, future],
+                                           return_when=asyncio.FIRST_COMPLETED)
+                        self._continuation = None
+                        if future.done(): # command rejected
+                            return await future
+                    line = bytes(arg)
+                    continue
+                if isinstance(arg, str):
+                    arg = arg.encode('utf-8')
+                line += b' ' + arg
+            self._writer.write(line + b'\r\n')
+            await self._writer.drain()
+        return await future
+
+    async def _read_line(self):
+        """ Read a complete response line from the server, including its
+            literals. Return a list in the form in which imaplib returns
+            the data of a response: a (text, literal) tuple for every
+            literal, followed by the remaining text.
+        """
+        result = []
+        while True:
+            line = await self._read_text()
+            if not line.endswith(b'\n'):
+                raise EOFError("connection closed by server")
+            line = line.rstrip(b'\r\n')
+            match = _LITERAL.search(line)
+            if match is None:
+                result.append(line)
+                return result
+            literal = await self._reader.readexactly(int(match.group('size')))
+            result.append((line, literal))
+
+    async def _read_text(self):
+        """ Read the text up to and including the next newline, however
+            long it is (StreamReader.readline fails for lines beyond the
+            limit of the stream, 64 KiB by default). At the end of the
+            stream, return what was read without a newline.
+        """
+        parts = []
+        while True:
+            try:
+                parts.append(await self._reader.readuntil(b'\n'))
+            except asyncio.IncompleteReadError as data:
+                parts.append(data.partial)
+            except asyncio.LimitOverrunError as data:
+                parts.append(await self._reader.read(data.consumed))
+                continue
+            return b''.join(parts)
+
+    async def _read_responses(self):
+        """ Read the responses from the server and dispatch them to the
+            commands in flight, until the connection is closed
+        """
+        try:
+            while True:
+                self._dispatch(await self._read_line())
+        except asyncio.CancelledError:
+            raise
+        except (OSError, EOFError, asyncio.IncompleteReadError) as data:
+            self._fail_pending("connection lost: %s" % data)
+        except Exception as data:
+            # without the reader, no command in flight would ever complete
+            self._fail_pending("cannot read response: %r" % data)
+
+    def _fail_pending(self, reason):
+        """ Raise AsyncImapError in all commands in flight """
+        for (future, response) in self._pending.values():
+            if not future.done():
+                future.set_exception(AsyncImapError(reason))
+        self._pending.clear()
+        if self._continuation is not None and not self._continuation.done():
+            self._continuation.set_exception(AsyncImapError(reason))
+
+    def _dispatch(self, parts):
+        """ Process a response line, as returned by _read_line """
+        first = parts[0]
+        if isinstance(first, tuple):
+            first = first[0]
+        if first.startswith(b'+'):
+            if self._continuation is not None \
+            and not self._continuation.done():
+                self._continuation.set_result(first)
+            return
+        if first.startswith(b'* '):
+            self._dispatch_untagged(first, parts)
+            return
+        match = _TAGGED.match(first)
+        if match is None or match.group('tag') not in self._pending:
+            return # ignore garbage
+        (future, response) = self._pending.pop(match.group('tag'))
+        response.code = match.group('type').decode('ascii').upper()
+        response.text = match.group('data') or b''
+        self._response_code(response.text, response)
+        if not future.done():
+            future.set_result(response)
+
+    def _dispatch_untagged(self, first, parts):
+        """ Store an untagged response with the oldest command in flight """
+        if len(self._pending) > 0:
+            response = next(iter(self._pending.values()))[1]
+        else:
+            response = self._unsolicited
+        match = _UNTAGGED_STATUS.match(first)
+        if match is not None:
+            name = match.group('type').decode('ascii').upper()
+            data = match.group('data')
+            if match.group('data2') is not None:
+                data = data + b' ' + match.group('data2')
+            if name == 'EXISTS':
+                self.exists = int(match.group('data'))
+            elif name == 'EXPUNGE' and self.exists is not None:
+                self.exists -= 1
+        else:
+            match = _UNTAGGED.match(first)
+            if match is None:
+                return # ignore garbage
+            name = match.group('type').decode('ascii').upper()
+            data = match.group('data') or b''
+            if name in ('OK', 'NO', 'BAD', 'BYE', 'PREAUTH'):
+                self._response_code(data, response)
+            elif name == 'CAPABILITY':
+                self.capabilities = data.decode('ascii').upper().split()
+        if isinstance(parts[0], tuple):
+            parts = [(data, parts[0][1])] + parts[1:]
+        else:
+            parts = [data] + parts[1:]
+        response.untagged.setdefault(name, []).extend(parts)
+
+    def _response_code(self, text, response):
+        """ Store the response code contained in the text of a status
+            response, as imaplib does
+        """
+        match = _RESPONSE_CODE.match(text)
+        if match is None:
+            return
+        name = match.group('type').decode('ascii').upper()
+        response.untagged.setdefault(name, []).append(match.group('data'))
+        if name == 'CAPABILITY':
+            self.capabilities = match.group('data').decode('ascii').upper()\
+                                                                     .split()
+
+    def response(self, code):
+        """ Return data for the response 'code' (e.g. 'EXISTS') that was
+            received while no command was in flight (e.g. during IDLE), as
+            a tuple (code, [data, ...]). If there is no such response, the
+            list of data is [None]. The data is cleared, so calling
+            response again returns only newer responses.
+        """
+        return (code, self._unsolicited.untagged.pop(code.upper(), [None]))
+
+    async def select(self, mailbox='INBOX', create=False):
+        """ Select a mailbox. Log in if not logged in already.
+            Return number of messages in mailbox if successful.
+            If the mailbox does not exist, create it if 'create' is True,
+            else raise NoSuchMailboxError.
+            The name of the mailbox will be stored in the mailboxname
+            attribute if selection was successful, and its UIDVALIDITY in
+            the uidvalidity attribute.
+        """
+        if not self._logged_in:
+            await self.login()
+        response = await self.command('SELECT', quote(mailbox))
+        if response.code == 'OK':
+            self.mailboxname = mailbox
+            self.exists = int(response.data('EXISTS')[-1] or 0)
+            self.uidvalidity = None
+            uidvalidity = response.data('UIDVALIDITY')[-1]
+            if uidvalidity is not None:
+                self.uidvalidity = int(uidvalidity)
+            return self.exists
+        self.mailboxname = None
+        if create:
+            await self.create(mailbox)
+            return await self.select(mailbox, create=False)
+        raise NoSuchMailboxError("mailbox %s does not exist." % mailbox)
+
+    async def close(self):
+        """ Close currently selected mailbox. Deleted messages are
+            removed from writable mailbox. This is the recommended
+            command before "LOGOUT"."""
+        self.mailboxname = None
+        self.uidvalidity = None
+        self.exists = None
+        response = await self.command('CLOSE')
+        return (response.code, [response.text])
+
+    async def create(self, name):
+        """ Create new mailbox """
+        response = await self.command('CREATE', quote(name))
+        return (response.code, [response.text])
+
+    async def delete(self, name):
+        """ Delete old mailbox """
+        response = await self.command('DELETE', quote(name))
+        return (response.code, [response.text])
+
+    async def status(self, mailbox, names):
+        """ Request named status conditions for mailbox, e.g.
+            status('INBOX', '(MESSAGES UIDNEXT)')
+        """
+        response = await self.command('STATUS', quote(mailbox), names)
+        return (response.code, response.data('STATUS'))
+
+    async def expunge(self):
+        """ Permanently remove deleted items from selected mailbox.
+            Returned data contains a list of "EXPUNGE" message numbers
+            in order received.
+        """
+        self._check_open('expunge')
+        response = await self.command('EXPUNGE')
+        return (response.code, response.data('EXPUNGE'))
+
+    async def uid(self, command, *args):
+        """ uid(command, arg[, ...])
+            Execute command with messages identified by UID.
+            Returns response appropriate to command, like ImapServer.uid.
+        """
+        self._check_open('uid')
+        return self._uid_result(command,
+                                await self.command('UID', command, *args))
+
+    async def uid_response(self, command, *args):
+        """ Like uid, but return the _Response instance of the command,
+            which also contains the response codes (e.g. COPYUID)
+        """
+        self._check_open('uid')
+        return await self.command('UID', command, *args)
+
+    def _uid_result(self, command, response):
+        """ Return the (code, data) tuple of a UID command, as returned by
+            imaplib
+        """
+        if response.code != 'OK':
+            return (response.code, [response.text])
+        name = command.upper()
+        if name not in ('SEARCH', 'SORT', 'THREAD'):
+            name = 'FETCH'
+        return (response.code, response.data(name))
+
+    async def append(self, mailbox, flags, date_time, messagestr):
+        """ Append message to named mailbox. All parameters are strings which
+            need to be in the appropriate format as described in RFC3501.
+            Return the tagged response, which contains the APPENDUID
+            response code of servers supporting UIDPLUS.
+        """
+        self._check_open('append')
+        arguments = [quote(mailbox)]
+        flags = flags.replace("\\Recent", '')
+        if flags:
+            if (flags[0], flags[-1]) != ('(', ')'):
+                flags = "(%s)" % flags
+            arguments.append(flags)
+        if date_time:
+            arguments.append(Time2Internaldate(date_time))
+        if not isinstance(messagestr, bytes):
+            messagestr = messagestr.encode('utf-8')
+        arguments.append(Literal(_MAP_CRLF.sub(b'\r\n', messagestr)))
+        response = await self.command('APPEND', *arguments)
+        return (response.code, [response.text])
+
+    async def list(self):
+        """ Return list of the names of all selectable mailboxes, or None if
+            the server does not send an 'OK' reply.
+        """
+        response = await self.command('LIST', '""', '*')
+        if response.code != 'OK':
+            return None
+        result = []
+        for line in response.data('LIST'):
+            if line is None:
+                continue
+            if isinstance(line, tuple): # name sent as literal
+                (line, name) = line
+                if b'\\noselect' not in line.lower():
+                    result.append(name.decode('utf-8'))
+                continue
+            match = re.match(br'\((?P<flags>[^)]*)\) (?:"[^"]*"|NIL) (?P<name>.*)$',
+                             line)
+            if match is None or b'\\noselect' in match.group('flags').lower():
+                continue
+            name = match.group('name').decode('utf-8')
+            if name.startswith('"'):
+                name = re.sub(r'\\(.)', r'\1', name[1:-1])
+            result.append(name)
+        return result
+
+    def _check_open(self, name):
+        """ Raise ClosedMailboxError if no mailbox is selected """
+        if self.mailboxname is None:
+            raise ClosedMailboxError("called %s on closed mailbox" % name)
+
+    def __eq__(self, other):
+        """ Equality test:
+            servers are equal if they are equal in servername, username,
+            password, port, and ssl.
+        """
+        return (    (self.servername == other.servername) \
+                and (self.username == other.username) \
+                and (self.password == other.password) \
+                and (self.port == other.port) \
+                and (self.ssl == other.ssl) \
+               )
+
+    def __ne__(self, other):
+        """ Inequality test:
+            servers are unequal if they are not equal
+        """
+        return (not (self == other))
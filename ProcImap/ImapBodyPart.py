@@ -0,0 +1,230 @@
+############################################################################
+#    Copyright (C) 2008 by Michael Goerz                                   #
+#    http://www.physik.fu-berlin.de/~goerz                                 #
+#                                                                          #
+#    This program is free software; you can redistribute it and#or modify  #
+#    it under the terms of the GNU General Public License as published by  #
+#    the Free Software Foundation; either version 3 of the License, or     #
+#    (at your option) any later version.                                   #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU General Public License     #
+#    along with this program; if not, write to the                         #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+############################################################################
+
+""" This module contains the ImapBodyPart class, which represents the MIME
+    structure of a message on an IMAP server, as described by the
+    BODYSTRUCTURE data item (RFC3501). The content of a part is only
+    downloaded when it is accessed, so that e.g. the text of a message can
+    be inspected without downloading its attachments.
+"""
+
+import base64
+import quopri
+
+from ProcImap.ImapResponse import ResponseParseError
+
+
+def _params(value):
+    """ Convert a parenthesized list of attribute/value pairs into a dict
+        with lower case keys
+    """
+    result = {}
+    if value is None:
+        return result
+    if not isinstance(value, list) or len(value) % 2 != 0:
+        raise ResponseParseError("malformed parameter list in BODYSTRUCTURE")
+    for index in range(0, len(value), 2):
+        result[value[index].lower()] = value[index+1]
+    return result
+
+
+def _subsection(section, number):
+    """ Return the section specifier of the part 'number' of section """
+    if section == '':
+        return str(number)
+    return "%s.%s" % (section, number)
+
+
+class ImapBodyPart:
+    """ A MIME part of a message on an IMAP server, with its subparts.
+
+        Public attributes are:
+        section         the section specifier of the part (e.g. '1.2'), as
+                        used in BODY[section]. It is '' for a multipart
+                        message as a whole.
+        maintype        lower case main type, e.g. 'text'
+        subtype         lower case subtype, e.g. 'plain'
+        params          dict of the content type parameters (lower case
+                        keys), e.g. {'charset': 'us-ascii'}
+        id              content id, or None
+        description     content description, or None
+        encoding        lower case content transfer encoding, e.g. 'base64'
+        size            size of the encoded content in bytes (0 for
+                        multipart parts)
+        lines           size of the content in lines for text parts, or None
+        disposition     lower case content disposition (e.g. 'attachment'),
+                        or None
+        disposition_params  dict of the disposition parameters
+        parts           list of subparts. For multipart parts these are the
+                        parts of the multipart; for message/rfc822 parts,
+                        the parts of the encapsulated message. Empty for
+                        all other parts.
+
+        The content of the part is downloaded on the first call of
+        get_payload, and kept afterwards.
+    """
+    def __init__(self, section, fetch_section):
+        """ Initialize an empty part with the given section specifier.
+            fetch_section is a function that takes a section specifier and
+            returns the content of that section of the message from the
+            server.
+        """
+        self.section = section
+        self.maintype = 'text'
+        self.subtype = 'plain'
+        self.params = {}
+        self.id = None
+        self.description = None
+        self.encoding = '7bit'
+        self.size = 0
+        self.lines = None
+        self.disposition = None
+        self.disposition_params = {}
+        self.parts = []
+        self._fetch_section = fetch_section
+        self._payload = None
+
+    def get_content_type(self):
+        """ Return the content type of the part, e.g. 'text/plain' """
+        return "%s/%s" % (self.maintype, self.subtype)
+
+    def get_content_charset(self, failobj=None):
+        """ Return the lower case charset parameter of the content type, or
+            failobj if there is no such parameter
+        """
+        charset = self.params.get('charset', None)
+        if charset is None:
+            return failobj
+        return charset.lower()
+
+    def get_filename(self, failobj=None):
+        """ Return the filename parameter of the content disposition, or
+            the name parameter of the content type, or failobj if there is
+            neither
+        """
+        filename = self.disposition_params.get('filename',
+                                               self.params.get('name', None))
+        if filename is None:
+            return failobj
+        return filename
+
+    def is_multipart(self):
+        """ Return True if the part is a multipart """
+        return self.maintype == 'multipart'
+
+    def walk(self):
+        """ Generate this part and all its subparts, depth-first """
+        yield self
+        for part in self.parts:
+            for subpart in part.walk():
+                yield subpart
+
+    def get_payload(self, decode=False):
+        """ Return the content of the part, downloading it from the server
+            on the first call. If decode is True, the base64 or
+            quoted-printable content transfer encoding is decoded.
+            The content is returned as it is transferred by the server,
+            i.e. as bytes in Python 3; decoding the charset is left to the
+            caller (see get_content_charset).
+        """
+        if self._payload is None:
+            self._payload = self._fetch_section(self.section or 'TEXT')
+        if not decode:
+            return self._payload
+        if self.encoding == 'base64':
+            return base64.b64decode(self._payload)
+        if self.encoding == 'quoted-printable':
+            return quopri.decodestring(self._payload)
+        return self._payload
+
+    def __repr__(self):
+        return "<ImapBodyPart %s %s>" % (self.section or '(message)',
+                                        self.get_content_type())
+
+
+def parse_bodystructure(value, fetch_section, section=''):
+    """ Return the tree of ImapBodyPart instances described by the value of
+        a BODYSTRUCTURE data item, as returned by ImapResponse.parse_list.
+        fetch_section is passed on to the ImapBodyPart instances. 'section'
+        is the section specifier of the part described by value; the
+        default is appropriate for a message as a whole.
+    """
+    if not isinstance(value, list) or len(value) == 0:
+        raise ResponseParseError("malformed BODYSTRUCTURE")
+    if isinstance(value[0], list):
+        # multipart: one or more parts followed by the subtype
+        result = ImapBodyPart(section, fetch_section)
+        result.maintype = 'multipart'
+        index = 0
+        while index < len(value) and isinstance(value[index], list):
+            result.parts.append(parse_bodystructure(value[index], fetch_section,
+                                          _subsection(section, index + 1)))
+            index += 1
+        if index >= len(value) or value[index] is None:
+            raise ResponseParseError("missing multipart subtype")
+        result.subtype = value[index].lower()
+        extension = value[index+1:]
+        if len(extension) > 0:
+            result.params = _params(extension[0])
+        extension = extension[1:]
+    else:
+        if section == '':
+            section = '1' # the body of a single-part message
+        if len(value) < 7:
+            raise ResponseParseError("incomplete BODYSTRUCTURE")
+        result = ImapBodyPart(section, fetch_section)
+        result.maintype = (value[0] or 'text').lower()
+        result.subtype = (value[1] or 'plain').lower()
+        result.params = _params(value[2])
+        result.id = value[3]
+        result.description = value[4]
+        result.encoding = (value[5] or '7bit').lower()
+        try:
+            result.size = int(value[6] or 0)
+        except ValueError:
+            raise ResponseParseError("malformed size in BODYSTRUCTURE")
+        extension = value[7:]
+        if result.maintype == 'message' and result.subtype == 'rfc822' \
+        and len(value) >= 10:
+            encapsulated = parse_bodystructure(value[8], fetch_section,
+                                               section)
+            if encapsulated.is_multipart():
+                result.parts = encapsulated.parts
+            else:
+                encapsulated.section = _subsection(section, 1)
+                result.parts = [encapsulated]
+            result.lines = value[9]
+            extension = value[10:]
+        elif result.maintype == 'text' and len(value) >= 8:
+            result.lines = value[7]
+            extension = value[8:]
+        if result.lines is not None:
+            try:
+                result.lines = int(result.lines)
+            except ValueError:
+                raise ResponseParseError("malformed lines in BODYSTRUCTURE")
+        extension = extension[1:] # MD5
+    if len(extension) > 0 and isinstance(extension[0], list) \
+    and len(extension[0]) == 2:
+        (disposition, params) = extension[0]
+        if disposition is not None:
+            result.disposition = disposition.lower()
+        result.disposition_params = _params(params)
+    return result
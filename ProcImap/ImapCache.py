@@ -0,0 +1,460 @@
+############################################################################
+#    Copyright (C) 2008 by Michael Goerz                                   #
+#    http://www.physik.fu-berlin.de/~goerz                                 #
+#                                                                          #
+#    This program is free software; you can redistribute it and#or modify  #
+#    it under the terms of the GNU General Public License as published by  #
+#    the Free Software Foundation; either version 3 of the License, or     #
+#    (at your option) any later version.                                   #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU General Public License     #
+#    along with this program; if not, write to the                         #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+############################################################################
+
+""" This module contains the MessageCache class, which is used by
+    ImapMailbox to keep the RFC822 text of recently downloaded messages, so
+    that they don't have to be downloaded again, and the DiskMessageCache
+    class, which does the same persistently in a directory.
+
+    Messages are identified by keys of the form
+    (server, mailbox, uidvalidity, uid), see the cache_key function. As
+    long as the UIDVALIDITY of a mailbox does not change, the IMAP protocol
+    guarantees that the message with a given UID never changes, so the
+    cached text is always valid. Flags are not cached, since they can
+    change at any time.
+"""
+
+from collections import OrderedDict
+import hashlib
+import os
+import tempfile
+
+CACHE_MAX_MESSAGES = 50          # default limits for the number of messages
+CACHE_MAX_BYTES = 20 * 1024**2   # and the total size of messages in a
+                                 # MessageCache
+
+DISK_CACHE_MAX_BYTES = 1024**3   # default limit for the total size of the
+                                 # messages in a DiskMessageCache
+
+
+def cache_key(server, mailbox, uidvalidity, uid):
+    """ Return the key identifying the message with UID in the named
+        mailbox on the ImapServer instance 'server'
+    """
+    return ((server.servername, server.port, server.username),
+            mailbox, uidvalidity, int(uid))
+
+
+class MessageCache:
+    """ A least-recently-used cache for the RFC822 text of messages.
+
+        The cache holds at most 'max_messages' messages with a total size
+        of at most 'max_bytes' bytes. If a new message would exceed either
+        limit, the least recently used messages are evicted. Messages that
+        are larger than max_bytes are not cached at all.
+
+        Public attributes are:
+        max_messages    maximum number of messages in the cache
+        max_bytes       maximum total size of the messages in the cache
+        hits            number of successful lookups
+        misses          number of unsuccessful lookups
+        evictions       number of messages evicted to respect the limits
+    """
+    def __init__(self, max_messages=CACHE_MAX_MESSAGES,
+                 max_bytes=CACHE_MAX_BYTES):
+        """ Initialize an empty cache with the given limits """
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """ Return the text stored for key and mark it as recently used.
+            Return default if key is not in the cache.
+        """
+        try:
+            text = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data[key] = text
+        self.hits += 1
+        return text
+
+    def put(self, key, text):
+        """ Store text for key, evicting the least recently used messages
+            as necessary.
+        """
+        self.discard(key)
+        if len(text) > self.max_bytes or self.max_messages < 1:
+            return
+        while self._data and (len(self._data) >= self.max_messages
+                              or self._bytes + len(text) > self.max_bytes):
+            (evicted_key, evicted_text) = self._data.popitem(last=False)
+            self._bytes -= len(evicted_text)
+            self.evictions += 1
+        self._data[key] = text
+        self._bytes += len(text)
+
+    def discard(self, key):
+        """ Remove key from the cache, if it is in the cache """
+        text = self._data.pop(key, None)
+        if text is not None:
+            self._bytes -= len(text)
+
+    def invalidate(self, server=None, mailbox=None):
+        """ Remove all messages of the named mailbox on the ImapServer
+            instance 'server' from the cache. If mailbox is None, remove all
+            messages on that server; if server is None, clear the cache.
+        """
+        if server is None:
+            self.clear()
+            return
+        serverkey = cache_key(server, mailbox, None, 0)[0]
+        for key in list(self._data.keys()):
+            if key[0] == serverkey and (mailbox is None or key[1] == mailbox):
+                self.discard(key)
+
+    def clear(self):
+        """ Remove all messages from the cache """
+        self._data.clear()
+        self._bytes = 0
+
+    def stats(self):
+        """ Return a dict with the keys 'messages', 'bytes', 'hits',
+            'misses', and 'evictions'
+        """
+        return {'messages': len(self._data), 'bytes': self._bytes,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+    def __contains__(self, key):
+        """ Return True if key is in the cache. This does not count as a
+            lookup in the statistics.
+        """
+        return key in self._data
+
+    def __len__(self):
+        """ Return the number of messages in the cache """
+        return len(self._data)
+
+
+class DiskMessageCache:
+    """ A persistent cache for the RFC822 text of messages, stored in a
+        directory. It has the same interface as MessageCache. Since the
+        cache is persistent, several processes (or several runs of the same
+        script) can share the messages they downloaded.
+
+        The messages are stored content-addressed: each message text is
+        stored once in the file objects/xx/<sha1 of text>, no matter how
+        many keys refer to it (e.g. the same message in several Gmail
+        labels). For each key, there is a small file keys/xx/<sha1 of key>
+        that contains the name of the object file. Files are written to
+        the tmp directory first and then renamed, so that other processes
+        never see incomplete files. A message text is
+        returned with the type with which it was stored: text stored as
+        bytes is returned as bytes, text stored as str (which is encoded
+        as latin-1 on disk) is returned as str.
+
+        The total size of the files in the cache (message texts and key
+        files) is kept below 'max_bytes' by deleting the least recently
+        used messages, together with the key files that refer to them.
+        Messages in mailboxes without a known UIDVALIDITY are not cached.
+
+        Public attributes are:
+        directory       the directory in which the messages are stored
+        max_bytes       maximum total size of the files in the cache
+        hits            number of successful lookups
+        misses          number of unsuccessful lookups
+        evictions       number of messages evicted to respect the limit
+    """
+    def __init__(self, directory, max_bytes=DISK_CACHE_MAX_BYTES):
+        """ Initialize the cache in directory, which is created if it does
+            not exist. Messages stored in the directory by earlier instances
+            are available immediately.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        for subdirectory in ('objects', 'keys', 'tmp'):
+            path = os.path.join(directory, subdirectory)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+        self._bytes = 0
+        for (path, size, mtime) in self._objects():
+            self._bytes += size
+        for (path, size, digest) in self._keys():
+            self._bytes += size
+
+    def _objects(self):
+        """ Return a list of (path, size, mtime) tuples for all stored
+            message texts
+        """
+        result = []
+        objectdir = os.path.join(self.directory, 'objects')
+        for (dirpath, dirnames, filenames) in os.walk(objectdir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue # deleted by another process
+                result.append((path, stat.st_size, stat.st_mtime))
+        return result
+
+    def _keys(self):
+        """ Return a list of (path, size, digest) tuples for all key files,
+            where digest is the name of the object file the key refers to
+        """
+        result = []
+        keydir = os.path.join(self.directory, 'keys')
+        for (dirpath, dirnames, filenames) in os.walk(keydir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    keyfile = open(path, 'rb')
+                    try:
+                        data = keyfile.read()
+                    finally:
+                        keyfile.close()
+                except (IOError, OSError):
+                    continue # deleted by another process
+                try:
+                    digest = _parse_keydata(data)[0]
+                except ValueError:
+                    continue # not a key file
+                result.append((path, len(data), digest))
+        return result
+
+    def _path(self, subdirectory, digest):
+        """ Return the path of the file for the hex digest in subdirectory
+            ('objects' or 'keys')
+        """
+        return os.path.join(self.directory, subdirectory, digest[:2], digest)
+
+    def _keypath(self, key):
+        """ Return the path of the file for key """
+        keystring = '\t'.join([str(part) for part in key[0] + key[1:]])
+        digest = hashlib.sha1(keystring.encode('utf-8')).hexdigest()
+        return self._path('keys', digest)
+
+    def _write(self, path, data):
+        """ Atomically write data to the file at path """
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                pass # created by another process
+        (handle, tmppath) = tempfile.mkstemp(
+                                       dir=os.path.join(self.directory, 'tmp'))
+        try:
+            try:
+                os.write(handle, data)
+            finally:
+                os.close(handle)
+            _replace(tmppath, path)
+        except:
+            try:
+                os.remove(tmppath)
+            except OSError:
+                pass
+            raise
+
+    def _lookup(self, key):
+        """ Return a tuple (path, is_str) of the path of the object file for
+            key, and whether the text was stored as str. Return (None, False)
+            if key is not in the cache.
+        """
+        try:
+            keyfile = open(self._keypath(key), 'rb')
+            try:
+                (digest, is_str) = _parse_keydata(keyfile.read())
+            finally:
+                keyfile.close()
+        except (IOError, OSError, ValueError):
+            return (None, False)
+        path = self._path('objects', digest)
+        if not os.path.isfile(path):
+            return (None, False)
+        return (path, is_str)
+
+    def open(self, key):
+        """ Return a file object opened for reading in binary mode for the
+            message text stored for key, and mark it as recently used.
+            Return None if key is not in the cache.
+        """
+        path = self._lookup(key)[0]
+        if path is not None:
+            try:
+                result = open(path, 'rb')
+                os.utime(path, None)
+                self.hits += 1
+                return result
+            except (IOError, OSError):
+                pass # evicted by another process
+        self.misses += 1
+        return None
+
+    def get(self, key, default=None):
+        """ Return the text stored for key and mark it as recently used,
+            with the type with which it was stored (bytes or str).
+            Return default if key is not in the cache.
+        """
+        is_str = self._lookup(key)[1]
+        objectfile = self.open(key)
+        if objectfile is None:
+            return default
+        try:
+            text = objectfile.read()
+        finally:
+            objectfile.close()
+        if is_str and not isinstance(text, str):
+            text = text.decode('latin-1')
+        return text
+
+    def put(self, key, text):
+        """ Store text for key, evicting the least recently used messages
+            as necessary.
+        """
+        if key[2] is None:
+            return # UIDVALIDITY unknown, UID might be reused
+        keydata = b''
+        if not isinstance(text, bytes):
+            text = text.encode('latin-1')
+            keydata = b' str'
+        digest = hashlib.sha1(text).hexdigest()
+        keydata = digest.encode('ascii') + keydata
+        if len(text) + len(keydata) > self.max_bytes:
+            return
+        self.discard(key)
+        path = self._path('objects', digest)
+        if os.path.isfile(path):
+            os.utime(path, None)
+            self._evict(self.max_bytes - len(keydata), keep=path)
+        else:
+            self._evict(self.max_bytes - len(text) - len(keydata))
+            self._write(path, text)
+            self._bytes += len(text)
+        self._write(self._keypath(key), keydata)
+        self._bytes += len(keydata)
+
+    def _evict(self, max_bytes, keep=None):
+        """ Delete the least recently used message texts (except the one at
+            the path 'keep') and the key files referring to them, until the
+            total size of all files is at most max_bytes. Key files that
+            refer to message texts that no longer exist are deleted as well.
+        """
+        if self._bytes <= max_bytes:
+            return
+        objects = self._objects()
+        keys = {} # digest => list of (path, size) of key files
+        self._bytes = sum([size for (path, size, mtime) in objects])
+        for (path, size, digest) in self._keys():
+            keys.setdefault(digest, []).append((path, size))
+            self._bytes += size
+        digests = set([os.path.basename(path) for (path, size, mtime)
+                       in objects])
+        for digest in list(keys.keys()):
+            if digest not in digests:
+                self._remove_keys(keys.pop(digest))
+        objects.sort(key=lambda object: object[2])
+        for (path, size, mtime) in objects:
+            if self._bytes <= max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue # deleted by another process
+            self._bytes -= size
+            self.evictions += 1
+            self._remove_keys(keys.pop(os.path.basename(path), []))
+
+    def _remove_keys(self, keyfiles):
+        """ Delete the key files in the list of (path, size) tuples """
+        for (path, size) in keyfiles:
+            try:
+                os.remove(path)
+            except OSError:
+                continue # deleted by another process
+            self._bytes -= size
+
+    def discard(self, key):
+        """ Remove key from the cache, if it is in the cache. The message
+            text is kept as long as other keys might refer to it; it will
+            eventually be evicted if it is no longer used.
+        """
+        path = self._keypath(key)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        self._bytes -= size
+
+    def invalidate(self, server=None, mailbox=None):
+        """ Not supported for a DiskMessageCache: since the cache keys
+            include the UIDVALIDITY, stored messages never become invalid.
+            Messages that are no longer needed are evicted eventually.
+        """
+        pass
+
+    def clear(self):
+        """ Remove all messages from the cache """
+        for subdirectory in ('objects', 'keys'):
+            path = os.path.join(self.directory, subdirectory)
+            for (dirpath, dirnames, filenames) in os.walk(path):
+                for filename in filenames:
+                    try:
+                        os.remove(os.path.join(dirpath, filename))
+                    except OSError:
+                        pass
+        self._bytes = 0
+
+    def stats(self):
+        """ Return a dict with the keys 'bytes', 'hits', 'misses', and
+            'evictions'
+        """
+        return {'bytes': self._bytes, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+    def __contains__(self, key):
+        """ Return True if key is in the cache. This does not count as a
+            lookup in the statistics.
+        """
+        return self._lookup(key)[0] is not None
+
+
+def _parse_keydata(data):
+    """ Return a tuple (digest, is_str) from the contents of a key file of
+        a DiskMessageCache. Raise ValueError if data is not the contents of
+        a key file.
+    """
+    parts = data.decode('ascii').split()
+    if len(parts) == 0 or len(parts[0]) != 40:
+        raise ValueError("invalid key file: %r" % data)
+    return (parts[0], 'str' in parts[1:])
+
+
+def _replace(source, destination):
+    """ Rename the file source to destination, replacing destination if it
+        exists (os.rename fails in that case on Windows)
+    """
+    if hasattr(os, 'replace'): # Python 3.3 or later
+        os.replace(source, destination)
+    else:
+        os.rename(source, destination)
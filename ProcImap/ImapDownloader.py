@@ -0,0 +1,228 @@
+############################################################################
+#    Copyright (C) 2008 by Michael Goerz                                   #
+#    http://www.physik.fu-berlin.de/~goerz                                 #
+#                                                                          #
+#    This program is free software; you can redistribute it and#or modify  #
+#    it under the terms of the GNU General Public License as published by  #
+#    the Free Software Foundation; either version 3 of the License, or     #
+#    (at your option) any later version.                                   #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU General Public License     #
+#    along with this program; if not, write to the                         #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+############################################################################
+
+""" This module contains the ParallelDownloader class, which downloads the
+    messages of a mailbox over several connections at once.
+"""
+
+import threading
+
+from ProcImap.ImapServer import ImapServer
+from ProcImap.ImapServerPool import ImapServerPool
+from ProcImap.ImapMailbox import PREFETCH
+from ProcImap.ImapMessage import ImapMessage
+from ProcImap.ImapSequenceSet import UIDSet, batches
+
+DOWNLOAD_CONNECTIONS = 4 # default number of connections used in parallel
+
+
+class _ReorderBuffer:
+    """ Hands out the indices of the batches of a download to the worker
+        threads, and collects the downloaded batches so that they can be
+        returned in order. A worker may only start on a batch if fewer than
+        'size' batches are in flight or waiting to be returned, so that
+        a slow batch cannot cause the buffer to grow without bounds.
+    """
+    def __init__(self, count, size):
+        self._count = count          # total number of batches
+        self._size = max(1, size)
+        self._next_request = 0       # next batch to hand out to a worker
+        self._next_result = 0        # next batch to return to the consumer
+        self._results = {}           # batch index => list of (uid, message)
+        self._error = None
+        self._stopped = False
+        self._condition = threading.Condition()
+
+    def request(self):
+        """ Return the index of the next batch that a worker should
+            download, blocking while the buffer is full. Return None if
+            there are no more batches, or if the download was stopped.
+        """
+        self._condition.acquire()
+        try:
+            while not self._stopped and self._next_request < self._count \
+            and self._next_request >= self._next_result + self._size:
+                self._condition.wait()
+            if self._stopped or self._next_request >= self._count:
+                return None
+            self._next_request += 1
+            return self._next_request - 1
+        finally:
+            self._condition.release()
+
+    def put(self, index, result):
+        """ Store the downloaded batch with the given index """
+        self._condition.acquire()
+        try:
+            self._results[index] = result
+            self._condition.notify_all()
+        finally:
+            self._condition.release()
+
+    def fail(self, error):
+        """ Stop the download because of the exception 'error', which is
+            raised in the consumer
+        """
+        self._condition.acquire()
+        try:
+            if self._error is None:
+                self._error = error
+            self._stopped = True
+            self._condition.notify_all()
+        finally:
+            self._condition.release()
+
+    def stop(self):
+        """ Stop the download, e.g. because the consumer is done """
+        self._condition.acquire()
+        try:
+            self._stopped = True
+            self._condition.notify_all()
+        finally:
+            self._condition.release()
+
+    def get(self):
+        """ Return the next batch in order, blocking until it has been
+            downloaded. Raise the error of a failed worker if the batch was
+            not downloaded before the failure.
+        """
+        self._condition.acquire()
+        try:
+            while self._next_result not in self._results \
+            and self._error is None:
+                self._condition.wait()
+            if self._next_result not in self._results:
+                raise self._error
+            result = self._results.pop(self._next_result)
+            self._next_result += 1
+            self._condition.notify_all()
+            return result
+        finally:
+            self._condition.release()
+
+
+class ParallelDownloader:
+    """ Downloads the messages of a mailbox over several connections from
+        an ImapServerPool at once, and returns them in the order of their
+        UIDs.
+
+        A single connection spends most of its time waiting for the server
+        to process one UID FETCH after the other. The downloader splits the
+        UIDs into batches of 'prefetch' messages, and 'connections' worker
+        threads, each with the mailbox opened read-only on its own pooled
+        connection, download one batch after the other. The batches are
+        handed out in order and returned in order: at most 'buffersize'
+        batches are in flight or waiting to be returned at any time, so a
+        slow batch holds up the workers instead of filling the memory.
+
+            >>> pool = ImapServerPool('localhost', 'user', 'secret')
+            >>> downloader = ParallelDownloader(pool, 'INBOX')
+            >>> for message in downloader:
+            ...     backup.add(message)
+
+        Instead of a pool, an ImapServer may be given; a pool for its account
+        (with 'connections' connections) is then created, like
+        ImapServer.clone() would.
+
+        Public attributes are:
+        pool            the ImapServerPool
+        name            name of the mailbox
+        connections     number of connections used in parallel
+        prefetch        number of messages per UID FETCH command
+        buffersize      maximum number of batches that are held in memory
+        factory         message factory, as for ImapMailbox
+    """
+
+    def __init__(self, pool, name, connections=DOWNLOAD_CONNECTIONS,
+                 prefetch=PREFETCH, buffersize=None, factory=ImapMessage):
+        """ Initialize the downloader for the mailbox 'name'. The buffersize
+            defaults to twice the number of connections.
+        """
+        if isinstance(pool, ImapServer):
+            pool = ImapServerPool.from_server(pool, maxsize=connections)
+        self.pool = pool
+        self.name = name
+        self.connections = max(1, connections)
+        self.prefetch = prefetch
+        if buffersize is None:
+            buffersize = 2 * self.connections
+        self.buffersize = buffersize
+        self.factory = factory
+
+    def _worker(self, buffer, uidbatches, section):
+        """ Download the batches handed out by the buffer on a pooled
+            connection
+        """
+        try:
+            with self.pool.mailbox(self.name, self.factory, readonly=True,
+                                   create=False) as mailbox:
+                mailbox.prefetch = self.prefetch
+                while True:
+                    index = buffer.request()
+                    if index is None:
+                        break
+                    buffer.put(index, list(mailbox._iterfetch(
+                                                uidbatches[index], section)))
+        except Exception as data:
+            buffer.fail(data)
+
+    def iteritems(self, uids=None, section=''):
+        """ Generate (uid, message) pairs for the given UIDs (all messages
+            by default), in order of the UIDs. As for the iteration over
+            an ImapMailbox, the messages consist of the BODY[section] of
+            the message, with imap flags, internal date and size, and UIDs
+            that do not exist (anymore) are skipped. If a worker fails, the
+            download stops, and its exception is raised once the batches
+            that were completed before have been generated.
+        """
+        if uids is None:
+            with self.pool.mailbox(self.name, readonly=True,
+                                   create=False) as mailbox:
+                uids = mailbox.search("ALL", as_set=True)
+        uidbatches = batches(UIDSet(uids), self.prefetch)
+        buffer = _ReorderBuffer(len(uidbatches), self.buffersize)
+        workers = []
+        for i in range(min(self.connections, len(uidbatches))):
+            worker = threading.Thread(target=self._worker,
+                                      args=(buffer, uidbatches, section))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        try:
+            for i in range(len(uidbatches)):
+                for (uid, message) in buffer.get():
+                    yield (uid, message)
+        finally:
+            buffer.stop()
+            for worker in workers:
+                worker.join()
+
+    def itervalues(self, uids=None):
+        """ Generate the messages with the given UIDs (all messages by
+            default), in order of the UIDs
+        """
+        for (uid, message) in self.iteritems(uids):
+            yield message
+
+    def __iter__(self):
+        """ Return an iterator over all messages, identical to
+            itervalues
+        """
+        return self.itervalues()
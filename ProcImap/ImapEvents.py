@@ -0,0 +1,63 @@
+############################################################################
+#    Copyright (C) 2008 by Michael Goerz                                   #
+#    http://www.physik.fu-berlin.de/~goerz                                 #
+#                                                                          #
+#    This program is free software; you can redistribute it and#or modify  #
+#    it under the terms of the GNU General Public License as published by  #
+#    the Free Software Foundation; either version 3 of the License, or     #
+#    (at your option) any later version.                                   #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU General Public License     #
+#    along with this program; if not, write to the                         #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+############################################################################
+
+""" This module contains the events that are generated by
+    ImapMailbox.watch when the server reports changes to the mailbox.
+"""
+
+
+class MailboxEvent:
+    """ Base class for the events generated by ImapMailbox.watch.
+        The 'uid' attribute is the UID of the message that the event
+        refers to.
+    """
+    def __init__(self, uid):
+        self.uid = uid
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__, self.uid)
+
+
+class NewMessageEvent(MailboxEvent):
+    """ A new message has arrived in the mailbox. The 'message' attribute
+        is the downloaded message, or None if the messages are not
+        fetched (see ImapMailbox.watch)
+    """
+    def __init__(self, uid, message=None):
+        MailboxEvent.__init__(self, uid)
+        self.message = message
+
+
+class ExpungeEvent(MailboxEvent):
+    """ A message has been expunged from the mailbox """
+    pass
+
+
+class FlagsEvent(MailboxEvent):
+    """ The imap flags of a message have changed. The 'flags' attribute is
+        the list of its new flags, e.g. ['\\Seen', '\\Answered']
+    """
+    def __init__(self, uid, flags):
+        MailboxEvent.__init__(self, uid)
+        self.flags = flags
+
+    def __repr__(self):
+        return "<%s %s %s>" % (self.__class__.__name__, self.uid,
+                               " ".join(self.flags))
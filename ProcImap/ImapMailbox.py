@@ -24,6 +24,8 @@
 """
 
 import imaplib
+from array import array
+from bisect import bisect_left, bisect_right
 from email.generator import Generator
 from mailbox import Mailbox
 from mailbox import Message
@@ -33,9 +35,25 @@ if sys.version_info > (3, 0):
     from io import StringIO
 else:
     from cStringIO import StringIO
-
-from ProcImap.ImapServer import ImapServer
-from ProcImap.ImapMessage import ImapMessage
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+from ProcImap.ImapServer import ImapServer, IDLE_TIMEOUT
+from ProcImap.ImapMessage import ImapMessage, LazyImapMessage
+from ProcImap.ImapResponse import ResponseParseError
+from ProcImap.ImapResponse import parse_fetch_response, get_body_item
+from ProcImap.ImapResponse import iter_fetch_responses
+from ProcImap.ImapResponse import internaldate_to_tuple
+from ProcImap.ImapResponse import get_response_code, parse_copyuid
+from ProcImap.ImapResponse import parse_thread_response, parse_esearch_response
+from ProcImap.ImapSequenceSet import sequence_set, batches, UID_TYPECODE
+from ProcImap.ImapSequenceSet import split_sequence_set, expand_sequence_set
+from ProcImap.ImapSequenceSet import UIDSet
+from ProcImap.ImapCache import MessageCache, cache_key
+from ProcImap.ImapBodyPart import parse_bodystructure
+from ProcImap.ImapEvents import NewMessageEvent, ExpungeEvent, FlagsEvent
+from ProcImap.ImapSort import sort_fields, sort_messages, thread_messages
+from ProcImap.ImapSort import THREAD_FIELDS
 
 
 FIX_BUGGY_IMAP_FROMLINE = False # I used this for the standard IMAP server
@@ -44,6 +62,54 @@ FIX_BUGGY_IMAP_FROMLINE = False # I used this for the standard IMAP server
                                 # with an escaped(!) envelope-header. Don't
                                 # use that server!
 
+METADATA_FETCH_ITEMS = "FLAGS INTERNALDATE RFC822.SIZE" # data items fetched
+                                # together with the message text, so that
+                                # all attributes of an ImapMessage can be
+                                # filled in from a single round trip
+
+PREFETCH = 100 # default number of messages that are downloaded in a single
+               # UID FETCH command when iterating over the messages in a
+               # mailbox. This bounds the number of messages held in memory
+               # while iterating. See the 'prefetch' attribute of ImapMailbox.
+
+FETCH_PIPELINE_DEPTH = 2 # number of batches of messages that are requested
+                         # before the first of them is processed, if the
+                         # server supports ImapServer.uid_async
+
+STORE_PIPELINE_DEPTH = 8 # maximal number of UID STORE commands that are sent
+                         # without waiting for their responses, if the
+                         # server supports ImapServer.uid_async
+
+DOWNLOAD_CHUNKSIZE = 204800  # default number of bytes that download_to fetches
+                             # in a single partial fetch
+DOWNLOAD_MIN_CHUNKSIZE = 4096 # download_to halves the chunksize after every
+DOWNLOAD_RETRIES = 10         # failed fetch, down to DOWNLOAD_MIN_CHUNKSIZE,
+                              # and gives up after DOWNLOAD_RETRIES failures in
+                              # a row
+
+SPOOL_THRESHOLD = 1024**2 # default size above which get_file spools a message
+                          # to a temporary file on disk instead of keeping it
+                          # in memory. See the 'spool_threshold' attribute of
+                          # ImapMailbox.
+
+APPEND_BATCH_SIZE = 100            # maximum number of messages, and maximum
+APPEND_BATCH_BYTES = 10 * 1024**2  # total size of the messages, that add_many
+                                   # uploads with a single MULTIAPPEND command
+                                   # or a single pipeline of APPEND commands
+
+
+
+def _fix_fromline(rfc822string):
+    """ Remove the escaped envelope header that some buggy servers put in
+        front of a message, if FIX_BUGGY_IMAP_FROMLINE is set.
+    """
+    if FIX_BUGGY_IMAP_FROMLINE:
+        if rfc822string[:6] in (">From ", b">From "):
+            newline = "\n"
+            if isinstance(rfc822string, bytes):
+                newline = b"\n"
+            rfc822string = rfc822string[rfc822string.find(newline)+1:]
+    return rfc822string
 
 
 class ImapNotOkError(Exception):
@@ -92,6 +158,12 @@ class ImapMailbox(Mailbox):
         server           ImapServer object (readonly, see below)
         trash            Trash folder
         readonly         True if mailbox is readonly, false otherwise
+        prefetch         number of messages downloaded per round trip when
+                         iterating over messages
+        spool_threshold  size in bytes above which get_file spools a
+                         message to disk
+        cache            MessageCache holding recently downloaded messages
+        disk_cache       optional DiskMessageCache, or None
         
         The 'trash' attribute may a string, another instance 
         of ImapMailbox, or an instance of mailbox.Mailbox.
@@ -101,6 +173,25 @@ class ImapMailbox(Mailbox):
         change the mailbox will raise a ReadOnlyError. Note that setting the
         readonly attribute does not prevent you from making changes through 
         the methods of the server attribute.
+
+        When iterating over the messages of the mailbox (itervalues,
+        iteritems, values, items), the messages are not downloaded one by
+        one, but in batches of 'prefetch' messages, each batch in a single
+        UID FETCH command. Setting 'prefetch' to 1 downloads each message in
+        its own round trip.
+
+        Downloaded messages are kept in the 'cache' attribute, a
+        ProcImap.ImapCache.MessageCache with default limits. You may replace
+        it by a MessageCache with different limits, or share one instance
+        between several mailboxes. The messages of a mailbox are removed
+        from the cache when the mailbox is expunged or switched.
+
+        Optionally, you can set the 'disk_cache' attribute to an instance
+        of ProcImap.ImapCache.DiskMessageCache. Messages are then looked up
+        in the disk cache before they are downloaded from the server, and
+        every downloaded message is stored in it. Since the disk cache is
+        persistent, scripts that run over the same mailboxes repeatedly
+        only need to download new messages.
     """
     def __init__(self, path, factory=ImapMessage, readonly=False, create=True):
         """ Initialize an ImapMailbox
@@ -138,11 +229,12 @@ class ImapMailbox(Mailbox):
             raise TypeError("path must be a tuple, consisting of an "\
                             + " instance of ImapServer and a string")
         self._server.select(name, create)
-        self._cached_uid = None
-        self._cached_mailbox = None
-        self._cached_text = None
+        self.cache = MessageCache()
+        self.disk_cache = None
         self.trash = None
         self.readonly = readonly
+        self.prefetch = PREFETCH
+        self.spool_threshold = SPOOL_THRESHOLD
         server.locked = True
 
     name = property(lambda self: self._server.mailboxname, None, 
@@ -173,15 +265,20 @@ class ImapMailbox(Mailbox):
         if not isinstance(name, str):
             raise TypeError("name must be the name of a mailbox " \
                             + "as a string")
+        self.cache.invalidate(self._server, self.name)
         self._server.select(name, create)
-        self._cached_uid = None
-        self._cached_text = None
         self.readonly = readonly
 
-    def search(self, criteria='ALL', charset=None ):
-        """ Return a list of all the UIDs in the mailbox (as integers)
-            that match the search criteria. See documentation
-            of imaplib and/or RFC3501 for details.
+    def search(self, criteria='ALL', charset=None, as_set=False):
+        """ Return a sorted list of all the UIDs in the mailbox (as
+            integers) that match the search criteria. See documentation
+            of imaplib and/or RFC3501 for details. If as_set is True, the
+            UIDs are returned as a ProcImap.ImapSequenceSet.UIDSet instead,
+            which stores ranges of consecutive UIDs compactly and supports
+            set operations. If the server supports the ESEARCH extension,
+            the UIDs are received as a sequence set (see esearch), so that
+            a search matching a large part of the mailbox with as_set=True
+            needs neither a large response nor a large amount of memory.
             Raise ImapNotOkError if a non-OK response is received from
             the server or if the response cannot be parsed into a list
             of integers.
@@ -236,14 +333,63 @@ class ImapMailbox(Mailbox):
         Example:    search('FLAGGED SINCE 1-Feb-1994 NOT FROM "Smith"')
                     search('TEXT "string not in mailbox"')
         """
-        (code, data) = self._server.uid('search', charset, "(%s)" % criteria)
-        uidlist = data[0].split()
-        if code != 'OK':
-            raise ImapNotOkError("%s in search" % code)
-        try:
-            return [int(uid) for uid in uidlist]
-        except ValueError:
-            raise ImapNotOkError("received unparsable response.")
+        if self._server.has_capability('ESEARCH'):
+            uids = self.esearch(criteria, 'ALL', charset)['ALL']
+        else:
+            (code, data) = self._server.uid('search', charset,
+                                            "(%s)" % criteria)
+            if code != 'OK':
+                raise ImapNotOkError("%s in search" % code)
+            try:
+                uids = UIDSet(int(uid) for uid in (data[0] or '').split())
+            except ValueError:
+                raise ImapNotOkError("received unparsable response.")
+        if as_set:
+            return uids
+        return list(uids)
+
+    def esearch(self, criteria='ALL', returns='MIN MAX COUNT ALL',
+                charset=None):
+        """ Search for the messages that match the search criteria (see the
+            search method), and return a dict with the requested results
+            (RFC4731): 'MIN' and 'MAX' are the lowest and highest matching
+            UID (None if no message matched), 'COUNT' the number of matching
+            messages, and 'ALL' the matching UIDs as a
+            ProcImap.ImapSequenceSet.UIDSet.
+            If the server supports the ESEARCH extension, it sends the UIDs
+            in ALL as a sequence set, which is stored in the UIDSet without
+            expanding its ranges. Otherwise, the results are computed from
+            an ordinary search.
+            Raise ImapNotOkError if a non-OK response is received from
+            the server.
+        """
+        names = returns.strip('()').upper().split()
+        if self._server.has_capability('ESEARCH'):
+            self._server.response('ESEARCH') # discard stale responses
+            (code, data) = self._server.uid('search', 'RETURN',
+                                         "(%s)" % ' '.join(names), charset,
+                                         "(%s)" % criteria)
+            if code != 'OK':
+                raise ImapNotOkError("%s in esearch" % code)
+            try:
+                result = parse_esearch_response(
+                                         self._server.response('ESEARCH')[1])
+            except ResponseParseError:
+                raise ImapNotOkError("received unparsable response.")
+        else:
+            uids = self.search(criteria, charset, as_set=True)
+            result = {'COUNT': len(uids), 'ALL': uids}
+            if len(uids) > 0:
+                result['MIN'] = uids[0]
+                result['MAX'] = uids[-1]
+        defaults = {'MIN': None, 'MAX': None, 'COUNT': 0, 'ALL': UIDSet()}
+        for name in names:
+            if name not in result:
+                result[name] = defaults.get(name, None)
+        for name in list(result.keys()):
+            if name not in names:
+                del result[name]
+        return result
 
     def get_unseen_uids(self):
         """ Get a list of all the unseen UIDs in the mailbox
@@ -258,73 +404,471 @@ class ImapMailbox(Mailbox):
         """
         return(self.search("UNDELETED"))
 
+    def sort(self, criteria='DATE', search='ALL', charset='UTF-8'):
+        """ Return a list of the UIDs of the messages that match the search
+            criteria (see the search method), sorted by the sort criteria
+            (RFC5256). The sort criteria are a string of the keys ARRIVAL,
+            CC, DATE, FROM, SIZE, SUBJECT and TO, each of which may be
+            preceded by REVERSE, e.g. 'REVERSE DATE' or 'FROM SUBJECT'.
+            Messages that compare equal are sorted by UID.
+            If the server supports the SORT extension, the messages are
+            sorted by the server (UID SORT). Otherwise, the headers needed
+            for sorting are downloaded in bulk (see get_headers) and sorted
+            locally, see ProcImap.ImapSort.
+            Raise ImapNotOkError if a non-OK response is received from
+            the server.
+        """
+        if self._server.has_capability('SORT'):
+            (code, data) = self._server.uid('sort', "(%s)" % criteria.strip('()'),
+                                            charset, "(%s)" % search)
+            if code != 'OK':
+                raise ImapNotOkError("%s in sort" % code)
+            try:
+                return [int(uid) for uid in (data[0] or '').split()]
+            except ValueError:
+                raise ImapNotOkError("received unparsable response.")
+        fields = sort_fields(criteria)
+        uids = self.search(search)
+        if fields == '':
+            headers = self.get_lazy_messages(uids) # only metadata needed
+        else:
+            headers = self._get_headers(uids, fields, convert=False)
+        return sort_messages(headers, criteria)
+
+    def thread(self, algorithm='REFERENCES', search='ALL', charset='UTF-8'):
+        """ Return the threads of the messages that match the search
+            criteria (see the search method), according to the threading
+            algorithm 'REFERENCES' or 'ORDEREDSUBJECT' (RFC5256). Each
+            thread is a list of UIDs, in which each message is the parent
+            of the next one; the list may end in several lists for the
+            subthreads of the last message, e.g.
+            [[2], [3, 6, [4, 23], [44, 7, 96]]].
+            If the server supports the THREAD extension with the given
+            algorithm, the threads are built by the server (UID THREAD).
+            Otherwise, the headers needed for threading are downloaded in
+            bulk (see get_headers) and threaded locally, see
+            ProcImap.ImapSort.
+            Raise ImapNotOkError if a non-OK response is received from
+            the server.
+        """
+        algorithm = algorithm.upper()
+        if self._server.has_capability('THREAD=%s' % algorithm):
+            (code, data) = self._server.uid('thread', algorithm, charset,
+                                            "(%s)" % search)
+            if code != 'OK':
+                raise ImapNotOkError("%s in thread" % code)
+            if data == [None]:
+                # imaplib2 does not return the THREAD response directly
+                data = self._server.response('THREAD')[1]
+            try:
+                return parse_thread_response(data)
+            except ResponseParseError:
+                raise ImapNotOkError("received unparsable response.")
+        uids = self.search(search)
+        headers = self._get_headers(uids, ' '.join(THREAD_FIELDS),
+                                    convert=False)
+        return thread_messages(headers, algorithm)
+
+    def watch(self, fetch=True, timeout=IDLE_TIMEOUT):
+        """ Generate events (see ProcImap.ImapEvents) for the changes of
+            the mailbox that the server reports: a NewMessageEvent for every
+            new message, an ExpungeEvent for every expunged message, and a
+            FlagsEvent whenever the flags of a message change. Between
+            events, the server is kept in IDLE mode (see ImapServer.idle),
+            which is renewed every 'timeout' seconds, so the generator never
+            ends; stop iterating over it to stop watching.
+
+                >>> for event in mailbox.watch():
+                ...     if isinstance(event, NewMessageEvent):
+                ...         print(event.message['Subject'])
+
+            New messages are downloaded as they arrive, in batches of
+            self.prefetch messages, unless 'fetch' is False, in which case
+            the 'message' attribute of the events is None. The mailbox may
+            be used while the generator is suspended; messages that are
+            expunged in the meantime are reported as well.
+        """
+        uids = array(UID_TYPECODE, self._uid_index()) # as of the last event
+        last = 0 # highest UID that has been reported or was there already
+        if len(uids) > 0:
+            last = uids[-1]
+        while True:
+            for (name, data) in self._server.idle(timeout):
+                if name == 'EXPUNGE':
+                    for msgno in data:
+                        if int(msgno) <= len(uids):
+                            uid = uids.pop(int(msgno) - 1)
+                            self.cache.discard(self._cache_key(uid))
+                            yield ExpungeEvent(uid)
+                elif name == 'FETCH':
+                    try:
+                        responses = list(iter_fetch_responses(data))
+                    except ResponseParseError:
+                        raise ImapNotOkError("received unparsable response.")
+                    for (msgno, items) in responses:
+                        if 'FLAGS' not in items:
+                            continue
+                        if 'UID' in items:
+                            uid = int(items['UID'])
+                        elif msgno <= len(uids):
+                            uid = uids[msgno - 1]
+                        else:
+                            continue
+                        if uid <= last: # new messages are reported below
+                            yield FlagsEvent(uid, items['FLAGS'])
+            current = array(UID_TYPECODE, self._uid_index())
+            new = current[bisect_right(current, last):]
+            if len(current) - len(new) != len(uids):
+                # messages were expunged while the generator was suspended
+                remaining = UIDSet(current[:len(current) - len(new)])
+                for uid in UIDSet(uids) - remaining:
+                    self.cache.discard(self._cache_key(uid))
+                    yield ExpungeEvent(uid)
+            uids = current
+            if len(new) > 0:
+                last = new[-1]
+                if fetch:
+                    for (uid, message) in self._iterfetch(list(new)):
+                        yield NewMessageEvent(uid, message)
+                else:
+                    for uid in new:
+                        yield NewMessageEvent(uid)
+
+    def _fetch(self, uid, items):
+        """ Fetch the data items (a string such as 'FLAGS RFC822.SIZE') of
+            the message with UID in a single UID FETCH command. Return a
+            dict mapping the names of the returned data items to their
+            values, see ImapResponse.parse_fetch_response.
+            Raise KeyError if there if there is no message with that UID.
+        """
+        (code, data) = self._server.uid('fetch', str(uid), "(%s)" % items)
+        if code != 'OK':
+            raise ImapNotOkError("%s in fetch(%s, %s)" % (code, uid, items))
+        try:
+            response = parse_fetch_response(data)
+        except ResponseParseError:
+            raise ImapNotOkError("received unparsable response.")
+        try:
+            return response[int(uid)]
+        except KeyError:
+            raise KeyError("No message %s in fetch" % uid)
+
+    def _message_from_items(self, rfc822string, items, convert=True):
+        """ Return a message created from rfc822string, with the imap flags,
+            internal date and size taken from the data items returned by
+            _fetch. The message is converted by the factory of the mailbox,
+            unless convert is False, in which case an ImapMessage is
+            returned.
+        """
+        result = ImapMessage(rfc822string)
+        self._set_metadata(result, items)
+        if self._factory is ImapMessage or not convert:
+            return result
+        return self._factory(result)
+
+    def _set_metadata(self, message, items):
+        """ Set the imap flags, internal date and size of the ImapMessage
+            from the data items returned by _fetch
+        """
+        message.set_imapflags(items.get('FLAGS') or [])
+        if items.get('INTERNALDATE') is not None:
+            message.internaldate = internaldate_to_tuple(items['INTERNALDATE'])
+        message.size = int(items.get('RFC822.SIZE') or 0)
+
+    def _download_message(self, uid):
+        """ Download the message with UID from the server. Return a tuple
+            of the RFC822 text of the message and the dict of data items
+            (flags, internal date, size) returned by _fetch. The text and
+            the data items are fetched in a single round trip.
+            Raise KeyError if there if there is no message with that UID.
+        """
+        try:
+            items = self._fetch(uid, METADATA_FETCH_ITEMS + " BODY.PEEK[]")
+            rfc822string = get_body_item(items)
+            if rfc822string is None:
+                raise KeyError("No message %s in _download_message" % uid)
+        except MemoryError:
+            # this happens sometimes for unknown reasons. Try do download
+            # in chunks instead
+            self.reconnect()
+            memoryfile = BytesIO()
+            items = self.download_to(uid, memoryfile)
+            return (memoryfile.getvalue(), items)
+        return (_fix_fromline(rfc822string), items)
+
+    def download_to(self, uid, fileobj, chunksize=DOWNLOAD_CHUNKSIZE):
+        """ Download the RFC822 text of the message with UID and write it
+            to fileobj (a file object opened for writing in binary mode,
+            e.g. a tempfile.SpooledTemporaryFile). Return the dict of data
+            items (flags, internal date, size), as for _fetch.
+            The message is downloaded with partial fetches of at most
+            chunksize bytes each, so that no more than one chunk is held in
+            memory at any time. If a fetch fails (e.g. because the
+            connection broke), the connection is renewed and the download
+            resumes at the end of the last chunk that was written, with the
+            chunksize halved. After DOWNLOAD_RETRIES failures in a row, the
+            last exception is raised.
+            Raise KeyError if there if there is no message with that UID.
+        """
+        items = None
+        size = None
+        offset = 0
+        attempts = 0
+        while True:
+            fetchitems = "BODY.PEEK[]<%s.%s>" % (offset, chunksize)
+            if items is None:
+                fetchitems = METADATA_FETCH_ITEMS + " " + fetchitems
+            try:
+                chunkitems = self._fetch(uid, fetchitems)
+            except KeyError:
+                raise
+            except Exception:
+                attempts += 1
+                if attempts > DOWNLOAD_RETRIES:
+                    raise
+                chunksize = max(DOWNLOAD_MIN_CHUNKSIZE, chunksize // 2)
+                self.reconnect()
+                continue
+            attempts = 0
+            chunk = get_body_item(chunkitems)
+            if chunk is None:
+                chunk = b'' # NIL: nothing left beyond offset
+            elif isinstance(chunk, str) and not isinstance(chunk, bytes):
+                chunk = chunk.encode('latin-1') # quoted string
+            received = len(chunk)
+            offset += received
+            if items is None:
+                items = chunkitems
+                if items.get('RFC822.SIZE') is not None:
+                    size = int(items['RFC822.SIZE'])
+                chunk = _fix_fromline(chunk)
+            if chunk:
+                fileobj.write(chunk)
+            if received < chunksize:
+                break # partial fetches only come up short at the end
+            if size is not None and offset >= size:
+                break
+        return items
+
+    def _fetch_many(self, sequenceset, items):
+        """ Fetch the data items (a string such as 'FLAGS RFC822.SIZE') of
+            all messages in the sequenceset in a single UID FETCH command.
+            Return a dict mapping UIDs to dicts of data items, see
+            ImapResponse.parse_fetch_response.
+        """
+        return self._send_fetch(sequenceset, items)()
+
+    def _send_fetch(self, sequenceset, items):
+        """ Send the UID FETCH command of _fetch_many without waiting for
+            the response, if the server supports ImapServer.uid_async.
+            Return a function that waits for the response and returns the
+            result of _fetch_many. If uid_async is not available, the
+            command is only sent when that function is called.
+        """
+        args = ('fetch', sequenceset, "(UID %s)" % items)
+        if self._server.has_uid_async():
+            response = self._server.uid_async(*args).result
+        else:
+            response = lambda: self._server.uid(*args)
+        def result():
+            (code, data) = response()
+            if code != 'OK':
+                raise ImapNotOkError("%s in fetch(%s, %s)" \
+                                                   % (code, sequenceset, items))
+            try:
+                return parse_fetch_response(data)
+            except ResponseParseError:
+                raise ImapNotOkError("received unparsable response.")
+        return result
+
+    def _request_batch(self, batch, items, use_disk_cache):
+        """ Send the UID FETCH commands for the batch of UIDs in _iterfetch
+            (see _send_fetch). Messages that are in the disk cache (if
+            use_disk_cache is True) are taken from there, and only their
+            metadata is fetched. Return a tuple (batch, cached, results),
+            where cached maps UIDs to the messages from the disk cache, and
+            results is the list of functions returning the responses.
+        """
+        cached = {}
+        if use_disk_cache:
+            for uid in batch:
+                rfc822string = self.disk_cache.get(self._cache_key(uid))
+                if rfc822string is not None:
+                    cached[int(uid)] = rfc822string
+        results = []
+        download = [uid for uid in batch if int(uid) not in cached]
+        if len(download) > 0:
+            results.append(self._send_fetch(sequence_set(download), items))
+        if len(cached) > 0:
+            results.append(self._send_fetch(sequence_set(cached.keys()),
+                                            METADATA_FETCH_ITEMS))
+        return (batch, cached, results)
+
+    def _iterfetch(self, uids, section='', convert=True):
+        """ Generate (uid, message) pairs for the given list of UIDs, in the
+            same order. The messages consist of the BODY[section] of the
+            message on the server (i.e. the full message for the default
+            section), with imap flags, internal date, and size.
+            The messages are downloaded in batches of self.prefetch
+            messages, using a single UID FETCH command for each batch. If
+            the server supports ImapServer.uid_async, the commands for the
+            next FETCH_PIPELINE_DEPTH batches are sent before a batch is
+            processed, so that the next batch is transferred while the
+            current one is processed; at most that many batches are held in
+            memory at any time. UIDs for which the server does not return a
+            message (e.g. because it was expunged in the meantime) are
+            skipped.
+            Instead of a list, uids may also be a string containing a
+            sequence set (e.g. '1001:1200'), which is fetched in a single
+            batch. In this case, the messages are generated in order of
+            their UIDs.
+            If a disk cache is set, full messages that are in the disk cache
+            are not downloaded again (only their flags, internal date and
+            size are fetched), and all other messages are stored in it.
+            If convert is False, the messages are ImapMessage instances
+            instead of being converted by the factory of the mailbox.
+        """
+        items = "%s BODY.PEEK[%s]" % (METADATA_FETCH_ITEMS, section)
+        use_disk_cache = (section == '') and (self.disk_cache is not None)
+        pending = [] # batches for which the commands have been sent
+        if isinstance(uids, str):
+            response = self._fetch_many(uids, items)
+            pending.append((sorted(response.keys()), {}, []))
+            uidbatches = []
+            use_disk_cache = False
+        else:
+            response = {}
+            uidbatches = batches(uids, self.prefetch)
+        next_batch = 0
+        while len(pending) > 0 or next_batch < len(uidbatches):
+            while len(pending) < FETCH_PIPELINE_DEPTH \
+            and next_batch < len(uidbatches):
+                pending.append(self._request_batch(uidbatches[next_batch],
+                                                   items, use_disk_cache))
+                next_batch += 1
+            (batch, cached, results) = pending.pop(0)
+            for result in results:
+                # with pipelining, a response may include data for the
+                # next batch, which is kept in 'response' until needed
+                response.update(result())
+            for uid in batch:
+                fetched = response.pop(int(uid), None)
+                if fetched is None:
+                    continue
+                if int(uid) in cached:
+                    rfc822string = cached.pop(int(uid))
+                else:
+                    rfc822string = get_body_item(fetched, section)
+                    if rfc822string is None:
+                        continue
+                    rfc822string = _fix_fromline(rfc822string)
+                    if use_disk_cache:
+                        self.disk_cache.put(self._cache_key(uid),
+                                            rfc822string)
+                yield (uid, self._message_from_items(rfc822string, fetched,
+                                                     convert))
+
     def _cache_message(self, uid):
         """ Download the RFC822 text of the message with UID and put
             in in the cache. Return the RFC822 text of the message. If the
             message is already in the cache, it is returned directly.
             Raise KeyError if there if there is no message with that UID.
         """
-        if (self._cached_uid != uid) or (self._cached_mailbox != self.name):
-            try:
-                (code, data) = self._server.uid('fetch', uid, "(RFC822)")
-                if code != 'OK':
-                    raise ImapNotOkError("%s in fetch_message(%s)" \
-                                                                   % (code, uid))
-                try:
-                    rfc822string = data[0][1]
-                except TypeError:
-                    raise KeyError("No message %s in _cache_message" % uid)
-            except MemoryError:
-                # this happens sometimes for unknown reasons. Try do download
-                # in chunks instead
-                self.reconnect()
-                size = self.get_size(uid)
-                octets_read = 0
-                chunksize = 204800
-                chunks = []
-                while octets_read < size:
-                    attempts = 0
-                    while True:
-                        try:
-                            (code, data) = self._server.uid('fetch', uid, 
-                                  "(BODY[]<%s.%s>)" % (octets_read, chunksize))
-                            if code != 'OK':
-                                raise ImapNotOkError("%s in fetch_message(%s)"\
-                                                                   % (code, uid))
-                            break
-                        except:
-                            self.reconnect()
-                            attempts += 1
-                            continue
-                        if attempts > 10:
-                            break
-                        chunksize = chunksize / (attempts + 1)
-                    try:
-                        chunks.append(data[0][1])
-                    except TypeError:
-                        raise KeyError("No message %s in _cache_message" % uid)
-                    octets_read += chunksize
-                rfc822string = ''.join(chunks)
-            if FIX_BUGGY_IMAP_FROMLINE:
-                if rfc822string.startswith(">From "):
-                    rfc822string = rfc822string[rfc822string.find("\n")+1:]
-            self._cached_uid = uid
-            self._cached_mailbox = self.name
-            self._cached_text = rfc822string
-        return self._cached_text
+        key = self._cache_key(uid)
+        rfc822string = self._lookup_cache(key)
+        if rfc822string is None:
+            (rfc822string, items) = self._download_message(uid)
+            self._store_cache(key, rfc822string)
+        return rfc822string
+
+    def _lookup_cache(self, key):
+        """ Return the message text stored for key in self.cache, or in
+            self.disk_cache if it is not in self.cache. Return None if the
+            message is in neither cache.
+        """
+        rfc822string = self.cache.get(key)
+        if rfc822string is None and self.disk_cache is not None:
+            rfc822string = self.disk_cache.get(key)
+            if rfc822string is not None:
+                self.cache.put(key, rfc822string)
+        return rfc822string
+
+    def _store_cache(self, key, rfc822string):
+        """ Store the message text for key in self.cache and
+            self.disk_cache
+        """
+        self.cache.put(key, rfc822string)
+        if self.disk_cache is not None:
+            self.disk_cache.put(key, rfc822string)
+
+    def _cache_key(self, uid):
+        """ Return the key for the message with UID in self.cache """
+        return cache_key(self._server, self.name, self._server.uidvalidity, uid)
 
     def get_message(self, uid):
         """ Return an ImapMessage object created from the message with UID.
             Raise KeyError if there if there is no message with that UID.
+            The message text, imap flags, internal date and size are
+            fetched in a single round trip. If the message text is already
+            in the cache, only the flags, internal date and size are
+            fetched.
         """
-        rfc822string = self._cache_message(uid)
-        result = ImapMessage(rfc822string)
-        result.set_imapflags(self.get_imapflags(uid))
-        result.internaldate = self.get_internaldate(uid)
-        result.size = self.get_size(uid)
-        if self._factory is ImapMessage:
-            return result
-        return self._factory(result)
+        key = self._cache_key(uid)
+        rfc822string = self._lookup_cache(key)
+        if rfc822string is not None:
+            items = self._fetch(uid, METADATA_FETCH_ITEMS)
+        else:
+            (rfc822string, items) = self._download_message(uid)
+            self._store_cache(key, rfc822string)
+        return self._message_from_items(rfc822string, items)
+
+    def get_lazy_message(self, uid):
+        """ Return a LazyImapMessage for the message with UID. Only the
+            imap flags, internal date and size are fetched; the header and
+            the body are downloaded when they are first accessed. Use this
+            instead of get_message if you might only need the flags, or
+            only some header fields, of the message. The mailbox's factory
+            is not applied.
+            Raise KeyError if there if there is no message with that UID.
+        """
+        return self._lazy_message(uid, self._fetch(uid, METADATA_FETCH_ITEMS))
+
+    def get_lazy_messages(self, uids):
+        """ Return a dict that maps the UIDs in the iterable 'uids' to
+            LazyImapMessage objects, as returned by get_lazy_message. The
+            imap flags, internal dates and sizes of all messages are
+            fetched with a single UID FETCH command per chunk of UIDs (see
+            ImapSequenceSet.split_sequence_set), and the commands are
+            pipelined if possible (see _send_fetch). UIDs for which there
+            is no message are not included in the result.
+        """
+        result = {}
+        responses = [self._send_fetch(sequenceset, METADATA_FETCH_ITEMS)
+                     for sequenceset in split_sequence_set(uids)]
+        for fetched in [response() for response in responses]:
+            for (uid, items) in fetched.items():
+                result[uid] = self._lazy_message(uid, items)
+        return result
+
+    def _lazy_message(self, uid, items):
+        """ Return a LazyImapMessage for the message with UID, with the
+            imap flags, internal date and size from the data items returned
+            by _fetch
+        """
+        key = str(uid) # imaplib only sends strings
+        result = LazyImapMessage(int(uid),
+                            lambda section: self._fetch_lazy_section(key, section))
+        self._set_metadata(result, items)
+        return result
+
+    def _fetch_lazy_section(self, uid, section):
+        """ Return the content of BODY[section] for a LazyImapMessage. The
+            complete message is looked up in the cache first, and stored in
+            the cache after it has been downloaded.
+        """
+        if section == '':
+            return self._cache_message(uid)
+        return self.get_section(uid, section)
 
     def __getitem__(self, uid):
         """ Return an ImapMessage object created from the message with UID.
@@ -349,16 +893,79 @@ class ImapMailbox(Mailbox):
         return self._cache_message(uid)
 
     def get_file(self, uid):
-        """ Return a cStringIO.StringIO of the message corresponding
-            to key, or raise a KeyError exception if no such message
-            exists.
+        """ Return a seekable file object, opened for reading in binary
+            mode, of the message corresponding to key, or raise a KeyError
+            exception if no such message exists.
+            If the message is in the cache, it is returned as an in-memory
+            file. If it is in the disk cache only, the file in the disk
+            cache is returned. Otherwise, the message is downloaded in
+            chunks (see download_to) into a tempfile.SpooledTemporaryFile,
+            which is kept in memory up to 'spool_threshold' bytes and
+            moved to disk beyond that. Messages larger than spool_threshold
+            are therefore never held in memory as a whole; they are not
+            stored in the caches either.
+        """
+        key = self._cache_key(uid)
+        rfc822string = self.cache.get(key)
+        if rfc822string is not None:
+            if not isinstance(rfc822string, bytes):
+                rfc822string = rfc822string.encode('latin-1')
+            return BytesIO(rfc822string)
+        if self.disk_cache is not None:
+            cachefile = self.disk_cache.open(key)
+            if cachefile is not None:
+                return cachefile
+        result = SpooledTemporaryFile(max_size=self.spool_threshold)
+        try:
+            self.download_to(uid, result)
+        except:
+            result.close()
+            raise
+        if result.tell() <= self.spool_threshold:
+            result.seek(0)
+            self._store_cache(key, result.read())
+        result.seek(0)
+        return result
+
+    def _uid_index(self):
+        """ Return the sorted array of all UIDs in the mailbox that is
+            maintained in the 'uids' attribute of the server. If the array
+            is unknown, it is initialized from a search; if the server
+            reported new messages, their UIDs are added.
         """
-        return StringIO(self._cache_message(uid))
+        uids = self._server.uids
+        if uids is not None and self._server.exists is not None \
+        and len(uids) < self._server.exists:
+            if len(uids) > 0:
+                last = uids[-1]
+                new_uids = [uid for uid in self.search("UID %s:*" % (last+1))
+                            if uid > last]
+            else:
+                new_uids = self.search("ALL")
+            uids = self._server.uids
+            if uids is not None:
+                uids.extend(sorted(new_uids))
+                if len(uids) != self._server.exists:
+                    uids = None
+        if uids is None or self._server.exists is None:
+            uids = array(UID_TYPECODE, self.search("ALL", as_set=True))
+            self._server.uids = uids
+            self._server.exists = len(uids)
+        return uids
 
     def has_key(self, uid):
         """ Return True if key corresponds to a message, False otherwise.
+            The lookup is done in the index of UIDs that is kept up to date
+            from the EXISTS and EXPUNGE responses of the server, so usually
+            no command needs to be sent.
         """
-        return (uid in self.search('ALL'))
+        try:
+            uid = int(uid)
+        except (TypeError, ValueError):
+            return False
+        uids = self._uid_index()
+        index = bisect_left(uids, uid)
+        return (index < len(uids)) and (uids[index] == uid)
 
     def __contains__(self, uid):
         """ Return True if key corresponds to a message, False otherwise.
@@ -366,15 +973,24 @@ class ImapMailbox(Mailbox):
         return self.has_key(uid)
 
     def __len__(self):
-        """ Return a count of messages in the mailbox. """
-        return len(self.search('ALL'))
+        """ Return a count of messages in the mailbox.
+            The count is tracked by the server from the EXISTS and EXPUNGE
+            responses, so usually no command needs to be sent. If the count
+            is unknown, the UIDs of all messages are requested with a
+            UID SEARCH (STATUS must not be used on the selected mailbox).
+        """
+        if self._server.exists is None:
+            self._uid_index()
+        return self._server.exists
 
     def clear(self):
         """ Delete all messages from the mailbox and expunge"""
         if self.readonly:
             raise ReadOnlyError("Tried to clear read-only mailbox")
-        for uid in self.get_all_uids():
-            self.discard(uid)
+        if self.trash is None:
+            self.add_imapflag_many(self.get_all_uids(), "\\Deleted")
+        else:
+            self.move_many(self.get_all_uids(), self.trash)
         self.expunge()
 
     def pop(self, uid, default=None):
@@ -445,23 +1061,81 @@ class ImapMailbox(Mailbox):
 
     def get_header(self, uid):
         """ Return an ImapMessage object containing only the Header
-            of the message with UID.
+            of the message with UID. The header, imap flags, internal date
+            and size are fetched in a single round trip.
             Raise KeyError if there if there is no message with that UID.
         """
-        (code, data) = self._server.uid('fetch', uid, "(BODY.PEEK[HEADER])")
-        if code != 'OK':
-            raise ImapNotOkError("%s in fetch_header(%s)" % (code, uid))
-        try:
-            rfc822string = data[0][1]
-        except TypeError:
+        items = self._fetch(uid, METADATA_FETCH_ITEMS + " BODY.PEEK[HEADER]")
+        rfc822string = get_body_item(items, 'HEADER')
+        if rfc822string is None:
             raise KeyError("No UID %s in get_header" % uid)
-        result = ImapMessage(rfc822string)
-        result.set_imapflags(self.get_imapflags(uid))
-        result.internaldate = self.get_internaldate(uid)
-        result.size = self.get_size(uid)
-        if self._factory is ImapMessage:
-            return result
-        return self._factory(result)
+        return self._message_from_items(rfc822string, items)
+
+    def get_bodystructure(self, uid):
+        """ Return the MIME structure of the message with UID as a tree of
+            ProcImap.ImapBodyPart.ImapBodyPart instances, parsed from the
+            BODYSTRUCTURE data item. Only the structure is downloaded; the
+            content of each part is fetched (see get_section) when its
+            get_payload method is called for the first time. E.g.
+
+                >>> for part in mailbox.get_bodystructure(uid).walk():
+                ...     if part.get_content_type() == 'text/plain':
+                ...         text = part.get_payload(decode=True)
+
+            downloads only the text/plain parts of the message.
+            Raise KeyError if there if there is no message with that UID.
+        """
+        items = self._fetch(uid, "BODYSTRUCTURE")
+        if items.get('BODYSTRUCTURE') is None:
+            raise KeyError("No UID %s in get_bodystructure" % uid)
+        try:
+            return parse_bodystructure(items['BODYSTRUCTURE'],
+                                 lambda section: self.get_section(uid, section))
+        except ResponseParseError:
+            raise ImapNotOkError("received unparsable response.")
+
+    def get_section(self, uid, section):
+        """ Return the content of BODY[section] of the message with UID,
+            e.g. get_section(uid, '1.2') for the second part of the first
+            part of a multipart message (see RFC3501). The message is not
+            marked as \\Seen.
+            Raise KeyError if there if there is no message with that UID.
+        """
+        items = self._fetch(uid, "BODY.PEEK[%s]" % section)
+        result = get_body_item(items, section)
+        if result is None:
+            raise KeyError("No UID %s in get_section" % uid)
+        return result
+
+    def get_headers(self, uids, fields=None):
+        """ Return a dict that maps the UIDs in 'uids' to ImapMessage
+            objects containing only the header of the message with that
+            UID, together with its imap flags, internal date, and size.
+            If 'fields' is given, the headers contain only the requested
+            header fields; fields is a string of header fields separated by
+            spaces, e.g. 'From SUBJECT date', as for get_fields.
+            'uids' may be a list of UIDs, or a string containing a sequence
+            set such as '1001:1200'. The headers are downloaded in batches
+            of self.prefetch messages, each batch in a single UID FETCH
+            command. UIDs for which there is no message are not included in
+            the result.
+        """
+        return self._get_headers(uids, fields)
+
+    def _get_headers(self, uids, fields=None, convert=True):
+        """ Return the headers as get_headers does. If convert is False,
+            the headers are ImapMessage instances even if the mailbox has a
+            different factory, as needed for sorting and threading them
+            (see ProcImap.ImapSort).
+        """
+        if fields is None:
+            section = 'HEADER'
+        else:
+            section = 'HEADER.FIELDS (%s)' % fields
+        result = {}
+        for (uid, message) in self._iterfetch(uids, section, convert):
+            result[uid] = message
+        return result
 
     def get_fields(self, uid, fields):
         """ Return an mailbox.Message object containing only the requested
@@ -560,46 +1234,75 @@ class ImapMailbox(Mailbox):
             downloaded) if the targetmailbox is on the same server.
             Do nothing and return None if there if there is no message with
             that UID.
-            Unless 'exact' is set to True, the return value will be None if
-            the targetmailbox is an ImapMailbox. This is because finding out
-            the new UID of the copied message on an IMAP server is non-trivial.
-            Giving 'exact' as True means that additional work will be done to
-            find the accurate result. This operation can be relatively
-            expensive. If targetmailbox is not an ImapMailbox, the value of
-            'exact' is irrelevant, and the return value will always be
-            accurate.
+            If the targetmailbox is on the same server, the target-UID is
+            taken from the COPYUID response of servers that support the
+            UIDPLUS extension (RFC4315); for other servers, the return value
+            is None. If the targetmailbox is an ImapMailbox on a different
+            server, the return value is that of its add method. If
+            targetmailbox is not an ImapMailbox, the return value will
+            always be accurate. The 'exact' parameter is ignored; it is only
+            kept for backwards compatibility.
+            See copy_many for copying many messages efficiently.
         """
-        result = None
+        return self.copy_many([uid], targetmailbox)[int(uid)]
+
+    def copy_many(self, uids, targetmailbox):
+        """ Copy all messages with UIDs in the iterable uids to the
+            targetmailbox, and return a dict that maps each of the UIDs to
+            the key that was assigned to the copied message in the
+            targetmailbox, or to None if that key is unknown (including the
+            case that there is no message with that UID).
+            targetmailbox can be given as for the copy method, and the
+            discussion of the return value there applies here as well.
+            If the targetmailbox is on the same server, one UID COPY command
+            is sent per chunk of UIDs (see
+            ImapSequenceSet.split_sequence_set). Otherwise, the messages are
+            downloaded in batches (see the 'prefetch' attribute) and added
+            to the targetmailbox.
+        """
+        uids = UIDSet(uids)
+        result = dict.fromkeys(uids)
         if isinstance(targetmailbox, ImapMailbox):
             if targetmailbox.server == self._server:
                 targetmailbox = targetmailbox.name # set as string
         if isinstance(targetmailbox, Mailbox):
             if self != targetmailbox:
                 targetmailbox.lock()
-                result = targetmailbox.add(self[uid])
+                for (uid, message) in self._iterfetch(uids):
+                    result[uid] = targetmailbox.add(message)
                 if isinstance(targetmailbox, ImapMailbox):
-                    result = None
                     targetmailbox.flush()
-                    if exact:
-                        pass
-                        # TODO: get more exact result
                 targetmailbox.unlock()
+            else:
+                return dict(zip(uids, uids))
         elif isinstance(targetmailbox, str):
             if targetmailbox != self.name:
-                (code, data) = self._server.uid('copy', uid, targetmailbox)
-                if code != 'OK':
-                    raise ImapNotOkError("%s in copy: %s" % (code, data))
-                if exact:
-                    pass
-                    # TODO: get more exact result
-
+                result.update(self._uid_copy_many('copy', uids, targetmailbox))
             else:
-                return uid
+                return dict(zip(uids, uids))
         else:
             raise TypeError("targetmailbox in copy is of unknown type.")
         return result
 
-
+    def _uid_copy_many(self, command, uids, targetmailbox):
+        """ Send a UID COPY or UID MOVE command (depending on 'command') to
+            the server for every chunk of uids, with the named mailbox
+            targetmailbox as the target. Return a dict mapping the UIDs to
+            the target UIDs reported in COPYUID responses (which contains
+            only the UIDs that the server reported).
+        """
+        result = {}
+        for sequenceset in split_sequence_set(uids):
+            self._server.response('COPYUID') # discard stale responses
+            (code, data) = self._server.uid(command, sequenceset,
+                                            targetmailbox)
+            if code != 'OK':
+                raise ImapNotOkError("%s in %s: %s" % (code, command, data))
+            try:
+                result.update(parse_copyuid(self._server.response('COPYUID')[1]))
+            except ResponseParseError:
+                pass # target UIDs remain unknown
+        return result
 
     def move(self, uid, targetmailbox, exact=False):
         """ Copy the message with UID to the targetmailbox, delete it in the
@@ -608,20 +1311,42 @@ class ImapMailbox(Mailbox):
             The discussions of the copy method concerning 'targetmailbox' and
             'exact' apply here as well.
             Do nothing and return None if there if there is no message with that UID.
+            See move_many for moving many messages efficiently.
         """
-        result = None
         if self.readonly:
             raise ReadOnlyError("Tried to move message from read-only mailbox")
         if (targetmailbox != self) and (targetmailbox != self.name):
-            result = self.copy(uid, targetmailbox, exact)
-            (code, data) = self._server.uid('store', uid, \
-                                           '+FLAGS', "(\\Deleted)")
-            if code != 'OK':
-                raise ImapNotOkError("%s in move: %s" % (code, data))
+            return self.move_many([uid], targetmailbox)[int(uid)]
         else:
             return uid
-        return result
 
+    def move_many(self, uids, targetmailbox):
+        """ Move all messages with UIDs in the iterable uids to the
+            targetmailbox, and return a dict that maps each of the UIDs to
+            the key that was assigned to the moved message in the
+            targetmailbox, or to None if that key is unknown.
+            If the targetmailbox is on the same server, and the server
+            supports the MOVE extension (RFC6851), one UID MOVE command is
+            sent per chunk of UIDs. Otherwise, the messages are copied with
+            copy_many, and then flagged as \\Deleted in the original
+            mailbox.
+        """
+        if self.readonly:
+            raise ReadOnlyError("Tried to move message from read-only mailbox")
+        uids = UIDSet(uids)
+        if isinstance(targetmailbox, ImapMailbox):
+            if targetmailbox.server == self._server:
+                targetmailbox = targetmailbox.name # set as string
+        if (targetmailbox == self) or (targetmailbox == self.name):
+            return dict(zip(uids, uids))
+        if isinstance(targetmailbox, str) \
+        and self._server.has_capability('MOVE'):
+            result = dict.fromkeys(uids)
+            result.update(self._uid_copy_many('move', uids, targetmailbox))
+        else:
+            result = self.copy_many(uids, targetmailbox)
+            self.add_imapflag_many(uids, "\\Deleted")
+        return result
 
     def discard(self, uid, exact=False):
         """ If trash folder is defined, move the message with UID to 
@@ -652,7 +1377,7 @@ class ImapMailbox(Mailbox):
         """
         if self.readonly:
             raise ReadOnlyError("Tried to remove from read-only mailbox")
-        if uid not in self.search("ALL"):
+        if not self.has_key(uid):
             raise KeyError("No UID %s" % uid)
         return self.discard(uid, exact)
 
@@ -671,22 +1396,25 @@ class ImapMailbox(Mailbox):
 
     def iterkeys(self):
         """ Return an iterator over all UIDs
-            This is an iterator over the list of UIDs at the time iterkeys()
+            This is an iterator over the UIDs at the time iterkeys()
             is a called.
         """
-        return iter(self.search("ALL"))
+        return iter(self.search("ALL", as_set=True))
 
     def keys(self):
-        """ Return a list of all UIDs """
+        """ Return a list of all UIDs. Use search("ALL", as_set=True) to
+            get them as a UIDSet instead.
+        """
         return self.search("ALL")
 
     def itervalues(self):
         """ Return an iterator over all messages. The messages are
             represented as instances of ImapMessage unless a custom message
             factory was specified when the Mailbox instance was initialized.
+            The messages are downloaded in batches of self.prefetch messages.
         """
-        for uid in self.search("ALL"):
-            yield self[uid]
+        for (uid, message) in self._iterfetch(self.search("ALL", as_set=True)):
+            yield message
 
     def __iter__(self):
         """ Return an iterator over all messages.
@@ -710,9 +1438,9 @@ class ImapMailbox(Mailbox):
     def iteritems(self):
         """ Return an iterator over (uid, message) pairs,
             where uid is a key and message is a message representation.
+            The messages are downloaded in batches of self.prefetch messages.
         """
-        for uid in self.keys():
-            yield((uid, self[uid]))
+        return self._iterfetch(self.search("ALL", as_set=True))
 
     def items(self):
         """ Return a list (uid, message) pairs,
@@ -720,52 +1448,134 @@ class ImapMailbox(Mailbox):
             Beware that this method can be extremely expensive in terms
             of time, bandwidth, and memory.
         """
-        result = []
-        for uid in self.keys():
-            result.append((uid, self[uid]))
-        return result
+        return list(self.iteritems())
 
     def add(self, message):
         """ Add the message to mailbox.
             Message can be an instance of email.Message.Message
             (including instaces of mailbox.Message and its subclasses );
             or an open file handle or a string containing an RFC822 message.
-            Return the highest UID in the mailbox, which should be, but
-            is not guaranteed to be, the UID of the message that was added.
+            Return the UID of the message that was added, as reported by
+            servers that support the UIDPLUS extension (RFC4315). For other
+            servers, return the highest UID in the mailbox, which should be,
+            but is not guaranteed to be, the UID of the message that was
+            added.
             Raise ImapNotOkError if a non-OK response is received from
             the server
         """
         if self.readonly:
             raise ReadOnlyError("Tried to add to a read-only mailbox")
-        message = ImapMessage(message)
-        flags = message.flagstring()
-        date_time = message.internaldatestring()
-        memoryfile = StringIO()
-        generator = Generator(memoryfile, mangle_from_=False)
-        generator.flatten(message)
-        message_str = memoryfile.getvalue()
+        (flags, date_time, message_str) = self._append_args(message)
         (code, data) = self._server.append(self.name, flags, \
                                       date_time, message_str)
         if code != 'OK':
             raise ImapNotOkError("%s in add: %s" % (code, data))
+        appenduids = self._appenduids(data, 1)
+        if appenduids is not None:
+            return appenduids[0]
         try:
             return self.get_all_uids()[-1]
         except IndexError:
             return 0
 
+    def add_many(self, messages):
+        """ Add all messages in the iterable 'messages' to the mailbox, and
+            return the list of their UIDs, in the same order. The messages
+            can be given in any form accepted by the add method. The UIDs
+            are those reported by servers that support the UIDPLUS extension
+            (RFC4315); for other servers, the list contains None for each
+            message.
+            The messages are uploaded in batches of at most
+            APPEND_BATCH_SIZE messages or APPEND_BATCH_BYTES bytes. If the
+            server supports the MULTIAPPEND extension (RFC3502), each batch
+            is uploaded with a single APPEND command. Otherwise, the APPEND
+            commands of a batch are pipelined if the server supports
+            LITERAL+ (RFC7888), see ImapServer.append_pipelined.
+            Raise ImapNotOkError if a non-OK response is received from the
+            server. With MULTIAPPEND, none of the messages in the failed
+            batch have been added in that case.
+        """
+        if self.readonly:
+            raise ReadOnlyError("Tried to add to a read-only mailbox")
+        result = []
+        batch = []
+        batchbytes = 0
+        for message in messages:
+            batch.append(self._append_args(message))
+            batchbytes += len(batch[-1][2])
+            if len(batch) >= APPEND_BATCH_SIZE \
+            or batchbytes >= APPEND_BATCH_BYTES:
+                result.extend(self._add_batch(batch))
+                batch = []
+                batchbytes = 0
+        if batch:
+            result.extend(self._add_batch(batch))
+        return result
+
+    def _add_batch(self, batch):
+        """ Upload a batch of messages, given as list of arguments for
+            ImapServer.append, and return the list of their UIDs as
+            described in add_many
+        """
+        if self._server.has_capability('MULTIAPPEND'):
+            (code, data) = self._server.multiappend(self.name, batch)
+            if code != 'OK':
+                raise ImapNotOkError("%s in add_many: %s" % (code, data))
+            appenduids = self._appenduids(data, len(batch))
+            if appenduids is None:
+                return [None] * len(batch)
+            return appenduids
+        result = []
+        for (code, data) in self._server.append_pipelined(self.name, batch):
+            if code != 'OK':
+                raise ImapNotOkError("%s in add_many: %s" % (code, data))
+            appenduids = self._appenduids(data, 1)
+            if appenduids is None:
+                result.append(None)
+            else:
+                result.append(appenduids[0])
+        return result
+
+    def _append_args(self, message):
+        """ Return the flags, internal date and RFC822 text of message as
+            strings, as they are passed to ImapServer.append
+        """
+        message = ImapMessage(message)
+        flags = message.flagstring()
+        date_time = message.internaldatestring()
+        memoryfile = StringIO()
+        generator = Generator(memoryfile, mangle_from_=False)
+        generator.flatten(message)
+        return (flags, date_time, memoryfile.getvalue())
+
+    def _appenduids(self, data, count):
+        """ Return the list of UIDs from the APPENDUID response code in the
+            data of the tagged response to an APPEND command, or None if
+            the response does not contain the UIDs of 'count' messages.
+        """
+        appenduid = get_response_code(data, 'APPENDUID')
+        if appenduid is None or len(appenduid) != 2:
+            return None
+        try:
+            result = expand_sequence_set(appenduid[1])
+        except ValueError:
+            return None
+        if len(result) != count:
+            return None
+        return result
+
 
     def add_imapflag(self, uid, *flags):
-        """ Add imap flag to message with UID.
+        """ Add imap flags to message with UID.
         """
         if self.readonly:
             raise ReadOnlyError(
                        "Tried to add imap flag for message in read-only mailbox")
-        for flag in flags:
-            (code, data) = self._server.uid('store', uid, '+FLAGS', \
-                                           "(%s)" % flag )
-            if code != 'OK':
-                raise ImapNotOkError("%s in add_flags(%s, %s): %s" \
-                                                       % (uid, flag, code, data))
+        (code, data) = self._server.uid('store', uid, '+FLAGS', \
+                                       "(%s)" % ' '.join(flags))
+        if code != 'OK':
+            raise ImapNotOkError("%s in add_flags(%s, %s): %s" \
+                                                   % (code, uid, flags, data))
 
     def remove_imapflag(self, uid, *flags):
         """ Remove imap flags from message with UID
@@ -773,12 +1583,11 @@ class ImapMailbox(Mailbox):
         if self.readonly:
             raise ReadOnlyError(
                    "Tried to remove imap flag from message in read-only mailbox")
-        for flag in flags:
-            (code, data) = self._server.uid('store', uid, '-FLAGS', \
-                                           "(%s)" % flag )
-            if code != 'OK':
-                raise ImapNotOkError("%s in remove_flag(%s, %s): %s" \
-                                                       % (uid, flag, code, data))
+        (code, data) = self._server.uid('store', uid, '-FLAGS', \
+                                       "(%s)" % ' '.join(flags))
+        if code != 'OK':
+            raise ImapNotOkError("%s in remove_flag(%s, %s): %s" \
+                                                   % (code, uid, flags, data))
 
     def set_imapflags(self, uid, flags):
         """ Set imap flags for message with UID
@@ -797,6 +1606,67 @@ class ImapMailbox(Mailbox):
             raise ImapNotOkError("%s in set_imapflags(%s, %s): %s" \
                                                       % (code, uid, flags, data))
 
+    def _store_many(self, uids, command, flags):
+        """ Send UID STORE commands with the given command ('+FLAGS',
+            '-FLAGS', or 'FLAGS') and flags for all messages in uids. The
+            UIDs are compressed into sequence sets, and one command is sent
+            for every sequence set (see ImapSequenceSet.split_sequence_set).
+            The .SILENT variant of the command is used, so that the server
+            does not send back the new flags of every message. If the
+            server supports ImapServer.uid_async, up to STORE_PIPELINE_DEPTH
+            commands are sent before the response to the oldest of them is
+            read.
+        """
+        flagstring = "(%s)" % ' '.join(flags)
+        arguments = [('store', sequenceset, command + '.SILENT', flagstring)
+                     for sequenceset in split_sequence_set(uids)]
+        if self._server.has_uid_async():
+            futures = [] # commands that have been sent, oldest first
+            responses = []
+            for args in arguments:
+                if len(futures) >= STORE_PIPELINE_DEPTH:
+                    responses.append(futures.pop(0).result())
+                futures.append(self._server.uid_async(*args))
+            responses.extend([future.result() for future in futures])
+        else:
+            responses = [self._server.uid(*args) for args in arguments]
+        for (code, data) in responses:
+            if code != 'OK':
+                raise ImapNotOkError("%s in %s %s: %s" \
+                                             % (code, command, flagstring, data))
+
+    def add_imapflag_many(self, uids, *flags):
+        """ Add imap flags to all messages with UIDs in the iterable uids.
+            All flags are added with a single UID STORE command per chunk
+            of UIDs, see _store_many.
+        """
+        if self.readonly:
+            raise ReadOnlyError(
+                      "Tried to add imap flag for messages in read-only mailbox")
+        self._store_many(uids, '+FLAGS', flags)
+
+    def remove_imapflag_many(self, uids, *flags):
+        """ Remove imap flags from all messages with UIDs in the iterable
+            uids. All flags are removed with a single UID STORE command per
+            chunk of UIDs, see _store_many.
+        """
+        if self.readonly:
+            raise ReadOnlyError(
+                  "Tried to remove imap flag from messages in read-only mailbox")
+        self._store_many(uids, '-FLAGS', flags)
+
+    def set_imapflags_many(self, uids, flags):
+        """ Set imap flags for all messages with UIDs in the iterable uids.
+            flags must be an iterable of flags, or a string, as for
+            set_imapflags.
+        """
+        if self.readonly:
+            raise ReadOnlyError(
+                     "Tried to set imap flags for messages in read-only mailbox")
+        if isinstance(flags, str):
+            flags = [flags]
+        self._store_many(uids, 'FLAGS', flags)
+
     def close(self):
         """ Flush mailbox, close connection to server """
         self.flush()
@@ -810,4 +1680,5 @@ class ImapMailbox(Mailbox):
         if self.readonly:
             raise ReadOnlyError("Tried to expunge read-only mailbox")
         self._server.expunge()
+        self.cache.invalidate(self._server, self.name)
 
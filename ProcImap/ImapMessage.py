@@ -21,9 +21,11 @@
 """ This module contains the ImapMessage class, which derives from
     mailbox.Message. The full interface of mailbox.Message including
     conversion to and from other subclasses of mailbox.Message is
-    implemented.
+    implemented. The LazyImapMessage subclass downloads the content of a
+    message only when it is accessed.
 """
 
+import copy
 import imaplib
 import mailbox
 import time
@@ -201,6 +203,113 @@ class ImapMessage(mailbox.Message):
         self.internaldate = imaplib.Internaldate2tuple(internaldatestring)
 
 
+_HEADER_ATTRIBUTES = ('_headers', '_unixfrom')
+_BODY_ATTRIBUTES = ('_payload', '_charset', 'preamble', 'epilogue', 'defects',
+                    '_default_type')
+
+
+class LazyImapMessage(ImapMessage):
+    """ An ImapMessage whose header and body are only downloaded when they
+        are needed. The imap flags, internal date and size are set when the
+        instance is created. The header is downloaded on the first access to
+        a header field (e.g. message['Subject']), the body on the first
+        access to the payload (e.g. get_payload, as_string, walk).
+
+        Class specific attributes are:
+
+        uid             the UID of the message on the server
+    """
+    def __init__(self, uid, fetch_section):
+        """ Initialize a message without header and body. fetch_section is
+            a function that takes a section specifier ('HEADER', 'TEXT' or
+            '' for the whole message) and returns the content of that
+            section of the message from the server.
+        """
+        ImapMessage.__init__(self)
+        self.uid = uid
+        self._fetch_section = fetch_section
+        self._headertext = None
+        for name in _HEADER_ATTRIBUTES + _BODY_ATTRIBUTES:
+            if name in self.__dict__:
+                del self.__dict__[name]
+
+    def __getattr__(self, name):
+        """ Download the header or the body if one of their attributes is
+            accessed for the first time
+        """
+        if name in _HEADER_ATTRIBUTES:
+            self._load_header()
+        elif name in _BODY_ATTRIBUTES:
+            self._load_body()
+        else:
+            raise AttributeError(name)
+        return self.__dict__[name]
+
+    def _load_header(self):
+        """ Download and parse the header """
+        if '_headers' in self.__dict__:
+            return
+        self._headertext = self._fetch_section('HEADER')
+        self._set_attributes(self._headertext, _HEADER_ATTRIBUTES)
+
+    def _load_body(self):
+        """ Download and parse the body. If the header was not downloaded
+            yet, the whole message is downloaded.
+        """
+        if '_payload' in self.__dict__:
+            return
+        if self._headertext is None:
+            self._set_attributes(self._fetch_section(''),
+                                 _HEADER_ATTRIBUTES + _BODY_ATTRIBUTES)
+        else:
+            # headers may have been modified, so only parse the body
+            self._set_attributes(self._headertext + self._fetch_section('TEXT'),
+                                 _BODY_ATTRIBUTES)
+
+    def _set_attributes(self, rfc822string, names):
+        """ Parse rfc822string and set the named attributes to the values
+            of the parsed message, unless they are set already
+        """
+        parsed = mailbox.Message(rfc822string)
+        for name in names:
+            if name not in self.__dict__ and name in parsed.__dict__:
+                self.__dict__[name] = parsed.__dict__[name]
+
+    def load(self):
+        """ Download the header and body, if they were not downloaded yet """
+        self._load_body()
+
+    def as_string(self, *args, **kwargs):
+        """ Return the complete message as a string. The whole message is
+            downloaded at once (if the header was not downloaded before),
+            instead of the header and the body one after the other.
+        """
+        self.load()
+        return ImapMessage.as_string(self, *args, **kwargs)
+
+    def __str__(self):
+        """ Return the complete message as a string, see as_string """
+        return self.as_string()
+
+    if hasattr(ImapMessage, 'as_bytes'): # Python 3
+        def as_bytes(self, *args, **kwargs):
+            """ Return the complete message as bytes, see as_string """
+            self.load()
+            return ImapMessage.as_bytes(self, *args, **kwargs)
+
+        def __bytes__(self):
+            """ Return the complete message as bytes, see as_string """
+            return self.as_bytes()
+
+    def __deepcopy__(self, memo):
+        """ Return a deep copy of the completely downloaded message """
+        self.load()
+        result = copy.copy(self)
+        memo[id(self)] = result
+        result.__dict__ = copy.deepcopy(self.__dict__, memo)
+        return result
+
+
 
 # Helper functions for conversion to/from other mailbox.Message instances
 
@@ -0,0 +1,305 @@
+############################################################################
+#    Copyright (C) 2008 by Michael Goerz                                   #
+#    http://www.physik.fu-berlin.de/~goerz                                 #
+#                                                                          #
+#    This program is free software; you can redistribute it and#or modify  #
+#    it under the terms of the GNU General Public License as published by  #
+#    the Free Software Foundation; either version 3 of the License, or     #
+#    (at your option) any later version.                                   #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU General Public License     #
+#    along with this program; if not, write to the                         #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+############################################################################
+
+""" This module contains functions for parsing the raw data that the IMAP
+    server sends back in response to a command, as it is returned by
+    imaplib/imaplib2. Only the parts of RFC3501 that are needed by the
+    ImapMailbox class are implemented.
+"""
+
+import imaplib
+import re
+
+from ProcImap.ImapSequenceSet import expand_sequence_set, UIDSet
+
+
+class ResponseParseError(Exception):
+    """ Raised if a response from the server cannot be parsed """
+    pass
+
+
+class _Literal:
+    """ Wrapper around the data of an IMAP literal, so that the tokenizer
+        can tell it apart from the surrounding response text.
+    """
+    def __init__(self, data):
+        self.data = data
+
+
+_LITERAL_SIZE_PATTERN = re.compile(r'\{\d+\}\s*$')
+
+_TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+        (?P<open>\()                        # start of a parenthesized list
+      | (?P<close>\))                       # end of a parenthesized list
+      | "(?P<quoted>(?:[^"\\]|\\.)*)"       # quoted string
+      | (?P<atom>[^\s()"\[]+                # atom, e.g. FLAGS or \\Seen
+          (?:\[[^\]]*\](?:<\d+>)?)?)        # optional section, e.g. BODY[1]
+    )""", re.VERBOSE)
+
+
+def _text(data):
+    """ Return data as a native string (response text may be bytes in
+        Python 3)
+    """
+    if not isinstance(data, str):
+        data = data.decode('latin-1')
+    return data
+
+
+def _parts(data):
+    """ Flatten the list returned by imaplib into a sequence of response
+        text strings and _Literal instances
+    """
+    for item in data:
+        if item is None:
+            continue
+        if isinstance(item, tuple):
+            yield _LITERAL_SIZE_PATTERN.sub('', _text(item[0]))
+            yield _Literal(item[1])
+        else:
+            yield _text(item)
+
+
+def _tokens(data):
+    """ Generate the tokens contained in data. Tokens are '(' and ')', or
+        strings for atoms and quoted strings, None for NIL, or _Literal
+        instances.
+    """
+    for part in _parts(data):
+        if isinstance(part, _Literal):
+            yield part
+            continue
+        position = 0
+        while True:
+            match = _TOKEN_PATTERN.match(part, position)
+            if match is None:
+                if part[position:].strip() != '':
+                    raise ResponseParseError("cannot parse '%s'"
+                                             % part[position:])
+                break
+            position = match.end()
+            if match.group('open'):
+                yield '('
+            elif match.group('close'):
+                yield ')'
+            elif match.group('quoted') is not None:
+                yield re.sub(r'\\(.)', r'\1', match.group('quoted'))
+            elif match.group('atom').upper() == 'NIL':
+                yield None
+            else:
+                yield match.group('atom')
+
+
+def parse_list(data):
+    """ Parse the response data into a list of values. Parenthesized lists
+        become (nested) python lists, atoms and quoted strings become
+        strings, and NIL becomes None. The data of literals is returned
+        unchanged.
+    """
+    stack = [[]]
+    for token in _tokens(data):
+        if token == '(':
+            stack.append([])
+        elif token == ')':
+            if len(stack) < 2:
+                raise ResponseParseError("unbalanced parenthesis in response")
+            closed = stack.pop()
+            stack[-1].append(closed)
+        elif isinstance(token, _Literal):
+            stack[-1].append(token.data)
+        else:
+            stack[-1].append(token)
+    if len(stack) != 1:
+        raise ResponseParseError("unbalanced parenthesis in response")
+    return stack[0]
+
+
+def iter_fetch_responses(data):
+    """ Generate (message number, items) pairs from the data returned by
+        a FETCH or UID FETCH command. 'items' is a dict that maps the
+        (upper case) names of the returned data items to their values,
+        e.g. {'UID': '12', 'FLAGS': ['\\Seen'], 'RFC822.SIZE': '4286'}
+    """
+    values = parse_list(data)
+    if len(values) % 2 != 0:
+        raise ResponseParseError("incomplete FETCH response")
+    for index in range(0, len(values), 2):
+        (msgno, itemlist) = (values[index], values[index+1])
+        if not isinstance(itemlist, list) or len(itemlist) % 2 != 0:
+            raise ResponseParseError("malformed FETCH response")
+        items = {}
+        for item_index in range(0, len(itemlist), 2):
+            name = itemlist[item_index].upper()
+            items[name] = itemlist[item_index+1]
+        try:
+            yield (int(msgno), items)
+        except (TypeError, ValueError):
+            raise ResponseParseError("malformed message number in FETCH")
+
+
+def parse_fetch_response(data):
+    """ Return a dict that maps UIDs (as integers) to dicts of data items,
+        as described in iter_fetch_responses. FETCH responses that do not
+        include the UID (e.g. unsolicited flag updates) are ignored. If the
+        server splits the data items for one message across several FETCH
+        responses, they are merged.
+    """
+    result = {}
+    for (msgno, items) in iter_fetch_responses(data):
+        if 'UID' not in items:
+            continue
+        try:
+            uid = int(items['UID'])
+        except (TypeError, ValueError):
+            raise ResponseParseError("malformed UID in FETCH response")
+        result.setdefault(uid, {}).update(items)
+    return result
+
+
+def get_body_item(items, section=''):
+    """ Return the value of the BODY[section] data item in items, or None
+        if there is no such item. The section is compared case-insensitively,
+        and if it starts with 'HEADER.FIELDS', the list of field names is
+        ignored (servers do not necessarily echo it back verbatim).
+    """
+    section = section.upper()
+    for (name, value) in items.items():
+        if not name.startswith('BODY['):
+            continue
+        returned = name[5:name.index(']')]
+        if returned == section:
+            return value
+        if section.startswith('HEADER.FIELDS') \
+        and returned.split(' ')[0] == section.split(' ')[0]:
+            return value
+    if section == '':
+        return items.get('RFC822', None)
+    if section == 'HEADER':
+        return items.get('RFC822.HEADER', None)
+    return None
+
+
+def get_response_code(data, name):
+    """ Return the list of arguments of the response code 'name' (e.g.
+        APPENDUID) contained in the data of a tagged response, e.g.
+        ['38505', '3955'] for 'OK [APPENDUID 38505 3955] APPEND completed'.
+        Return None if there is no such response code.
+    """
+    pattern = re.compile(r'\[%s(?: (?P<args>[^\]]*))?\]' % re.escape(name),
+                         re.IGNORECASE)
+    for item in data:
+        if item is None or isinstance(item, tuple):
+            continue
+        match = pattern.search(_text(item))
+        if match:
+            return (match.group('args') or '').split()
+    return None
+
+
+def parse_copyuid(data):
+    """ Return a dict mapping source UIDs to target UIDs from the data of
+        COPYUID response codes (UIDPLUS extension, RFC4315), as returned by
+        the response('COPYUID') method of imaplib, e.g.
+        ['38505 304,319:320 3956:3958'].
+    """
+    result = {}
+    for item in data:
+        if item is None:
+            continue
+        args = _text(item).split()
+        if len(args) != 3:
+            raise ResponseParseError("malformed COPYUID: %s" % item)
+        try:
+            source_uids = expand_sequence_set(args[1])
+            target_uids = expand_sequence_set(args[2])
+        except ValueError:
+            raise ResponseParseError("malformed COPYUID: %s" % item)
+        if len(source_uids) != len(target_uids):
+            raise ResponseParseError("malformed COPYUID: %s" % item)
+        result.update(zip(source_uids, target_uids))
+    return result
+
+
+def parse_esearch_response(data):
+    """ Return a dict with the results of an ESEARCH response (RFC4731),
+        e.g. '(TAG "A282") UID MIN 2 MAX 47 COUNT 17 ALL 2,10:11,...'. The
+        keys are the upper case names of the returned results. The values
+        of MIN, MAX and COUNT are integers, the values of ALL (and of any
+        other result that is a sequence set) are UIDSet instances.
+        Note that servers omit MIN, MAX and ALL if no message matched.
+    """
+    result = {}
+    for item in data:
+        if item is None:
+            continue
+        values = parse_list([item])
+        if len(values) > 0 and isinstance(values[0], list):
+            values = values[1:] # search correlator, e.g. (TAG "A282")
+        if len(values) > 0 and str(values[0]).upper() == 'UID':
+            values = values[1:]
+        if len(values) % 2 != 0:
+            raise ResponseParseError("malformed ESEARCH response")
+        for index in range(0, len(values), 2):
+            (name, value) = (values[index].upper(), values[index+1])
+            try:
+                if name in ('MIN', 'MAX', 'COUNT'):
+                    result[name] = int(value)
+                else:
+                    result[name] = UIDSet.from_sequence_set(value)
+            except (TypeError, ValueError):
+                raise ResponseParseError("malformed %s in ESEARCH" % name)
+    return result
+
+
+def _thread_uids(value):
+    """ Convert the strings in the nested list value into integers """
+    if isinstance(value, list):
+        return [_thread_uids(item) for item in value]
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ResponseParseError("malformed THREAD response")
+
+
+def parse_thread_response(data):
+    """ Return the list of threads from the data of a THREAD or UID THREAD
+        response (RFC5256). Each thread is a list of UIDs (or message
+        numbers) as integers, in which each message is the parent of the
+        next one; the list may end in several lists for the subthreads of
+        the last message, e.g. [[2], [3, 6, [4, 23], [44, 7, 96]]] for
+        '(2)(3 6 (4 23)(44 7 96))'.
+    """
+    result = []
+    for thread in parse_list(data):
+        if not isinstance(thread, list):
+            raise ResponseParseError("malformed THREAD response")
+        result.append(_thread_uids(thread))
+    return result
+
+
+def internaldate_to_tuple(datestring):
+    """ Convert the value of an INTERNALDATE data item into a time tuple """
+    response = 'INTERNALDATE "%s"' % datestring
+    try:
+        return imaplib.Internaldate2tuple(response)
+    except TypeError:
+        # Python 3 imaplib works on bytes
+        return imaplib.Internaldate2tuple(response.encode('ascii'))
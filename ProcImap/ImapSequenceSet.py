@@ -0,0 +1,387 @@
+############################################################################
+#    Copyright (C) 2008 by Michael Goerz                                   #
+#    http://www.physik.fu-berlin.de/~goerz                                 #
+#                                                                          #
+#    This program is free software; you can redistribute it and#or modify  #
+#    it under the terms of the GNU General Public License as published by  #
+#    the Free Software Foundation; either version 3 of the License, or     #
+#    (at your option) any later version.                                   #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU General Public License     #
+#    along with this program; if not, write to the                         #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+############################################################################
+
+""" This module contains functions for working with IMAP sequence sets
+    (RFC3501), i.e. strings like '1:500,502,510:900' that describe a set of
+    UIDs in a single command argument, and the UIDSet class, which stores
+    a set of UIDs in the same compact form. All functions that take an
+    iterable of UIDs work on the ranges of a UIDSet directly, without
+    expanding it.
+"""
+
+from array import array
+from bisect import bisect_right
+
+UID_TYPECODE = 'I'  # array typecode for storing UIDs (32 bit unsigned)
+if array(UID_TYPECODE).itemsize < 4:
+    UID_TYPECODE = 'L'
+
+MAX_SEQUENCE_SET_LENGTH = 4000 # maximum length of a sequence set in a single
+                               # command. Many servers limit the length of a
+                               # command line to about 8000 octets.
+
+
+def uid_ranges(uids):
+    """ Return a list of (first, last) tuples of consecutive UIDs covering
+        the given iterable of UIDs. Duplicates are ignored.
+
+            >>> uid_ranges([5, 1, 2, 3, 7, 8])
+            [(1, 3), (5, 5), (7, 8)]
+    """
+    if isinstance(uids, UIDSet):
+        return uids.ranges()
+    result = []
+    for uid in sorted(set([int(uid) for uid in uids])):
+        if result and result[-1][1] == uid - 1:
+            result[-1] = (result[-1][0], uid)
+        else:
+            result.append((uid, uid))
+    return result
+
+
+def sequence_set(uids):
+    """ Return the IMAP sequence set for the given iterable of UIDs, with
+        runs of consecutive UIDs compressed into ranges.
+
+            >>> sequence_set([5, 1, 2, 3, 7, 8])
+            '1:3,5,7:8'
+    """
+    parts = []
+    for (first, last) in uid_ranges(uids):
+        if first == last:
+            parts.append(str(first))
+        else:
+            parts.append("%s:%s" % (first, last))
+    return ','.join(parts)
+
+
+def parse_sequence_set(sequenceset):
+    """ Return the list of (first, last) tuples of the ranges in the
+        sequence set, without expanding them. The '*' wildcard is not
+        supported.
+
+            >>> parse_sequence_set('304,319:320,318')
+            [(304, 304), (319, 320), (318, 318)]
+    """
+    result = []
+    for part in sequenceset.split(','):
+        if ':' in part:
+            (first, last) = [int(uid) for uid in part.split(':')]
+            if first > last:
+                (first, last) = (last, first)
+            result.append((first, last))
+        else:
+            result.append((int(part), int(part)))
+    return result
+
+
+def merge_ranges(ranges):
+    """ Return the sorted list of disjoint (first, last) tuples covering
+        the same UIDs as the given iterable of (first, last) tuples
+
+            >>> merge_ranges([(5, 7), (1, 3), (4, 4), (9, 9)])
+            [(1, 7), (9, 9)]
+    """
+    result = []
+    for (first, last) in sorted(ranges):
+        if result and first <= result[-1][1] + 1:
+            if last > result[-1][1]:
+                result[-1] = (result[-1][0], last)
+        else:
+            result.append((first, last))
+    return result
+
+
+def expand_sequence_set(sequenceset):
+    """ Return the list of UIDs described by the sequence set, in the order
+        in which they appear. Ranges are expanded in ascending order.
+        The '*' wildcard is not supported.
+
+            >>> expand_sequence_set('304,319:320,318')
+            [304, 319, 320, 318]
+    """
+    result = []
+    for (first, last) in parse_sequence_set(sequenceset):
+        result.extend(range(first, last + 1))
+    return result
+
+
+def split_sequence_set(uids, maxlength=MAX_SEQUENCE_SET_LENGTH):
+    """ Return a list of sequence sets that together cover the given
+        iterable of UIDs, each of them at most maxlength characters long
+        (unless a single range is longer than that).
+
+            >>> split_sequence_set([1, 2, 3, 5, 7, 8], maxlength=5)
+            ['1:3,5', '7:8']
+    """
+    result = []
+    current = ''
+    for (first, last) in uid_ranges(uids):
+        if first == last:
+            part = str(first)
+        else:
+            part = "%s:%s" % (first, last)
+        if current == '':
+            current = part
+        elif len(current) + 1 + len(part) <= maxlength:
+            current = "%s,%s" % (current, part)
+        else:
+            result.append(current)
+            current = part
+    if current != '':
+        result.append(current)
+    return result
+
+
+def batches(uids, batchsize):
+    """ Split the list of UIDs into lists of at most batchsize UIDs,
+        preserving the order. A UIDSet is split into UIDSets.
+    """
+    if not isinstance(uids, UIDSet):
+        uids = list(uids)
+    batchsize = max(1, int(batchsize))
+    return [uids[index:index+batchsize]
+            for index in range(0, len(uids), batchsize)]
+
+
+def _intersect_ranges(ranges, other):
+    """ Return the sorted list of (first, last) tuples of the UIDs that are
+        in both of the sorted lists of disjoint ranges
+    """
+    result = []
+    (index, other_index) = (0, 0)
+    while index < len(ranges) and other_index < len(other):
+        first = max(ranges[index][0], other[other_index][0])
+        last = min(ranges[index][1], other[other_index][1])
+        if first <= last:
+            result.append((first, last))
+        if ranges[index][1] < other[other_index][1]:
+            index += 1
+        else:
+            other_index += 1
+    return result
+
+
+def _subtract_ranges(ranges, other):
+    """ Return the sorted list of (first, last) tuples of the UIDs that are
+        in the first, but not in the second of the sorted lists of disjoint
+        ranges
+    """
+    result = []
+    other_index = 0
+    for (first, last) in ranges:
+        while other_index < len(other) and other[other_index][1] < first:
+            other_index += 1
+        index = other_index
+        while index < len(other) and other[index][0] <= last:
+            if other[index][0] > first:
+                result.append((first, other[index][0] - 1))
+            first = max(first, other[index][1] + 1)
+            index += 1
+        if first <= last:
+            result.append((first, last))
+    return result
+
+
+class UIDSet:
+    """ An immutable, sorted set of UIDs, stored as ranges of consecutive
+        UIDs. A set of a million UIDs that are mostly consecutive takes only
+        a few bytes, no matter whether it is created from a list of UIDs or
+        from a sequence set, e.g. from an ESEARCH response.
+
+        A UIDSet behaves like a sorted list of UIDs (as integers): it
+        supports len, iteration, membership tests, indexing and slicing.
+        Membership tests, indexing and slicing take logarithmic time in the
+        number of ranges; slices with a step of 1 are UIDSets again.
+
+        Like a frozenset, it supports union (|), intersection (&) and
+        difference (-) with other UIDSets; the methods of the same names
+        accept any iterable of UIDs. These operations work on the ranges,
+        so their cost does not depend on the number of UIDs.
+    """
+    def __init__(self, uids=()):
+        """ Initialize the set from an iterable of UIDs, or from another
+            UIDSet
+        """
+        if isinstance(uids, UIDSet):
+            ranges = uids.ranges()
+        else:
+            ranges = uid_ranges(uids)
+        self._set_ranges(ranges)
+
+    def _set_ranges(self, ranges):
+        """ Set the contents from a sorted list of disjoint, non-adjacent
+            (first, last) tuples
+        """
+        self._firsts = array(UID_TYPECODE, [first for (first, last) in ranges])
+        self._lasts = array(UID_TYPECODE, [last for (first, last) in ranges])
+        self._offsets = array(UID_TYPECODE) # index of each range's first UID
+        length = 0
+        for (first, last) in ranges:
+            self._offsets.append(length)
+            length += last - first + 1
+        self._length = int(length) # not long, for len() in Python 2
+
+    def from_ranges(cls, ranges):
+        """ Return a UIDSet containing the UIDs in the given iterable of
+            (first, last) tuples, which may overlap and be in any order
+        """
+        result = cls()
+        result._set_ranges(merge_ranges(ranges))
+        return result
+    from_ranges = classmethod(from_ranges)
+
+    def from_sequence_set(cls, sequenceset):
+        """ Return a UIDSet containing the UIDs in the sequence set (a
+            string such as '1:500,502'), without expanding its ranges
+        """
+        if sequenceset.strip() == '':
+            return cls()
+        return cls.from_ranges(parse_sequence_set(sequenceset.strip()))
+    from_sequence_set = classmethod(from_sequence_set)
+
+    def ranges(self):
+        """ Return the list of (first, last) tuples of the ranges of
+            consecutive UIDs in the set, in ascending order
+        """
+        return list(zip(self._firsts, self._lasts))
+
+    def union(self, *others):
+        """ Return a UIDSet of the UIDs that are in this set or in any of
+            the iterables of UIDs in others
+        """
+        ranges = self.ranges()
+        for other in others:
+            ranges.extend(UIDSet(other).ranges())
+        return UIDSet.from_ranges(ranges)
+
+    def intersection(self, *others):
+        """ Return a UIDSet of the UIDs that are in this set and in all of
+            the iterables of UIDs in others
+        """
+        ranges = self.ranges()
+        for other in others:
+            ranges = _intersect_ranges(ranges, UIDSet(other).ranges())
+        result = UIDSet()
+        result._set_ranges(ranges)
+        return result
+
+    def difference(self, *others):
+        """ Return a UIDSet of the UIDs that are in this set but not in any
+            of the iterables of UIDs in others
+        """
+        ranges = self.ranges()
+        for other in others:
+            ranges = _subtract_ranges(ranges, UIDSet(other).ranges())
+        result = UIDSet()
+        result._set_ranges(ranges)
+        return result
+
+    def __or__(self, other):
+        if not isinstance(other, UIDSet):
+            return NotImplemented
+        return self.union(other)
+
+    def __and__(self, other):
+        if not isinstance(other, UIDSet):
+            return NotImplemented
+        return self.intersection(other)
+
+    def __sub__(self, other):
+        if not isinstance(other, UIDSet):
+            return NotImplemented
+        return self.difference(other)
+
+    def sequence_set(self):
+        """ Return the IMAP sequence set describing the UIDs in the set """
+        parts = []
+        for (first, last) in zip(self._firsts, self._lasts):
+            if first == last:
+                parts.append(str(first))
+            else:
+                parts.append("%s:%s" % (first, last))
+        return ','.join(parts)
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for (first, last) in zip(self._firsts, self._lasts):
+            for uid in range(first, last + 1):
+                yield uid
+
+    def __reversed__(self):
+        for index in range(len(self._firsts) - 1, -1, -1):
+            for uid in range(self._lasts[index], self._firsts[index] - 1, -1):
+                yield uid
+
+    def __contains__(self, uid):
+        try:
+            uid = int(uid)
+        except (TypeError, ValueError):
+            return False
+        index = bisect_right(self._firsts, uid) - 1
+        return index >= 0 and uid <= self._lasts[index]
+
+    def _uid_at(self, position):
+        """ Return the UID at the non-negative position """
+        index = bisect_right(self._offsets, position) - 1
+        return self._firsts[index] + position - self._offsets[index]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            (start, stop, step) = index.indices(self._length)
+            if step != 1:
+                return [self._uid_at(position)
+                        for position in range(start, stop, step)]
+            if start >= stop:
+                return UIDSet()
+            first_index = bisect_right(self._offsets, start) - 1
+            last_index = bisect_right(self._offsets, stop - 1) - 1
+            ranges = list(zip(self._firsts[first_index:last_index+1],
+                              self._lasts[first_index:last_index+1]))
+            ranges[0] = (self._uid_at(start), ranges[0][1])
+            ranges[-1] = (ranges[-1][0], self._uid_at(stop - 1))
+            result = UIDSet()
+            result._set_ranges(ranges)
+            return result
+        index = int(index)
+        if index < 0:
+            index += self._length
+        if index < 0 or index >= self._length:
+            raise IndexError("UIDSet index out of range")
+        return self._uid_at(index)
+
+    def __eq__(self, other):
+        if isinstance(other, UIDSet):
+            return self.ranges() == other.ranges()
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash(tuple(self.ranges()))
+
+    def __repr__(self):
+        return "UIDSet.from_sequence_set('%s')" % self.sequence_set()
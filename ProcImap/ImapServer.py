@@ -28,15 +28,16 @@ STANDARD_IMAPLIB = True    # this module can use the multithreaded imaplib2
                             # replacement of the standard imaplib module.
                             # If you find imaplib2 to cause problems, you can
                             # switch to to the standard library module
-                            # As a consequence, the idle command will not
-                            # be available (it will be replace by a dummy).
+                            # The idle command is available with both.
 
 IDLE_TIMEOUT = 120 # max time to wait in the idle command (this must be less
                    # than 29 minutes)
 
+IDLE_POLL_INTERVAL = 5 # if the server does not support IDLE, the idle command
+                       # polls it with NOOP at this interval (in seconds)
+
 if STANDARD_IMAPLIB:
     import imaplib
-    IDLE_TIMEOUT = 5 # that's how long we sleep in the bogus idle
 else:
     # imaplib2 from http://www.cs.usyd.edu.au/~piers/python/imaplib2
     # enables idle command
@@ -44,6 +45,24 @@ else:
 
 import time
 import re
+import select
+import socket
+
+from ProcImap.ImapResponse import get_response_code
+
+try:
+    from concurrent.futures import Future
+except ImportError: # Python 2 without the 'futures' backport
+    Future = None
+
+LITERAL_MINUS_MAX = 4096 # largest literal that may be sent without waiting for
+                         # a continuation if the server supports LITERAL-
+                         # (RFC7888)
+
+_MAP_CRLF = re.compile(b'\r\n|\r|\n')
+
+_CHANGE_RESPONSES = ('EXPUNGE', 'FETCH', 'EXISTS') # untagged responses that
+                                                  # idle() reports
 
 
 class ClosedMailboxError(Exception):
@@ -54,6 +73,53 @@ class NoSuchMailboxError(Exception):
     """ Raised if a non-existing mailbox is opened """
     pass
 
+
+def _native(data):
+    """ Return response data as a native string (it is bytes in Python 3) """
+    if not isinstance(data, str):
+        data = data.decode('latin-1')
+    return data
+
+
+class _RawArgument(bytes):
+    """ A command argument that imaplib sends verbatim, without quoting """
+    pass
+
+
+class _Literator:
+    """ Supplies the parts of a command that follow the synchronizing
+        literals to imaplib, one part per continuation request
+    """
+    def __init__(self, parts):
+        self._parts = list(parts)
+
+    def next_part(self, *args):
+        """ Return the next part of the command """
+        return self._parts.pop(0)
+
+
+if Future is not None:
+
+    class _PipelinedFuture(Future):
+        """ A Future for a command sent with uid_async through the standard
+            imaplib module, which has no thread that reads the responses.
+            The response is read when the result is requested, or when the
+            next blocking command is sent (see
+            ImapServer.complete_pending).
+        """
+        def __init__(self, server):
+            Future.__init__(self)
+            self._imapserver = server
+
+        def result(self, timeout=None):
+            self._imapserver.complete_pending(self)
+            return Future.result(self, timeout)
+
+        def exception(self, timeout=None):
+            self._imapserver.complete_pending(self)
+            return Future.exception(self, timeout)
+
+
 class ImapServer:
     """ A small lowlevel representation of an imap server 
     
@@ -63,6 +129,22 @@ class ImapServer:
         password        authentication password
         port            server port
         mailboxname     currently active mailbox on the server
+        uidvalidity     UIDVALIDITY of the currently active mailbox, or None
+        exists          number of messages in the currently active mailbox,
+                        or None if unknown
+        uids            sorted array of the UIDs of the messages in the
+                        currently active mailbox, or None if unknown
+
+        The 'exists' attribute is initialized from the EXISTS response to
+        SELECT, and kept up to date from the untagged EXISTS and EXPUNGE
+        responses that the server sends along with later commands. If the
+        count cannot be determined reliably, it is set to None.
+
+        The 'uids' attribute is not filled in by the server itself (see
+        ImapMailbox), but once set, expunged messages are removed from it.
+        New messages (i.e. an EXISTS count larger than the length of the
+        array) have to be added by the user of the attribute. If the
+        array cannot be kept up to date reliably, it is set to None.
     """
 
     def __init__(self, servername, username, password, ssl=True, port=None):
@@ -83,6 +165,10 @@ class ImapServer:
             'open' : False          # opened a mailbox? select/close
         }
         self.mailboxname = None
+        self.uidvalidity = None
+        self.exists = None
+        self.uids = None
+        self._pending = [] # (future, command, tag) sent with uid_async
         self.connect()
         self.login()
 
@@ -117,6 +203,9 @@ class ImapServer:
         """
         if self._flags['logged_in']:
             self.logout()
+        for (future, command, tag) in self._pending:
+            future.set_exception(imaplib.IMAP4.abort("disconnected"))
+        self._pending = []
         self._server = None
         self._flags['connected'] = False
 
@@ -137,8 +226,31 @@ class ImapServer:
                 self.reconnect()
                 result =  self._server.login(self.username, self.password)
             self._flags['logged_in'] = True
+            self._update_capabilities(result[1])
             return result
 
+    def _update_capabilities(self, data):
+        """ Replace the capabilities that the server announced before login
+            (which do not include most extensions on many servers) by those
+            announced in the response to LOGIN, or by asking the server
+            again. 'data' is the data of the tagged LOGIN response.
+        """
+        capabilities = get_response_code(data, 'CAPABILITY')
+        if capabilities is None:
+            untagged = [item for item in self._server.response('CAPABILITY')[1]
+                        if item is not None]
+            if len(untagged) == 0:
+                (code, untagged) = self._server.capability()
+                if code != 'OK':
+                    return
+            capabilities = []
+            for item in untagged:
+                if not isinstance(item, str):
+                    item = item.decode('ascii')
+                capabilities.extend(item.split())
+        self._server.capabilities = tuple([capability.upper()
+                                           for capability in capabilities])
+
     def reconnect(self):
         """ Close and then reopen the connection to the server """
         try:
@@ -148,29 +260,175 @@ class ImapServer:
         self.connect()
 
     def idle(self, timeout=IDLE_TIMEOUT):
-        """ Put server into IDLE mode until server notifies some change,
-            or 'timeout' (secs) occurs (default: 29 minutes),
-            or another IMAP4 command is scheduled.
+        """ Put server into IDLE mode (RFC2177) until server notifies some
+            change, or 'timeout' (secs) occurs. If the server does not
+            support IDLE, it is polled with NOOP every IDLE_POLL_INTERVAL
+            seconds instead.
+            Return the list of untagged EXPUNGE, FETCH and EXISTS responses
+            that were received, as tuples (name, data), where data is the
+            list of data for the response as returned by imaplib, e.g.
+            [('EXPUNGE', ['3']), ('EXISTS', ['22'])]. The list is empty if
+            the timeout occurred. The responses are in the order in which
+            the server sent them, except with imaplib2, which does not keep
+            that order: there, each kind of response is returned at most
+            once, with the data of all responses of that kind.
+            The 'exists' and 'uids' attributes are updated.
         """
-        if STANDARD_IMAPLIB:
-            time.sleep(IDLE_TIMEOUT)
+        self.complete_pending()
+        self._track_exists() # responses to earlier commands are not reported
+        deadline = time.time() + timeout
+        while True:
+            if self.has_capability('IDLE'):
+                responses = self._changes('IDLE', deadline - time.time())
+            else:
+                time.sleep(max(0, min(IDLE_POLL_INTERVAL,
+                                      deadline - time.time())))
+                responses = self._changes('NOOP')
+            if len(responses) > 0 or time.time() >= deadline:
+                return responses
+
+    def _changes(self, command, timeout=None):
+        """ Send the IDLE or NOOP command, and return the untagged
+            responses reported by idle(). IDLE is ended after the first such
+            response, or after 'timeout' seconds.
+        """
+        if not STANDARD_IMAPLIB:
+            if command == 'IDLE':
+                self._server.idle(timeout)
+            else:
+                self._server.noop()
+            responses = self._pop_changes()
+            names = [name for (name, data) in responses]
+            if 'EXPUNGE' in names and 'EXISTS' in names:
+                # the relative order of the responses is lost
+                self.exists = None
+                self.uids = None
+            else:
+                self._track_changes(responses)
+            return responses
+        # the standard imaplib module reads all responses to a command at
+        # once, so the responses are read one by one here, to keep their
+        # order and to be able to end IDLE when a change is reported
+        tag = self._send_command(command)
+        if timeout is not None:
+            deadline = time.time() + timeout
+        responses = []
+        idling = False
+        while self._server.tagged_commands[tag] is None:
+            if idling:
+                remaining = max(0, deadline - time.time())
+                if len(responses) > 0 or not self._response_waiting(remaining):
+                    self._server.send(b'DONE\r\n')
+                    idling = False
+                    continue
+            if self._server._get_response() is None: # continuation
+                idling = (command == 'IDLE')
+            responses.extend(self._pop_changes())
+        (code, data) = self._server.tagged_commands.pop(tag)
+        if code != 'OK':
+            raise self._server.error("%s command error: %s %s"
+                                     % (command, code, data))
+        self._track_changes(responses)
+        return responses
+
+    def _send_command(self, command):
+        """ Send a command without arguments through the standard imaplib
+            module, and return its tag. imaplib's own _command refuses
+            commands that are missing from its module-wide Commands table
+            (IDLE is missing before Python 3.14), and adding them there would
+            affect every IMAP4 instance in the process, so the command line
+            is written directly.
+        """
+        tag = self._server._new_tag() # also registers the tag
+        self._server.send(tag + b' ' + command.encode('ascii') + b'\r\n')
+        return tag
+
+    def _pop_changes(self):
+        """ Remove the responses reported by idle() from the untagged
+            responses of imaplib and return them
+        """
+        responses = []
+        for name in _CHANGE_RESPONSES:
+            data = [item for item in self._server.response(name)[1]
+                    if item is not None]
+            if len(data) > 0:
+                responses.append((name, data))
+        return responses
+
+    def _response_waiting(self, timeout):
+        """ Wait up to 'timeout' seconds for data from the server. Return
+            True if there is data to be read (standard imaplib only).
+        """
+        server = self._server
+        sslobj = getattr(server, 'sslobj', server.sock) # Python 2 SSL
+        if hasattr(sslobj, 'pending') and sslobj.pending() > 0:
+            return True
+        rbuf = getattr(server.file, '_rbuf', None)
+        if rbuf is not None: # Python 2 socket._fileobject
+            rbuf.seek(0, 2)
+            if rbuf.tell() > 0:
+                return True
         else:
-            return self._server.idle(timeout)
+            # Python 3 buffered reader: peek without blocking
+            sock_timeout = server.sock.gettimeout()
+            server.sock.setblocking(False)
+            try:
+                try:
+                    if len(server.file.peek(1)) > 0:
+                        return True
+                except socket.error:
+                    pass # nothing received yet
+            finally:
+                server.sock.settimeout(sock_timeout)
+        return len(select.select([server.sock], [], [], timeout)[0]) > 0
+
+    def _track_changes(self, responses):
+        """ Update the 'exists' and 'uids' attributes from the list of
+            responses returned by idle(), which must be in order
+        """
+        for (name, data) in responses:
+            if name == 'EXISTS':
+                self.exists = int(data[-1])
+                if self.uids is not None and len(self.uids) > self.exists:
+                    self.uids = None
+            elif name == 'EXPUNGE':
+                for msgno in data:
+                    if self.exists is not None:
+                        self.exists -= 1
+                    if self.uids is not None:
+                        try:
+                            del self.uids[int(msgno) - 1]
+                        except (IndexError, ValueError):
+                            self.uids = None
+
+    def noop(self):
+        """ Send a NOOP command. Untagged responses that the server has
+            queued up (e.g. EXISTS) are received along with it.
+        """
+        self.complete_pending()
+        result = self._server.noop()
+        if self._flags['open']:
+            self._track_exists()
+        return result
 
     def create(self, name):
         """ Create new mailbox """
+        self.complete_pending()
         return self._server.create(name)
 
     def delete(self, name):
         """ Delete old mailbox """
+        self.complete_pending()
         return self._server.delete(name)
 
     def subscribe(self, name):
         """ Subscribe to new mailbox """
+        self.complete_pending()
         return self._server.subscribe(name)
 
     def unsubscribe(self, name):
         """ Unsubscribe from old mailbox """
+        self.complete_pending()
         return self._server.unsubscribe(name)
 
     def logout(self):
@@ -179,16 +437,153 @@ class ImapServer:
         """
         if self._flags['open']:
             self.close()
+        self.complete_pending()
         self._flags['logged_in'] = False
         return self._server.logout()
 
     def append(self, mailbox, flags, date_time, messagestr):
         """ Append message to named mailbox. All parameters are strings which
-            need to be in the appropriate format as described in RFC3501"""
+            need to be in the appropriate format as described in RFC3501.
+            If the server allows it, the message is sent as a
+            non-synchronizing literal (see nonsync_literal), saving one
+            round trip.
+        """
         if not self._flags['open']:
             raise ClosedMailboxError("called append on closed mailbox")
+        if STANDARD_IMAPLIB:
+            # imaplib always waits for a continuation request (imaplib2
+            # takes care of non-synchronizing literals itself)
+            literal = self._append_data(flags, date_time, messagestr)[1]
+            if self.nonsync_literal(len(literal)):
+                return self.append_pipelined(mailbox,
+                                        [(flags, date_time, messagestr)])[0]
+        return self._append(mailbox, flags, date_time, messagestr)
+
+    def _append(self, mailbox, flags, date_time, messagestr):
+        """ Append message to named mailbox, using the append method of
+            imaplib
+        """
+        flags = flags.replace("\\Recent", '')
+        if not isinstance(messagestr, bytes):
+            messagestr = messagestr.encode('utf-8')
+        self.complete_pending()
+        result = self._server.append(mailbox, flags, date_time, messagestr)
+        self._track_exists()
+        return result
+
+    def nonsync_literal(self, size):
+        """ Return True if a literal of 'size' bytes may be sent without
+            waiting for a continuation request, i.e. if the server supports
+            LITERAL+, or LITERAL- and size does not exceed LITERAL_MINUS_MAX
+            (RFC7888)
+        """
+        if self.has_capability('LITERAL+'):
+            return True
+        return self.has_capability('LITERAL-') and size <= LITERAL_MINUS_MAX
+
+    def _append_data(self, flags, date_time, messagestr):
+        """ Return the flags and date_time arguments of an APPEND command
+            as a single string, and the message as a literal (bytes with
+            CRLF line endings)
+        """
+        arguments = []
         flags = flags.replace("\\Recent", '')
-        return self._server.append(mailbox, flags, date_time, messagestr)
+        if flags:
+            if (flags[0], flags[-1]) != ('(', ')'):
+                flags = "(%s)" % flags
+            arguments.append(flags)
+        if date_time:
+            arguments.append(imaplib.Time2Internaldate(date_time))
+        if not isinstance(messagestr, bytes):
+            messagestr = messagestr.encode('utf-8')
+        return (' '.join(arguments), _MAP_CRLF.sub(b'\r\n', messagestr))
+
+    def multiappend(self, mailbox, messages):
+        """ Append all messages to the named mailbox with a single APPEND
+            command (MULTIAPPEND extension, RFC3502). 'messages' is a list
+            of (flags, date_time, messagestr) tuples with the same meaning
+            as the parameters of the append method. The literals are sent
+            without waiting for continuation requests where the server
+            allows it (see nonsync_literal). Either all or none of the
+            messages are appended. Returns the tagged response.
+        """
+        if not self._flags['open']:
+            raise ClosedMailboxError("called multiappend on closed mailbox")
+        parts = []
+        for (flags, date_time, messagestr) in messages:
+            (arguments, literal) = self._append_data(flags, date_time,
+                                                     messagestr)
+            if arguments:
+                arguments = (arguments + ' ').encode('ascii')
+            else:
+                arguments = b''
+            if not parts:
+                first_arguments = _RawArgument(
+                            arguments + ('{%s}' % len(literal)).encode('ascii'))
+                parts.append(literal)
+            elif self.nonsync_literal(len(literal)):
+                parts[-1] += b' ' + arguments \
+                             + ('{%s+}\r\n' % len(literal)).encode('ascii') \
+                             + literal
+            else:
+                parts[-1] += b' ' + arguments \
+                             + ('{%s}' % len(literal)).encode('ascii')
+                parts.append(literal)
+        if not parts:
+            return ('OK', [None])
+        self.complete_pending()
+        self._server.literal = _Literator(parts).next_part
+        result = self._server.xatom('APPEND', mailbox, first_arguments)
+        self._track_exists()
+        return result
+
+    def append_pipelined(self, mailbox, messages):
+        """ Append all messages to the named mailbox, with one APPEND
+            command per message, like the append method. 'messages' is a
+            list of (flags, date_time, messagestr) tuples. If the server
+            allows all of the literals to be sent without waiting for
+            continuation requests (see nonsync_literal), all commands are
+            sent before the first response is read, so that the messages
+            are uploaded in a single round trip. Returns the list of tagged
+            responses, one per message.
+            Pipelining requires the standard imaplib module; with imaplib2,
+            the messages are appended one after another (still without
+            waiting for continuation requests, if the server allows it).
+        """
+        if not self._flags['open']:
+            raise ClosedMailboxError("called append_pipelined on closed mailbox")
+        appenddata = [self._append_data(flags, date_time, messagestr)
+                      for (flags, date_time, messagestr) in messages]
+        if not STANDARD_IMAPLIB \
+        or not all([self.nonsync_literal(len(literal))
+                    for (arguments, literal) in appenddata]):
+            return [self._append(mailbox, flags, date_time, messagestr)
+                    for (flags, date_time, messagestr) in messages]
+        self.complete_pending()
+        server = self._server
+        if hasattr(server, '_checkquote'):
+            mailbox = server._checkquote(mailbox) # Python 2 imaplib quotes
+        if not isinstance(mailbox, bytes):
+            mailbox = mailbox.encode('ascii')
+        tags = []
+        for (arguments, literal) in appenddata:
+            tag = server._new_tag()
+            command = [tag, b'APPEND', mailbox]
+            if arguments:
+                command.append(arguments.encode('ascii'))
+            command.append(('{%s+}' % len(literal)).encode('ascii'))
+            server.send(b' '.join(command) + b'\r\n' + literal + b'\r\n')
+            tags.append(tag)
+        result = []
+        for tag in tags:
+            try:
+                result.append(server._command_complete('APPEND', tag))
+            except server.abort:
+                raise
+            except server.error as data:
+                result.append(('BAD', [str(data)]))
+        self._track_exists()
+        return result
 
     def uid(self, command, *args):
         """ uid(command, arg[, ...])
@@ -197,7 +592,103 @@ class ImapServer:
         """
         if not self._flags['open']:
             raise ClosedMailboxError("called uid on closed mailbox")
-        return self._server.uid(command, *args)
+        self.complete_pending()
+        result = self._server.uid(command, *args)
+        self._track_exists()
+        return result
+
+    def has_uid_async(self):
+        """ Return True if uid_async is available, i.e. if the
+            concurrent.futures module can be imported (in Python 2, it is
+            provided by the 'futures' package)
+        """
+        return Future is not None
+
+    def uid_async(self, command, *args):
+        """ uid_async(command, arg[, ...])
+            Send the command like uid(command, arg[, ...]), but return a
+            concurrent.futures.Future for its response instead of waiting
+            for it. Any number of commands can be sent this way before the
+            first response is read, so that they take a single round trip.
+
+            With imaplib2, the future is completed by imaplib2's threads as
+            soon as the response arrives. The standard imaplib module has
+            no such threads; its futures are completed when their result is
+            requested (which reads the responses to all earlier commands as
+            well), or by complete_pending, which is called before every
+            blocking command. Waiting for them in any other way (e.g. with
+            concurrent.futures.wait) blocks forever.
+
+            The untagged FETCH responses of several commands in flight
+            cannot always be told apart. The data of a pipelined UID FETCH
+            command may therefore also contain the responses to later
+            commands, and the results of pipelined fetches should be
+            combined by UID.
+            Raise NotImplementedError if concurrent.futures is not
+            available, see has_uid_async.
+        """
+        if Future is None:
+            raise NotImplementedError("uid_async requires concurrent.futures")
+        if not self._flags['open']:
+            raise ClosedMailboxError("called uid_async on closed mailbox")
+        if STANDARD_IMAPLIB:
+            command = command.upper()
+            if command not in imaplib.Commands:
+                raise self._server.error("Unknown IMAP4 UID command: %s"
+                                         % command)
+            future = _PipelinedFuture(self)
+            future.set_running_or_notify_cancel() # cannot be cancelled
+            tag = self._server._command('UID', command, *args)
+            self._pending.append((future, command, tag))
+        else:
+            future = Future()
+            future.set_running_or_notify_cancel()
+            self._server.uid(command, callback=self._deliver, cb_arg=future,
+                             *args)
+        return future
+
+    def _deliver(self, args):
+        """ Complete the future of a command sent with uid_async through
+            imaplib2, with the result passed to the imaplib2 callback
+        """
+        (response, future, error) = args
+        if error is not None:
+            (exception, reason) = error
+            future.set_exception(exception(reason))
+            return
+        self._track_exists()
+        future.set_result(response)
+
+    def complete_pending(self, future=None):
+        """ Read the responses to the commands sent with uid_async through
+            the standard imaplib module, in the order in which they were
+            sent, and complete their futures. If 'future' is given, stop
+            after its response. The futures of commands that fail get the
+            exception that uid would have raised.
+            This is called automatically before every blocking command, and
+            does nothing with imaplib2.
+        """
+        while len(self._pending) > 0:
+            if future is not None and future.done():
+                break
+            (pending, command, tag) = self._pending.pop(0)
+            try:
+                (code, data) = self._server._command_complete('UID', tag)
+                if command not in ('SEARCH', 'SORT', 'THREAD'):
+                    command = 'FETCH'
+                result = self._server._untagged_response(code, data, command)
+            except self._server.abort as data:
+                # the connection is lost, no more responses will arrive
+                pending.set_exception(data)
+                for (pending, command, tag) in self._pending:
+                    pending.set_exception(data)
+                self._pending = []
+                return
+            except self._server.error as data:
+                pending.set_exception(data)
+                continue
+            self._track_exists()
+            pending.set_result(result)
 
     def expunge(self):
         """ Permanently remove deleted items from selected mailbox.
@@ -207,32 +698,123 @@ class ImapServer:
         """
         if not self._flags['open']:
             raise ClosedMailboxError("called expunge on closed mailbox")
-        return self._server.expunge()
+        self.complete_pending()
+        result = self._server.expunge()
+        self._track_exists(expunged=result[1])
+        return result
+
+    def _track_exists(self, expunged=None):
+        """ Update the 'exists' attribute from the untagged EXISTS and
+            EXPUNGE responses received since the last update. 'expunged' is
+            the list of EXPUNGE responses if they were already consumed by
+            the command (as for the EXPUNGE command).
+        """
+        exists = [count for count in self._server.response('EXISTS')[1]
+                  if count is not None]
+        if expunged is None:
+            expunged = self._server.response('EXPUNGE')[1]
+        expunged = [msgno for msgno in expunged if msgno is not None]
+        if len(exists) > 0 and len(expunged) > 0:
+            # the relative order of the responses is lost
+            self.exists = None
+            self.uids = None
+        elif len(exists) > 0:
+            self.exists = int(exists[-1])
+            if self.uids is not None and len(self.uids) > self.exists:
+                self.uids = None
+        elif len(expunged) > 0:
+            if self.exists is not None:
+                self.exists -= len(expunged)
+            if self.uids is not None:
+                try:
+                    for msgno in expunged:
+                        del self.uids[int(msgno) - 1]
+                except (IndexError, ValueError):
+                    self.uids = None
+
+    def response(self, code):
+        """ Return data for the response 'code' (e.g. 'COPYUID') received
+            from the server, as a tuple (code, [data, ...]). If there is no
+            such response, the list of data is [None]. The data is cleared,
+            so calling response again returns only newer responses.
+        """
+        return self._server.response(code)
+
+    def has_capability(self, name):
+        """ Return True if the server announced the capability 'name'
+            (e.g. 'UIDPLUS') in its CAPABILITY response
+        """
+        return name.upper() in [str(capability).upper()
+                                for capability in self._server.capabilities]
+
+    def status(self, mailbox, names):
+        """ Request named status conditions for mailbox, e.g.
+            status('INBOX', '(MESSAGES UIDNEXT)')
+        """
+        if not self._flags['logged_in']:
+            raise ClosedMailboxError("called status before logging in")
+        self.complete_pending()
+        return self._server.status(mailbox, names)
 
     def close(self):
         """ Close currently selected mailbox. Deleted messages are
             removed from writable mailbox. This is the recommended
             command before "LOGOUT"."""
+        self.complete_pending()
         self._flags['open'] = False
         self.mailboxname = None
+        self.uidvalidity = None
+        self.exists = None
+        self.uids = None
         return self._server.close()
 
+    def unselect(self):
+        """ Leave the currently selected mailbox without removing the
+            messages marked as deleted. This uses the UNSELECT command
+            (RFC3691) if the server supports it; otherwise the mailbox is
+            re-opened read-only before it is closed.
+        """
+        self.complete_pending()
+        if self._flags['open']:
+            if self.has_capability('UNSELECT'):
+                result = self._server.xatom('UNSELECT')
+                self._server.state = 'AUTH'
+            else:
+                self._server.select(self.mailboxname, readonly=True)
+                result = self._server.close()
+        else:
+            result = ('OK', [None])
+        self._flags['open'] = False
+        self.mailboxname = None
+        self.uidvalidity = None
+        self.exists = None
+        self.uids = None
+        return result
+
     def select(self, mailbox = 'INBOX', create=False):
         """ Select a mailbox. Log in if not logged in already.
             Return number of messages in mailbox if successful.
             If the mailbox does not exist, create it if 'create' is True,
             else raise NoSuchMailboxError.
             The name of the mailbox will be stored in the mailboxname 
-            attribute if selection was successful
+            attribute if selection was successful, and its UIDVALIDITY in
+            the uidvalidity attribute.
         """
         if not self._flags['logged_in']:
             self.login()
+        self.complete_pending()
         data = self._server.select(mailbox)
         code = data[0]
         count = data[1][0]
         if code == 'OK':
             self._flags['open'] = True
             self.mailboxname = mailbox
+            self.exists = int(count)
+            self.uids = None
+            self.uidvalidity = None
+            uidvalidity = self._server.response('UIDVALIDITY')[1][-1]
+            if uidvalidity is not None:
+                self.uidvalidity = int(uidvalidity)
             return int(count)
         else:
             if create:
@@ -260,10 +842,20 @@ class ImapServer:
             "*                  # optional quoted, end of folder
         """
         mailbox_pattern = re.compile(imap_flist_pattern, re.VERBOSE);
+        self.complete_pending()
         code, mailboxlist = self._server.list()
         result = []
         if code == 'OK':
             for raw_mailbox in mailboxlist:
+                if raw_mailbox is None:
+                    continue # no mailboxes at all
+                if isinstance(raw_mailbox, tuple):
+                    # name sent as a literal
+                    (flags, name) = [_native(part) for part in raw_mailbox]
+                    if '\\Noselect' not in flags:
+                        result.append(name)
+                    continue
+                raw_mailbox = _native(raw_mailbox)
                 mailbox_match = mailbox_pattern.match(raw_mailbox)
                 if mailbox_match:
                     result.append(mailbox_match.group('mailboxname'))
@@ -275,6 +867,7 @@ class ImapServer:
         """ List subscribed mailbox names """
         if not self._flags['logged_in']:
             raise ClosedMailboxError("called lsub before logging in")
+        self.complete_pending()
         return self._server.lsub()
 
     def __eq__(self, other):
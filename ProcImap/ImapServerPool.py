@@ -0,0 +1,348 @@
+############################################################################
+#    Copyright (C) 2008 by Michael Goerz                                   #
+#    http://www.physik.fu-berlin.de/~goerz                                 #
+#                                                                          #
+#    This program is free software; you can redistribute it and#or modify  #
+#    it under the terms of the GNU General Public License as published by  #
+#    the Free Software Foundation; either version 3 of the License, or     #
+#    (at your option) any later version.                                   #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU General Public License     #
+#    along with this program; if not, write to the                         #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+############################################################################
+
+""" This module contains the ImapServerPool class, which keeps a number of
+    connected and authenticated ImapServer instances for the same account,
+    so that they can be leased out and returned instead of paying for a
+    new connection and LOGIN every time a mailbox is opened.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from ProcImap.ImapServer import ImapServer
+from ProcImap.ImapMailbox import ImapMailbox
+from ProcImap.ImapMessage import ImapMessage
+
+POOL_MINSIZE = 0      # number of connections that are kept open even if idle
+POOL_MAXSIZE = 4      # maximum number of open connections
+POOL_MAX_IDLE = 300   # seconds after which a surplus idle connection is closed
+POOL_CHECK_AFTER = 30 # idle connections older than this (in seconds) are
+                      # checked with a NOOP before they are leased out
+
+
+class PoolExhaustedError(Exception):
+    """ Raised if no connection becomes available within the timeout """
+    pass
+
+class PoolClosedError(Exception):
+    """ Raised if a connection is requested from a closed pool """
+    pass
+
+
+class ImapServerPool:
+    """ A pool of ImapServer instances that point to the same server and
+        account.
+
+        Connections are created lazily: the first call to lease() opens
+        'minsize' connections (see warmup), any further connections are
+        opened on demand, up to 'maxsize'. When all connections are leased
+        out, lease() blocks until one is returned. Connections that were
+        idle for more than 'max_idle' seconds are closed, as long as more
+        than 'minsize' connections are open. A connection that has been
+        idle for a while is checked with a NOOP before it is leased out,
+        and replaced by a new connection if the check fails.
+
+        A leased ImapServer may be used for an ImapMailbox, but the
+        mailbox must not be closed with its close() method, as that logs
+        out the connection. Use the mailbox() context manager instead, or
+        call flush() on the mailbox before returning the server with
+        release(). The pool is safe to use from several threads.
+
+            >>> pool = ImapServerPool('localhost', 'user', 'secret')
+            >>> with pool.mailbox('INBOX') as mailbox:
+            ...     print(len(mailbox))
+
+        Public attributes are:
+        servername, username, password, ssl, port
+                        the account data, as for ImapServer
+        minsize         number of connections that are kept open
+        maxsize         maximum number of open connections
+        max_idle        time (in seconds) after which surplus idle
+                        connections are closed
+    """
+
+    def __init__(self, servername, username, password, ssl=True, port=None,
+                 minsize=POOL_MINSIZE, maxsize=POOL_MAXSIZE,
+                 max_idle=POOL_MAX_IDLE):
+        """ Initialize the pool. No connection is opened before the first
+            call to lease() or warmup().
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        if minsize < 0 or minsize > maxsize:
+            raise ValueError("minsize must be between 0 and maxsize")
+        self.servername = servername
+        self.username = username
+        self.password = password
+        self.ssl = ssl
+        self.port = port
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.max_idle = max_idle
+        self._idle = []    # (server, time of return), most recent last
+        self._leased = {}  # id(server) => server
+        self._size = 0     # open connections, including those being opened
+        self._warm = False
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def from_server(cls, server, **kwargs):
+        """ Return a new pool for the account of the ImapServer instance
+            'server'. The keyword arguments are passed to the constructor.
+            The server itself does not become part of the pool.
+        """
+        return cls(server.servername, server.username, server.password,
+                   server.ssl, server.port, **kwargs)
+    from_server = classmethod(from_server)
+
+    size = property(lambda self: self._size, None,
+                    doc="Number of open connections")
+
+    available = property(lambda self: len(self._idle), None,
+                         doc="Number of idle connections")
+
+    def _connect(self):
+        """ Open a new connection. The caller must have reserved a slot
+            for it; the slot is freed if the connection fails.
+        """
+        try:
+            return ImapServer(self.servername, self.username, self.password,
+                              self.ssl, self.port)
+        except:
+            self._condition.acquire()
+            try:
+                self._size -= 1
+                self._condition.notify()
+            finally:
+                self._condition.release()
+            raise
+
+    def warmup(self):
+        """ Open connections until at least 'minsize' are open. This is
+            done automatically on the first call to lease(), and again on
+            later calls until it has succeeded once. The connections are
+            opened one at a time; if one of them fails, the exception is
+            raised, and the connections opened before are kept.
+        """
+        while True:
+            self._condition.acquire()
+            try:
+                if self._size >= self.minsize:
+                    break
+                self._size += 1 # reserve a slot for the new connection
+            finally:
+                self._condition.release()
+            server = self._connect()
+            self._condition.acquire()
+            try:
+                self._idle.append((server, time.time()))
+                self._condition.notify()
+            finally:
+                self._condition.release()
+        self._warm = True
+
+    def _expired(self):
+        """ Remove the connections that are idle for more than max_idle
+            seconds from the pool and return them. Must be called with the
+            lock held.
+        """
+        expired = []
+        deadline = time.time() - self.max_idle
+        while len(self._idle) > 0 and self._size > self.minsize \
+        and self._idle[0][1] < deadline:
+            expired.append(self._idle.pop(0)[0])
+            self._size -= 1
+        return expired
+
+    def reap(self):
+        """ Close the connections that have been idle for more than
+            max_idle seconds, as long as more than minsize connections are
+            open. Return the number of closed connections. This is done
+            automatically whenever a connection is leased or returned.
+        """
+        self._condition.acquire()
+        try:
+            expired = self._expired()
+        finally:
+            self._condition.release()
+        for server in expired:
+            _shutdown(server)
+        return len(expired)
+
+    def lease(self, timeout=None):
+        """ Return a connected and authenticated ImapServer from the pool.
+            If all connections are in use, block until one is returned, or
+            until 'timeout' seconds have passed, in which case
+            PoolExhaustedError is raised. The server must be returned with
+            release().
+        """
+        if not self._warm:
+            self.warmup()
+        if timeout is not None:
+            deadline = time.time() + timeout
+        self._condition.acquire()
+        try:
+            while True:
+                if self._closed:
+                    raise PoolClosedError("pool has been closed")
+                if len(self._idle) > 0:
+                    (server, returned) = self._idle.pop()
+                    break
+                if self._size < self.maxsize:
+                    (server, returned) = (None, None)
+                    self._size += 1
+                    break
+                if timeout is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise PoolExhaustedError("all %s connections are "
+                                                 "in use" % self.maxsize)
+                    self._condition.wait(remaining)
+            expired = self._expired()
+        finally:
+            self._condition.release()
+        for stale in expired:
+            _shutdown(stale)
+        if server is None:
+            server = self._connect()
+        elif time.time() - returned > POOL_CHECK_AFTER \
+        and not _healthy(server):
+            _shutdown(server)
+            server = self._connect()
+        self._condition.acquire()
+        try:
+            self._leased[id(server)] = server
+        finally:
+            self._condition.release()
+        return server
+
+    def release(self, server, discard=False):
+        """ Return a server that was obtained with lease() to the pool. A
+            selected mailbox is left without expunging it (see
+            ImapServer.unselect). If 'discard' is True, or if the server
+            cannot be reset, the connection is closed instead of being
+            reused.
+        """
+        self._condition.acquire()
+        try:
+            if id(server) not in self._leased:
+                raise ValueError("server was not leased from this pool")
+            del self._leased[id(server)]
+        finally:
+            self._condition.release()
+        if hasattr(server, 'locked'):
+            del server.locked
+        if not discard:
+            try:
+                server.unselect()
+            except Exception:
+                discard = True
+        self._condition.acquire()
+        try:
+            if discard or self._closed:
+                self._size -= 1
+            else:
+                self._idle.append((server, time.time()))
+            self._condition.notify()
+            expired = self._expired()
+        finally:
+            self._condition.release()
+        if discard or self._closed:
+            expired.append(server)
+        for stale in expired:
+            _shutdown(stale)
+
+    def close(self):
+        """ Log out all idle connections. Connections that are still
+            leased out are logged out when they are returned. Any further
+            call to lease() raises PoolClosedError.
+        """
+        self._condition.acquire()
+        try:
+            self._closed = True
+            idle = [server for (server, returned) in self._idle]
+            self._idle = []
+            self._size -= len(idle)
+            self._condition.notify_all()
+        finally:
+            self._condition.release()
+        for server in idle:
+            _shutdown(server)
+
+    def connection(self, timeout=None):
+        """ Context manager that leases a server and returns it to the pool
+            afterwards. If the connection is broken when the block exits,
+            it is discarded (see release).
+
+                >>> with pool.connection() as server:
+                ...     print(server.list())
+        """
+        server = self.lease(timeout)
+        try:
+            yield server
+        finally:
+            self.release(server)
+    connection = contextmanager(connection)
+
+    def mailbox(self, name, factory=ImapMessage, readonly=False, create=True,
+                timeout=None):
+        """ Context manager that returns an ImapMailbox for the mailbox
+            'name' on a leased server. The arguments are those of the
+            ImapMailbox constructor. If the block completes, the mailbox is
+            flushed (i.e. expunged, unless it is read-only); the server is
+            returned to the pool in any case.
+
+                >>> with pool.mailbox('INBOX') as mailbox:
+                ...     mailbox.discard(15)
+        """
+        server = self.lease(timeout)
+        try:
+            mailbox = ImapMailbox((server, name), factory, readonly, create)
+            yield mailbox
+            mailbox.flush()
+        finally:
+            self.release(server)
+    mailbox = contextmanager(mailbox)
+
+    def __len__(self):
+        """ Return the number of open connections """
+        return self._size
+
+
+def _healthy(server):
+    """ Return True if 'server' answers a NOOP """
+    try:
+        return server.noop()[0] == 'OK'
+    except Exception:
+        return False
+
+
+def _shutdown(server):
+    """ Log out of 'server', ignoring all errors (the connection may
+        already be broken)
+    """
+    try:
+        server.disconnect()
+    except Exception:
+        pass
@@ -0,0 +1,230 @@
+############################################################################
+#    Copyright (C) 2008 by Michael Goerz                                   #
+#    http://www.physik.fu-berlin.de/~goerz                                 #
+#                                                                          #
+#    This program is free software; you can redistribute it and#or modify  #
+#    it under the terms of the GNU General Public License as published by  #
+#    the Free Software Foundation; either version 3 of the License, or     #
+#    (at your option) any later version.                                   #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU General Public License     #
+#    along with this program; if not, write to the                         #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+############################################################################
+
+""" This module contains local implementations of the SORT and THREAD
+    commands (RFC5256). ImapMailbox uses them for servers that do not
+    support these extensions. They work on the headers of the messages, as
+    returned by ImapMailbox.get_headers.
+
+    The implementations follow the RFC closely enough for displaying
+    mailboxes, but not exactly: header fields are compared without decoding
+    RFC2047 encoded words, and the REFERENCES algorithm does not merge
+    threads with the same subject.
+"""
+
+import email.utils
+import re
+import time
+
+SORT_FIELDS = {              # header fields needed for each sort criterion
+    'ARRIVAL': [],
+    'CC': ['Cc'],
+    'DATE': ['Date'],
+    'FROM': ['From'],
+    'SIZE': [],
+    'SUBJECT': ['Subject'],
+    'TO': ['To'],
+}
+
+THREAD_FIELDS = ['Subject', 'Date', 'Message-ID', 'In-Reply-To', 'References']
+
+_SUBJECT_PREFIX = re.compile(r'^\s*((re|fwd?)\s*(\[[^\]]*\])?\s*:|\[[^\]]*\])',
+                             re.IGNORECASE)
+_SUBJECT_SUFFIX = re.compile(r'\s*\(fwd\)\s*$', re.IGNORECASE)
+_MESSAGE_ID = re.compile(r'<[^>]*>')
+
+
+class SortCriteriaError(Exception):
+    """ Raised if unknown sort criteria or threading algorithms are given """
+    pass
+
+
+def parse_sort_criteria(criteria):
+    """ Return a list of (key, reverse) tuples for the sort criteria string,
+        e.g. [('DATE', True), ('SUBJECT', False)] for 'REVERSE DATE SUBJECT'
+    """
+    result = []
+    reverse = False
+    for word in criteria.strip('()').upper().split():
+        if word == 'REVERSE':
+            reverse = True
+            continue
+        if word not in SORT_FIELDS:
+            raise SortCriteriaError("unknown sort criterion %s" % word)
+        result.append((word, reverse))
+        reverse = False
+    if len(result) == 0:
+        raise SortCriteriaError("no sort criteria given")
+    return result
+
+
+def sort_fields(criteria):
+    """ Return the header fields needed to sort by criteria, as a string
+        suitable for ImapMailbox.get_headers
+    """
+    fields = []
+    for (key, reverse) in parse_sort_criteria(criteria):
+        for field in SORT_FIELDS[key]:
+            if field not in fields:
+                fields.append(field)
+    return ' '.join(fields)
+
+
+def base_subject(subject):
+    """ Return the lower case subject with the prefixes and suffixes that
+        are added by replies and forwards (e.g. 'Re:', '[list]', '(fwd)')
+        removed
+    """
+    subject = ' '.join(str(subject or '').split())
+    while True:
+        stripped = _SUBJECT_SUFFIX.sub('', subject)
+        stripped = _SUBJECT_PREFIX.sub('', stripped).strip()
+        if stripped == subject or stripped == '':
+            break
+        subject = stripped
+    return subject.lower()
+
+
+def sent_date(message):
+    """ Return the date of the message as seconds since the epoch, from the
+        Date header, or from the internal date if that header is missing
+        or invalid
+    """
+    date = message['Date']
+    if date is not None:
+        datetuple = email.utils.parsedate_tz(str(date))
+        if datetuple is not None:
+            try:
+                return email.utils.mktime_tz(datetuple)
+            except (OverflowError, ValueError):
+                pass
+    return arrival_date(message)
+
+
+def arrival_date(message):
+    """ Return the internal date of the message as seconds since the epoch """
+    if message.internaldate is None:
+        return 0
+    return time.mktime(message.internaldate)
+
+
+def _mailbox_name(message, field):
+    """ Return the lower case local part of the first address in the
+        header field
+    """
+    addresses = email.utils.getaddresses([str(message[field] or '')])
+    if len(addresses) == 0:
+        return ''
+    return addresses[0][1].split('@')[0].lower()
+
+
+def _sort_key(key, message):
+    """ Return the value of message to be compared for the sort key """
+    if key == 'ARRIVAL':
+        return arrival_date(message)
+    if key == 'DATE':
+        return sent_date(message)
+    if key == 'SIZE':
+        return message.size
+    if key == 'SUBJECT':
+        return base_subject(message['Subject'])
+    return _mailbox_name(message, key.capitalize())
+
+
+def sort_messages(headers, criteria):
+    """ Return the UIDs of the messages in headers (a dict mapping UIDs to
+        messages with the fields required by sort_fields(criteria)),
+        sorted by the sort criteria. Messages that compare equal for all
+        criteria are sorted by UID.
+    """
+    result = sorted(headers.keys())
+    keys = parse_sort_criteria(criteria)
+    keys.reverse()
+    for (key, reverse) in keys:
+        result.sort(key=lambda uid: _sort_key(key, headers[uid]),
+                    reverse=reverse)
+    return result
+
+
+def _message_ids(value):
+    """ Return the list of message ids contained in a header value """
+    return _MESSAGE_ID.findall(str(value or ''))
+
+
+def _thread_list(uid, children):
+    """ Return the thread below uid in the format of a THREAD response:
+        a list starting with uid and its only descendants, followed by a
+        list for each subthread if there is more than one.
+    """
+    result = [uid]
+    while len(children.get(uid, [])) == 1:
+        uid = children[uid][0]
+        result.append(uid)
+    for child in children.get(uid, []):
+        result.append(_thread_list(child, children))
+    return result
+
+
+def thread_messages(headers, algorithm):
+    """ Return the threads of the messages in headers (a dict mapping UIDs
+        to messages with the fields in THREAD_FIELDS), for the threading
+        algorithm 'ORDEREDSUBJECT' or 'REFERENCES'. The result has the
+        same format as ImapResponse.parse_thread_response.
+    """
+    algorithm = algorithm.upper()
+    dates = {}
+    for (uid, message) in headers.items():
+        dates[uid] = (sent_date(message), uid)
+    parents = {}
+    if algorithm == 'ORDEREDSUBJECT':
+        first = {}
+        for uid in sorted(headers.keys(), key=lambda uid: dates[uid]):
+            subject = base_subject(headers[uid]['Subject'])
+            if subject in first:
+                parents[uid] = first[subject]
+            else:
+                first[subject] = uid
+    elif algorithm == 'REFERENCES':
+        by_id = {}
+        for uid in sorted(headers.keys()):
+            for message_id in _message_ids(headers[uid]['Message-ID'])[:1]:
+                by_id.setdefault(message_id, uid)
+        for (uid, message) in headers.items():
+            references = _message_ids(message['References']) \
+                         + _message_ids(message['In-Reply-To'])
+            references.reverse()
+            for message_id in references:
+                parent = by_id.get(message_id, uid)
+                ancestor = parent
+                while ancestor in parents and ancestor != uid:
+                    ancestor = parents[ancestor]
+                if ancestor != uid: # avoid loops
+                    parents[uid] = parent
+                    break
+    else:
+        raise SortCriteriaError("unknown threading algorithm %s" % algorithm)
+    children = {}
+    roots = []
+    for uid in sorted(headers.keys(), key=lambda uid: dates[uid]):
+        if uid in parents:
+            children.setdefault(parents[uid], []).append(uid)
+        else:
+            roots.append(uid)
+    return [_thread_list(uid, children) for uid in roots]
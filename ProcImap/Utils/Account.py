@@ -0,0 +1,198 @@
+############################################################################
+#    Copyright (C) 2008 by Michael Goerz                                   #
+#    http://www.physik.fu-berlin.de/~goerz                                 #
+#                                                                          #
+#    This program is free software; you can redistribute it and#or modify  #
+#    it under the terms of the GNU General Public License as published by  #
+#    the Free Software Foundation; either version 3 of the License, or     #
+#    (at your option) any later version.                                   #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU General Public License     #
+#    along with this program; if not, write to the                         #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+############################################################################
+""" This module contains the FolderExecutor class, which runs a function
+    on all the mailboxes ("folders") of an IMAP account, several folders at
+    a time.
+"""
+import sys
+import threading
+import time
+import traceback
+
+from ProcImap.ImapMailbox import ImapNotOkError
+from ProcImap.ImapServer import ImapServer
+from ProcImap.ImapServerPool import ImapServerPool
+
+FOLDER_WORKERS = 4 # default number of folders that are processed at once
+
+
+class FolderResult:
+    """ The outcome of processing a single folder.
+
+        Public attributes are:
+        name        name of the folder
+        value       return value of the function, or None if it failed
+        error       the exception raised by the function (or by opening the
+                    folder), or None if it succeeded
+        traceback   the formatted traceback of the error, or None
+        start       time (as returned by time.time()) at which the folder
+                    was opened
+        end         time at which processing finished
+    """
+    def __init__(self, name):
+        self.name = name
+        self.value = None
+        self.error = None
+        self.traceback = None
+        self.start = None
+        self.end = None
+
+    ok = property(lambda self: self.error is None, None,
+                  doc="True if the folder was processed without error")
+
+    duration = property(lambda self: self.end - self.start, None,
+                        doc="Time (in seconds) spent on the folder")
+
+    def __repr__(self):
+        if self.ok:
+            return "<FolderResult %s: %r>" % (self.name, self.value)
+        return "<FolderResult %s: %s>" % (self.name, repr(self.error))
+
+
+class FolderExecutor:
+    """ Runs a function on a number of folders of an IMAP account, with at
+        most 'workers' folders open at the same time. Each folder is opened
+        as an ImapMailbox on a connection from an ImapServerPool, and
+        passed to the function. Errors do not stop the processing of other
+        folders; they are collected in the returned FolderResult instances,
+        like the return values of the function.
+
+            >>> executor = FolderExecutor(pool, workers=4,
+            ...                           progress=print_progress)
+            >>> results = executor.run(lambda mailbox: len(mailbox))
+            >>> sizes = dict((r.name, r.value) for r in results if r.ok)
+
+        The function is called from worker threads, so it must not share
+        unprotected state (e.g. a local mbox file) between folders.
+
+        Public attributes are:
+        pool        the ImapServerPool
+        workers     maximum number of folders processed at once
+        readonly    if True, the folders are opened read-only
+        progress    None, or a callable that is called as
+                    progress(result, done, total) whenever a folder is
+                    finished, where 'result' is its FolderResult and 'done'
+                    is the number of folders finished so far. The calls are
+                    serialized, so the callable does not need to be
+                    thread-safe.
+    """
+
+    def __init__(self, pool, workers=FOLDER_WORKERS, readonly=False,
+                 progress=None):
+        """ Initialize the executor. Instead of a pool, an ImapServer may be
+            given, in which case a pool with 'workers' connections is
+            created for its account.
+        """
+        if isinstance(pool, ImapServer):
+            pool = ImapServerPool.from_server(pool, maxsize=workers)
+        self.pool = pool
+        self.workers = max(1, workers)
+        self.readonly = readonly
+        self.progress = progress
+        self._lock = threading.Lock()
+
+    def _process(self, function, folder):
+        """ Run function on folder, return its FolderResult """
+        result = FolderResult(folder)
+        result.start = time.time()
+        try:
+            with self.pool.mailbox(folder, readonly=self.readonly,
+                                   create=False) as mailbox:
+                result.value = function(mailbox)
+        except Exception as data:
+            result.error = data
+            result.traceback = traceback.format_exc()
+        result.end = time.time()
+        return result
+
+    def _worker(self, function, folders, results, state):
+        """ Process folders until there are none left. 'state' is a list
+            holding the index of the next folder and the number of finished
+            folders, and is protected by the lock.
+        """
+        while True:
+            self._lock.acquire()
+            try:
+                index = state[0]
+                state[0] += 1
+            finally:
+                self._lock.release()
+            if index >= len(folders):
+                return
+            results[index] = self._process(function, folders[index])
+            self._lock.acquire()
+            try:
+                state[1] += 1
+                if self.progress is not None:
+                    self.progress(results[index], state[1], len(folders))
+            finally:
+                self._lock.release()
+
+    def run(self, function, folders=None):
+        """ Call function(mailbox) for each of the folders (a list of names,
+            as returned by ImapServer.list(), which is also the default),
+            and return the list of FolderResult instances in the same
+            order as the folders.
+            Raise ImapNotOkError if the folders cannot be listed.
+        """
+        if folders is None:
+            with self.pool.connection() as server:
+                folders = server.list()
+            if folders is None:
+                raise ImapNotOkError("cannot list the folders of %s@%s"
+                                     % (self.pool.username,
+                                        self.pool.servername))
+        folders = list(folders)
+        results = [None] * len(folders)
+        state = [0, 0]
+        threads = []
+        for i in range(min(self.workers, len(folders))):
+            thread = threading.Thread(target=self._worker,
+                                      args=(function, folders, results, state))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return results
+
+
+def failed(results):
+    """ Return the list of the FolderResult instances in results that have
+        an error
+    """
+    return [result for result in results if not result.ok]
+
+
+def print_progress(result, done, total, stream=None):
+    """ Progress callback for FolderExecutor that prints a line per
+        finished folder to stream (default: sys.stdout), e.g.
+        "[ 3/12] INBOX: done in 2.1 s"
+    """
+    if stream is None:
+        stream = sys.stdout
+    width = len(str(total))
+    if result.ok:
+        outcome = "done"
+    else:
+        outcome = "FAILED (%s)" % repr(result.error)
+    stream.write("[%*d/%d] %s: %s in %.1f s\n" % (width, done, total,
+                 result.name, outcome, result.duration))
+    stream.flush()
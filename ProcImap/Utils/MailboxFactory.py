@@ -36,6 +36,7 @@ else:
 
 from ProcImap.ImapServer import ImapServer
 from ProcImap.ImapMailbox import ImapMailbox
+from ProcImap.ImapServerPool import ImapServerPool
 
 class UnknownMailboxTypeError(Exception):
     """ Raised when there is a mailbox type in the config file that is
@@ -104,6 +105,10 @@ class MailboxFactory:
         MailboxFactory has capabilities to extend the set of known types by
         using the set_type method.
 
+        For IMAP mailboxes, the borrow method returns the mailbox on a
+        connection from a pool that is shared by all sections describing the
+        same account (see get_pool), instead of opening a new connection.
+
         The MailboxFactory partly supports a read-only dictionary interface.
     """
     def __init__(self, configfilename):
@@ -120,6 +125,7 @@ class MailboxFactory:
         self.set_type('imap', ImapMailbox, imap_pathgenerator)
         self._configparser = ConfigParser()
         self._configparser.read(configfilename)
+        self._pools = {} # (servername, username, password, ssl, port) => pool
 
     def get(self, name):
         """ Create the Mailbox object that is described in section 'name'
@@ -163,6 +169,44 @@ class MailboxFactory:
         path = pathgenerator(dict(self._configparser.items(name)))
         return(path[0])
 
+    def get_pool(self, name, **kwargs):
+        """ Return the ImapServerPool for the server data that is described
+            in section 'name', which must be of type IMAP (as for
+            get_server). All sections that describe the same account share
+            one pool, which is created on first use with the given keyword
+            arguments (see ImapServerPool); for an existing pool, the
+            keyword arguments are ignored.
+        """
+        mailboxtype = self._configparser.get(name, 'type').lower()
+        if mailboxtype != 'imap':
+            raise TypeError("You can only create a pool from an IMAP mailbox")
+        (mailboxname, account) = imap_account(
+                                        dict(self._configparser.items(name)))
+        if account not in self._pools:
+            self._pools[account] = ImapServerPool(*account, **kwargs)
+        return self._pools[account]
+
+    def borrow(self, name, readonly=False, timeout=None):
+        """ Context manager that returns the ImapMailbox described in
+            section 'name' on a connection borrowed from the pool of its
+            account (see get_pool), instead of opening a new connection.
+            The connection is returned to the pool at the end of the block.
+
+                >>> mailboxes = MailboxFactory("mailboxes.cfg")
+                >>> with mailboxes.borrow('Standard') as mb:
+                ...     print(len(mb))
+        """
+        pool = self.get_pool(name)
+        (mailboxname, account) = imap_account(
+                                        dict(self._configparser.items(name)))
+        return pool.mailbox(mailboxname, readonly=readonly, timeout=timeout)
+
+    def close_pools(self):
+        """ Close all pools created by get_pool """
+        for pool in self._pools.values():
+            pool.close()
+        self._pools = {}
+
     def __contains__(self, name):
         """ Return True if there is a mailbox with the given name, 
             False otherwise """
@@ -209,6 +253,16 @@ class MailboxFactory:
 
 def imap_pathgenerator(optionsdict):
     """ Converts options into (server, name) tuple """
+    (name, account) = imap_account(optionsdict)
+    server = ImapServer(*account)
+    return(tuple((server, name)))
+
+
+def imap_account(optionsdict):
+    """ Converts options into a tuple (name, account), where account is
+        the tuple of arguments (servername, username, password, ssl, port)
+        for ImapServer and ImapServerPool
+    """
     try:
         name = optionsdict['mailbox']
         serveraddress = optionsdict['server']
@@ -226,8 +280,7 @@ def imap_pathgenerator(optionsdict):
               "IMAP Mailbox object needs the following parameters\n " \
               + "'mailbox', 'server', 'username', 'password'.\n" \
               + "The 'ssl' and 'port' parameters are optional.")
-    server = ImapServer(serveraddress, username, password, ssl, port)
-    return(tuple((server, name)))
+    return (name, (serveraddress, username, password, ssl, port))
 
 
 def standard_pathgenerator(optionsdict):
@@ -77,11 +77,11 @@ def summary(mailbox, uids, printout=True, printuid=True):
     result = [] # array of lines
     if isinstance(uids, (str, int)):
         uids = [uids]
+    headers = mailbox.get_headers(uids, 'From Date Subject')
     for uid in uids:
-        try:
-            header = mailbox.get_header(uid)
-        except: # unspecified on purpose, might be ProcImap.imaplib2.error
+        if uid not in headers:
             continue
+        header = headers[uid]
         counter += 1
         index = counter
         if printuid:
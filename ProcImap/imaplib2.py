@@ -1041,7 +1041,13 @@ class IMAP4(object):
             self.literal = None
             if isinstance(literal, str):
                 literator = None
-                data = '%s {%s}' % (data, len(literal))
+                if self._nonsync_literal(len(literal)):
+                    # Send the literal straight away (RFC 7888)
+                    data = '%s {%s+}%s%s' % (data, len(literal), CRLF, literal)
+                    if __debug__: self._log(4, 'write non-synchronizing literal size %s' % len(literal))
+                    literal = None
+                else:
+                    data = '%s {%s}' % (data, len(literal))
             else:
                 literator = literal
 
@@ -1086,6 +1092,16 @@ class IMAP4(object):
         return rqb
 
 
+    def _nonsync_literal(self, size):
+
+        # LITERAL+ allows any literal, LITERAL- only literals of up to
+        # 4096 octets, to be sent without waiting for a continuation
+
+        if 'LITERAL+' in self.capabilities:
+            return True
+        return 'LITERAL-' in self.capabilities and size <= 4096
+
+
     def _command_complete(self, rqb, kw):
 
         # Called for non-callback commands
@@ -3,7 +3,7 @@
     This example shows how to create a backup of an IMAP mailbox into an mbox folders.
     The IMAP attributes are stored in each message in special header fields"
 """
-from ProcImap.ImapMailbox import ImapMailbox
+from ProcImap.ImapDownloader import ParallelDownloader
 from ProcImap.Utils.MailboxFactory import MailboxFactory
 from mailbox import mbox
 import sys
@@ -11,8 +11,9 @@ import sys
 # usage: backup_mailbox.py imapmailbox backupmbox
 
 mailboxes = MailboxFactory('/home/goerz/.procimap/mailboxes.cfg')
-server = mailboxes.get_server('Gmail')
-mailbox = ImapMailbox((server, sys.argv[1]))
+# the messages are downloaded over four connections at once
+pool = mailboxes.get_pool('Gmail', maxsize=4)
+mailbox = ParallelDownloader(pool, sys.argv[1], connections=4)
 backuptarget = mbox(sys.argv[2])
 
 backuptarget.lock()
@@ -22,6 +23,6 @@ for message in mailbox:
     message.add_header("X-ProcImap-ImapInternalDate", message.internaldatestring())
     backuptarget.add(message)
 
-mailbox.close()
+mailboxes.close_pools()
 backuptarget.close()
 sys.exit(0)
@@ -6,7 +6,7 @@ import sys
 
 from ProcImap.Utils.Processing import pipe_message
 from ProcImap.Utils.CLI import ProcImapOptParser
-from ProcImap.ImapMailbox import ImapMailbox
+from ProcImap.ImapServerPool import ImapServerPool
 from ProcImap.Utils.Gmail import GmailCache, is_gmail_box, delete
 import mailbox as Mailbox # I'm already using 'mailbox' as a variable name
 
@@ -43,38 +43,41 @@ if 'imap.gmail.com' in mailbox_server.servername:
         cache.autosave = options.cachefile
         cache.update()
 
+# the mailbox and the label boxes are opened on pooled connections, so that
+# they do not have to log in again for every mailbox
+pool = ImapServerPool.from_server(mailbox_server, maxsize=2)
 
 for mailbox_name in args[2:]:
-    mailbox =  ImapMailbox((mailbox_server.clone(), mailbox_name))
-    print("\n\nProcessing mailbox %s" % mailbox.name)
-    encrypted = mailbox.search('UNDELETED HEADER Content-Type encrypted')
-    for uid in encrypted:
-        print("    Decrypting UID %s" % uid)
-        message = mailbox[uid]
-        labels = [mailbox_name] # all the mailboxes the mail appears (for gmail)
-        if options.backup is not None:
-            print("        Backing up the original (encrypted) message")
-            backupbox.add(message)
-        print("        Deleting the original (encrypted) message")
-        if is_gmail_box(mailbox):
-            labels = cache.get_labels("%s.%s" % (mailbox_name, uid))
-            delete(mailbox, uid)
-        else:
-            mailbox.discard(uid)
-        print("        Piping message through decryption program")
-        try:
-            message = pipe_message(message, decryptprogram)
-        except:
-            # the decryption program sometimes stalls. This try-except block
-            # allows to use Ctrl+C to get out of processing this specific mail
-            pass
-        print("        Done")
-        for labelbox_name in labels:
-            # this can be done more efficiently once we are able to find the UID
-            # of a message that was just uploaded to the mailbox
-            labelbox = ImapMailbox((mailbox_server.clone(), labelbox_name))
-            print("        Putting decrypted text into mailbox %s" % labelbox_name)
-            labelbox.add(message)
-            labelbox.close()
-    mailbox.close()
+    with pool.mailbox(mailbox_name) as mailbox:
+        print("\n\nProcessing mailbox %s" % mailbox.name)
+        encrypted = mailbox.search('UNDELETED HEADER Content-Type encrypted')
+        for uid in encrypted:
+            print("    Decrypting UID %s" % uid)
+            message = mailbox[uid]
+            labels = [mailbox_name] # all the mailboxes the mail appears (for gmail)
+            if options.backup is not None:
+                print("        Backing up the original (encrypted) message")
+                backupbox.add(message)
+            print("        Deleting the original (encrypted) message")
+            if is_gmail_box(mailbox):
+                labels = cache.get_labels("%s.%s" % (mailbox_name, uid))
+                delete(mailbox, uid)
+            else:
+                mailbox.discard(uid)
+            print("        Piping message through decryption program")
+            try:
+                message = pipe_message(message, decryptprogram)
+            except:
+                # the decryption program sometimes stalls. This try-except block
+                # allows to use Ctrl+C to get out of processing this specific mail
+                pass
+            print("        Done")
+            for labelbox_name in labels:
+                # this can be done more efficiently once we are able to find the UID
+                # of a message that was just uploaded to the mailbox
+                with pool.mailbox(labelbox_name) as labelbox:
+                    print("        Putting decrypted text into mailbox %s"
+                          % labelbox_name)
+                    labelbox.add(message)
+pool.close()
 sys.exit(0)
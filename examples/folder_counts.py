@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+"""
+This example shows how to process all the folders of an IMAP account in
+parallel: it prints the number of messages and the number of unseen messages
+in every folder on the server.
+"""
+import sys
+
+from ProcImap.Utils.CLI import ProcImapOptParser
+from ProcImap.Utils.Account import FolderExecutor, failed, print_progress
+
+opt = ProcImapOptParser()
+opt.usage = '%prog [options] SERVER [FOLDERS]'
+opt.add_option('--workers', dest='workers', type='int', default=4,
+               help='number of folders processed at once')
+(options, args) = opt.parse_args(args=sys.argv)
+
+if len(args) < 2:
+    opt.print_usage()
+    sys.exit(1)
+
+
+def folder_counts(mailbox):
+    """ Return number of messages and of unseen messages in the mailbox """
+    return (len(mailbox), len(mailbox.get_unseen_uids()))
+
+
+pool = options.profile.get_pool(args[1], maxsize=options.workers)
+executor = FolderExecutor(pool, workers=options.workers, readonly=True,
+                          progress=print_progress)
+folders = None
+if len(args) > 2:
+    folders = args[2:]
+results = executor.run(folder_counts, folders)
+pool.close()
+
+print("")
+for result in results:
+    if result.ok:
+        print("%-40s %6d messages %6d unseen" % (result.name, result.value[0],
+                                                 result.value[1]))
+for result in failed(results):
+    print("%-40s %s" % (result.name, result.error))
+sys.exit(len(failed(results)) > 0)
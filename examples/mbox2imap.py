@@ -4,9 +4,8 @@
 
 from ProcImap.ImapMailbox import ImapMailbox
 from ProcImap.ImapServer import ImapServer
-from ProcImap.ImapMailbox import ImapNotOkError
+from ProcImap.ImapMailbox import ImapNotOkError, APPEND_BATCH_SIZE
 import sys
-import time
 import mailbox
 from email.utils import make_msgid
 
@@ -29,26 +28,55 @@ frombox.lock()
 tobox.lock()
 
 
-i = 1
+def prepared_messages(frombox):
+    """ Generate the messages in frombox, adding missing Message-Ids """
+    i = 1
+    for message in frombox:
+        print("%s" % i)
+        if message['Message-Id'] is None:
+            print("   WARNING: message has no message-id (mesage ID will be added)")
+            message.add_header("Message-Id", make_msgid('katamon.mbox2imap') )
+        yield message
+        i = i + 1
+
+def batches(messages, size):
+    """ Generate lists of at most size messages from the iterable messages """
+    batch = []
+    for message in messages:
+        batch.append(message)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
 print("Processing mbox file %s with %s messages" % (fromboxname, len(frombox)))
-for message in frombox:
-    print("%s" % i)
-    if message['Message-Id'] is None:
-        print("   WARNING: message has no message-id (mesage ID will be added)")
-        message.add_header("Message-Id", make_msgid('katamon.mbox2imap') )
-    if True:
+uids = []   # UIDs of the uploaded messages (None if the server doesn't say)
+failed = 0  # number of messages that could not be uploaded
+for batch in batches(prepared_messages(frombox), APPEND_BATCH_SIZE):
+    # a failed batch is retried once after reconnecting. Note that without
+    # MULTIAPPEND, some messages of a failed batch may already have been
+    # added, so they may end up in the mailbox twice
+    for attempt in (1, 2):
         try:
-            tobox.add(message)
-        except ImapNotOkError:
-            print("   ERROR: Transaction failed for message %s" % i)
-            toserver.reconnect()
-            tobox = ImapMailbox((toserver, toboxname))
-            time.sleep(5)
-        time.sleep(1)
-        number_in_tobox = len(tobox.get_all_uids())
-        #time.sleep(1)
-        print("    Added Message, %s in mailbox" % number_in_tobox)
-    i = i + 1
+            uids.extend(tobox.add_many(batch))
+            break
+        except ImapNotOkError as data:
+            print("   ERROR: Transaction failed: %s" % data)
+            try:
+                tobox.reconnect()
+            except Exception as data:
+                print("   ERROR: Reconnect failed: %s" % data)
+    else:
+        print("   ERROR: Skipping %s messages" % len(batch))
+        failed += len(batch)
+    print("    Added %s messages so far" % len(uids))
+
+print("Added %s messages, %s in mailbox" % (len(uids), len(tobox)))
+if failed > 0:
+    print("%s messages could not be added" % failed)
+print("UIDs of the added messages: %s"
+      % ", ".join([str(uid) for uid in uids if uid is not None]))
 
 frombox.close()
 tobox.close()
@@ -111,12 +111,14 @@ for uid in unread_mails.keys():
 
 # notify as necessary
 if len(unseen) > 0:
+    new_uids = [uid for uid in unseen if uid not in unread_mails]
+    new_fields = inbox.get_headers(new_uids, "From Subject Content-Type")
     for uid in unseen:
         if uid in unread_mails:
             if (int(time()) - unread_mails[uid][0]) > notifytimeout:
                 notify()
-        else:
-            fields = inbox.get_fields(uid, "From Subject Content-Type")
+        elif uid in new_fields:
+            fields = new_fields[uid]
             from_address = fields['From']
             subject = fields['Subject']
             encoding = fields.get_content_charset()
@@ -15,14 +15,20 @@ server = mailboxes.get_server('Gmail')
 mailbox = ImapMailbox((server, sys.argv[2]))
 backupsource = mbox(sys.argv[1], factory=ImapMessage)
 
-for message in backupsource:
-    if "X-ProcImap-Imapflags" in message:
-        message.flags_from_string(message["X-ProcImap-Imapflags"])
-        del message["X-ProcImap-Imapflags"]
-    if "X-ProcImap-ImapInternalDate" in message:
-        message.internaldate_from_string(message["X-ProcImap-ImapInternalDate"])
-        del message["X-ProcImap-ImapInternalDate"]
-    mailbox.add(message)
+def restored_messages(backupsource):
+    """ Generate the messages in backupsource, with the imap flags and
+        internal date restored from the headers added by backup_mailbox.py
+    """
+    for message in backupsource:
+        if "X-ProcImap-Imapflags" in message:
+            message.flags_from_string(message["X-ProcImap-Imapflags"])
+            del message["X-ProcImap-Imapflags"]
+        if "X-ProcImap-ImapInternalDate" in message:
+            message.internaldate_from_string(message["X-ProcImap-ImapInternalDate"])
+            del message["X-ProcImap-ImapInternalDate"]
+        yield message
+
+mailbox.add_many(restored_messages(backupsource))
 
 mailbox.close()
 backupsource.close()
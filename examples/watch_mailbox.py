@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+"""
+    This example shows how to get notified of changes to an IMAP mailbox as
+    they happen, instead of polling the server on a timer. It prints a line
+    for every new, expunged, or re-flagged message.
+"""
+import sys
+
+from ProcImap.Utils.MailboxFactory import MailboxFactory
+from ProcImap.ImapEvents import NewMessageEvent, ExpungeEvent, FlagsEvent
+
+# usage: watch_mailbox.py mailbox
+
+mailboxes = MailboxFactory('/home/goerz/.procimap/mailboxes.cfg')
+mailbox = mailboxes[sys.argv[1]]
+
+try:
+    for event in mailbox.watch():
+        if isinstance(event, NewMessageEvent):
+            print("New message %s from %s: %s" % (event.uid,
+                  event.message['From'], event.message['Subject']))
+        elif isinstance(event, ExpungeEvent):
+            print("Message %s was expunged" % event.uid)
+        elif isinstance(event, FlagsEvent):
+            print("Message %s is now flagged %s" % (event.uid,
+                  " ".join(event.flags)))
+except KeyboardInterrupt:
+    pass
+
+mailbox.close()
+sys.exit(0)
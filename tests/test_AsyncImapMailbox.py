@@ -0,0 +1,81 @@
+############################################################################
+#    Copyright (C) 2008 by Michael Goerz                                   #
+#    http://www.physik.fu-berlin.de/~goerz                                 #
+#                                                                          #
+#    This program is free software; you can redistribute it and#or modify  #
+#    it under the terms of the GNU General Public License as published by  #
+#    the Free Software Foundation; either version 3 of the License, or     #
+#    (at your option) any later version.                                   #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU General Public License     #
+#    along with this program; if not, write to the                         #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+############################################################################
+
+""" Tests for ProcImap.AsyncImapMailbox, run against an AsyncImapServer
+    whose commands are recorded instead of being sent.
+    Requires Python 3.5 or later.
+"""
+
+import asyncio
+import unittest
+
+from ProcImap.AsyncImapServer import AsyncImapServer, _Response
+from ProcImap.AsyncImapMailbox import AsyncImapMailbox
+
+
+class RecordingServer(AsyncImapServer):
+    """ An AsyncImapServer that records its commands and answers all of
+        them with OK
+    """
+    def __init__(self, capabilities=()):
+        AsyncImapServer.__init__(self, 'localhost', 'user', 'secret')
+        self.capabilities = list(capabilities)
+        self.mailboxname = 'INBOX'
+        self.commands = []
+
+    async def command(self, name, *args):
+        self.commands.append((name,) + args)
+        response = _Response()
+        response.code = 'OK'
+        return response
+
+
+class CopyMoveTest(unittest.TestCase):
+
+    def run_coroutine(self, coroutine):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def test_copy_quotes_target(self):
+        server = RecordingServer()
+        mailbox = AsyncImapMailbox((server, 'INBOX'))
+        self.run_coroutine(mailbox.copy_many([1, 2, 3], 'Sent Items'))
+        self.assertEqual(server.commands,
+                         [('UID', 'copy', '1:3', '"Sent Items"')])
+
+    def test_move_quotes_target(self):
+        server = RecordingServer(['MOVE'])
+        mailbox = AsyncImapMailbox((server, 'INBOX'))
+        self.run_coroutine(mailbox.move_many([5], '[Gmail]/All Mail'))
+        self.assertEqual(server.commands,
+                         [('UID', 'move', '5', '"[Gmail]/All Mail"')])
+
+    def test_atom_target_is_not_quoted(self):
+        server = RecordingServer()
+        mailbox = AsyncImapMailbox((server, 'INBOX'))
+        self.run_coroutine(mailbox.copy_many([7], 'Archive'))
+        self.assertEqual(server.commands, [('UID', 'copy', '7', 'Archive')])
+
+
+if __name__ == '__main__':
+    unittest.main()
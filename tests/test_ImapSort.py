@@ -0,0 +1,111 @@
+############################################################################
+#    Copyright (C) 2008 by Michael Goerz                                   #
+#    http://www.physik.fu-berlin.de/~goerz                                 #
+#                                                                          #
+#    This program is free software; you can redistribute it and#or modify  #
+#    it under the terms of the GNU General Public License as published by  #
+#    the Free Software Foundation; either version 3 of the License, or     #
+#    (at your option) any later version.                                   #
+#                                                                          #
+#    This program is distributed in the hope that it will be useful,       #
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of        #
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+#    GNU General Public License for more details.                          #
+#                                                                          #
+#    You should have received a copy of the GNU General Public License     #
+#    along with this program; if not, write to the                         #
+#    Free Software Foundation, Inc.,                                       #
+#    59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.             #
+############################################################################
+
+""" Tests for the local sorting and threading of ImapMailbox, which is
+    used if the server does not support the SORT and THREAD extensions
+"""
+
+import email
+import unittest
+
+from ProcImap.ImapMailbox import ImapMailbox
+from ProcImap.ImapServer import ImapServer
+from ProcImap.ImapSequenceSet import expand_sequence_set
+
+
+MESSAGES = { # uid => (header, internal date, size)
+    1: (b'Subject: b\r\nMessage-ID: <1@x>\r\n\r\n',
+        '02-Jan-2020 10:00:00 +0000', 300),
+    2: (b'Subject: a\r\nMessage-ID: <2@x>\r\nReferences: <1@x>\r\n\r\n',
+        '01-Jan-2020 10:00:00 +0000', 100),
+    3: (b'Subject: a\r\nMessage-ID: <3@x>\r\n\r\n',
+        '03-Jan-2020 10:00:00 +0000', 200),
+}
+
+
+class FakeServer(ImapServer):
+    """ An ImapServer without SORT and THREAD, which answers UID SEARCH
+        and UID FETCH from MESSAGES without a connection
+    """
+    def __init__(self):
+        self.mailboxname = None
+        self.uidvalidity = 1
+        self.exists = None
+        self.uids = None
+        self.capabilities = ()
+
+    def select(self, mailbox='INBOX', create=True):
+        self.mailboxname = mailbox
+
+    def has_capability(self, capability):
+        return False
+
+    def has_uid_async(self):
+        return False
+
+    def uid(self, command, *args):
+        if command == 'search':
+            return ('OK', [b' '.join([str(uid).encode('ascii')
+                                      for uid in sorted(MESSAGES)])])
+        if command != 'fetch':
+            return ('BAD', [b'unexpected command'])
+        section = args[1].split('[')[1].split(']')[0]
+        data = []
+        for uid in expand_sequence_set(args[0]):
+            (header, internaldate, size) = MESSAGES[uid]
+            text = ('%s (UID %s FLAGS () INTERNALDATE "%s" RFC822.SIZE %s '
+                    'BODY[%s] {%s}' % (uid, uid, internaldate, size,
+                                       section, len(header)))
+            data.append((text.encode('ascii'), header))
+            data.append(b')')
+        return ('OK', data)
+
+
+def to_email_message(message):
+    """ A custom factory that returns plain email.message.Message objects,
+        without internaldate and size
+    """
+    return email.message_from_string(message.as_string())
+
+
+class LocalSortTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mailbox = ImapMailbox((FakeServer(), 'INBOX'),
+                                   factory=to_email_message)
+
+    def test_sort_with_custom_factory(self):
+        self.assertEqual(self.mailbox.sort('SUBJECT REVERSE SIZE'),
+                         [3, 2, 1])
+        self.assertEqual(self.mailbox.sort('SUBJECT ARRIVAL'), [2, 3, 1])
+
+    def test_thread_with_custom_factory(self):
+        self.assertEqual(self.mailbox.thread('REFERENCES'), [[1, 2], [3]])
+        self.assertEqual(self.mailbox.thread('ORDEREDSUBJECT'),
+                         [[2, 3], [1]])
+
+    def test_get_headers_applies_factory(self):
+        headers = self.mailbox.get_headers([1, 2])
+        self.assertFalse(hasattr(headers[1], 'internaldate'))
+        self.assertEqual(headers[2]['Subject'], 'a')
+
+
+if __name__ == '__main__':
+    unittest.main()